@@ -9,6 +9,10 @@ interface DiveApiService {
     @GET("api/dive/sites")
     suspend fun getAllSites(): Response<List<DiveSite>>
 
+    // Tutti i siti con ultima lettura e alert aperti in una richiesta; 304 se l'ETag non è cambiato
+    @GET("api/dive/overview")
+    suspend fun getOverview(@Header("If-None-Match") etag: String? = null): Response<List<SiteOverview>>
+
     @GET("api/dive/sites/{siteId}/current")
     suspend fun getCurrentConditions(@Path("siteId") siteId: String): Response<SensorData>
 
@@ -25,6 +25,20 @@ data class SensorData(
     @SerializedName("battery_level") val batteryLevel: Double
 )
 
+data class SiteOverview(
+    @SerializedName("site_id") val siteId: String,
+    @SerializedName("name") val name: String,
+    @SerializedName("latitude") val latitude: Double,
+    @SerializedName("longitude") val longitude: Double,
+    @SerializedName("depth_category") val depthCategory: String,
+    @SerializedName("status") val status: String,
+    @SerializedName("last_update") val lastUpdate: String?,
+    @SerializedName("current") val current: SensorData?,
+    @SerializedName("active_alerts") val activeAlerts: Int
+) {
+    fun toDiveSite() = DiveSite(siteId, name, latitude, longitude, depthCategory, status, lastUpdate ?: "")
+}
+
 data class Alert(
     @SerializedName("type") val type: String,
     @SerializedName("level") val level: String, // warning, critical
@@ -8,6 +8,28 @@ import retrofit2.Response
 
 class DiveRepository(private val apiService: DiveApiService) {
 
+    // Ultima panoramica ricevuta e il suo ETag: un poll senza cambiamenti riceve 304 senza body
+    private var overviewEtag: String? = null
+    private var overviewCache: List<SiteOverview>? = null
+
+    fun getOverview(): Flow<Result<List<SiteOverview>>> = flow {
+        try {
+            val cached = overviewCache
+            val response = apiService.getOverview(if (cached != null) overviewEtag else null)
+            if (response.code() == 304 && cached != null) {
+                emit(Result.success(cached))
+            } else if (response.isSuccessful && response.body() != null) {
+                overviewEtag = response.headers()["ETag"]
+                overviewCache = response.body()
+                emit(Result.success(response.body()!!))
+            } else {
+                emit(Result.failure(Exception("Errore API: ${response.code()}")))
+            }
+        } catch (e: Exception) {
+            emit(Result.failure(e))
+        }
+    }
+
     fun getAllSites(): Flow<Result<List<DiveSite>>> = flow {
         try {
             val response = apiService.getAllSites()
@@ -29,62 +29,23 @@ class DashboardViewModel : ViewModel() {
             _uiState.value = _uiState.value.copy(isLoading = true, error = null)
 
             try {
-                // Try to load real data from API
-                repository.getAllSites().collect { result ->
+                // Una sola richiesta per siti, condizioni attuali e stato (API Python)
+                repository.getOverview().collect { result ->
                     result.fold(
-                        onSuccess = { sites ->
+                        onSuccess = { overview ->
                             _uiState.value = _uiState.value.copy(
-                                sites = sites,
+                                sites = overview.map { it.toDiveSite() },
+                                currentConditions = overview.mapNotNull { site ->
+                                    site.current?.let { site.siteId to it }
+                                }.toMap(),
                                 isLoading = false,
                                 mqttConnected = true,
                                 databaseConnected = true
                             )
-
-                            // Load current conditions for each site
-                            loadCurrentConditions(sites.map { it.siteId })
                         },
-                        onFailure = { error ->
-                            // If API fails, use mock data as fallback
-                            val mockSites = listOf(
-                                DiveSite(
-                                    siteId = "capo_vaticano",
-                                    name = "Capo Vaticano",
-                                    latitude = 38.6878,
-                                    longitude = 15.8742,
-                                    depthCategory = "shallow",
-                                    status = "online",
-                                    lastUpdate = "2025-05-30T12:34:56Z"
-                                ),
-                                DiveSite(
-                                    siteId = "tropea_reef",
-                                    name = "Tropea Reef",
-                                    latitude = 38.6767,
-                                    longitude = 15.8989,
-                                    depthCategory = "deep",
-                                    status = "warning",
-                                    lastUpdate = "2025-05-30T12:30:15Z"
-                                ),
-                                DiveSite(
-                                    siteId = "stromboli_east",
-                                    name = "Stromboli East",
-                                    latitude = 38.7891,
-                                    longitude = 15.2134,
-                                    depthCategory = "surface",
-                                    status = "online",
-                                    lastUpdate = "2025-05-30T12:35:22Z"
-                                )
-                            )
-
-                            _uiState.value = _uiState.value.copy(
-                                sites = mockSites,
-                                isLoading = false,
-                                error = "Usando dati offline - Controlla connessione: ${error.message}",
-                                mqttConnected = false,
-                                databaseConnected = false
-                            )
-
-                            // Load mock current conditions
-                            loadMockCurrentConditions()
+                        onFailure = {
+                            // Backend senza /overview (Node-RED): una richiesta per sito
+                            loadSitesAndConditions()
                         }
                     )
                 }
@@ -103,6 +64,67 @@ class DashboardViewModel : ViewModel() {
         }
     }
 
+    private suspend fun loadSitesAndConditions() {
+        repository.getAllSites().collect { result ->
+            result.fold(
+                onSuccess = { sites ->
+                    _uiState.value = _uiState.value.copy(
+                        sites = sites,
+                        isLoading = false,
+                        mqttConnected = true,
+                        databaseConnected = true
+                    )
+
+                    // Load current conditions for each site
+                    loadCurrentConditions(sites.map { it.siteId })
+                },
+                onFailure = { error ->
+                    // If API fails, use mock data as fallback
+                    val mockSites = listOf(
+                        DiveSite(
+                            siteId = "capo_vaticano",
+                            name = "Capo Vaticano",
+                            latitude = 38.6878,
+                            longitude = 15.8742,
+                            depthCategory = "shallow",
+                            status = "online",
+                            lastUpdate = "2025-05-30T12:34:56Z"
+                        ),
+                        DiveSite(
+                            siteId = "tropea_reef",
+                            name = "Tropea Reef",
+                            latitude = 38.6767,
+                            longitude = 15.8989,
+                            depthCategory = "deep",
+                            status = "warning",
+                            lastUpdate = "2025-05-30T12:30:15Z"
+                        ),
+                        DiveSite(
+                            siteId = "stromboli_east",
+                            name = "Stromboli East",
+                            latitude = 38.7891,
+                            longitude = 15.2134,
+                            depthCategory = "surface",
+                            status = "online",
+                            lastUpdate = "2025-05-30T12:35:22Z"
+                        )
+                    )
+
+                    _uiState.value = _uiState.value.copy(
+                        sites = mockSites,
+                        isLoading = false,
+                        error = "Usando dati offline - Controlla connessione: ${error.message}",
+                        mqttConnected = false,
+                        databaseConnected = false
+                    )
+
+                    // Load mock current conditions
+                    loadMockCurrentConditions()
+                }
+            )
+        }
+    }
+
     private fun loadCurrentConditions(siteIds: List<String>) {
         viewModelScope.launch {
             val currentConditions = mutableMapOf<String, SensorData>()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Alert Engine
+Regole di soglia condivise, valutazione con stato (isteresi e durata minima)
+e store indicizzato degli alert attivi
+"""
+
+from datetime import datetime, timezone
+import json
+import threading
+import time
+
+from sensor_codec import decode_payload
+
+
+class AlertRule:
+    """Soglia su un campo della lettura"""
+
+    def __init__(self, alert_type, field, direction, threshold, level, message, unit="",
+                 hysteresis=0.0, min_duration=0.0, clear_duration=0.0, critical_threshold=None):
+        self.type = alert_type
+        self.field = field
+        self.direction = direction          # "below" o "above"
+        self.threshold = threshold
+        self.level = level
+        self.message = message
+        self.unit = unit
+        self.hysteresis = hysteresis        # margine oltre la soglia per chiudere l'alert
+        self.min_duration = min_duration    # secondi di condizione continua prima di aprire
+        self.clear_duration = clear_duration
+        self.critical_threshold = critical_threshold
+
+    def is_triggered(self, value):
+        if self.direction == "below":
+            return value < self.threshold
+        return value > self.threshold
+
+    def is_cleared(self, value):
+        if self.direction == "below":
+            return value >= self.threshold + self.hysteresis
+        return value <= self.threshold - self.hysteresis
+
+    def level_for(self, value):
+        if self.critical_threshold is not None:
+            beyond = value < self.critical_threshold if self.direction == "below" else value > self.critical_threshold
+            if beyond:
+                return "critical"
+        return self.level
+
+
+# Tabella unica delle soglie (simulatore, engine e API)
+ALERT_RULES = [
+    AlertRule("temperature", "temperature", "below", 12.0, "critical", "Temperatura critica", "°C",
+              hysteresis=0.5, min_duration=60, clear_duration=60),
+    AlertRule("current", "current_speed", "above", 1.5, "warning", "Corrente forte", "m/s",
+              hysteresis=0.2, min_duration=60, clear_duration=120),
+    AlertRule("visibility", "visibility", "below", 5.0, "warning", "Scarsa visibilità", "m",
+              hysteresis=1.0, min_duration=60, clear_duration=120),
+    AlertRule("battery", "battery_level", "below", 20.0, "warning", "Batteria scarica", "%",
+              hysteresis=2.0, critical_threshold=10.0),
+]
+
+
+def evaluate_rules(data, rules=ALERT_RULES):
+    """Valutazione senza stato di una lettura (una voce per soglia superata)"""
+    alerts = []
+    for rule in rules:
+        value = data.get(rule.field)
+        if isinstance(value, (int, float)) and rule.is_triggered(value):
+            alerts.append({
+                "type": rule.type,
+                "level": rule.level_for(value),
+                "message": rule.message,
+                "value": value,
+                "threshold": rule.threshold
+            })
+    return alerts
+
+
+def iso_utc(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class AlertState:
+    """Stato di una regola per un sensore: pending → open → clearing → (chiuso)"""
+    __slots__ = ("status", "since", "level", "alert")
+
+    def __init__(self, status, since):
+        self.status = status
+        self.since = since
+        self.level = None
+        self.alert = None
+
+
+class ActiveAlertStore:
+    """Alert aperti indicizzati per chiave e per sito, con lista completa pre-calcolata"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.alerts = {}          # (site_id, sensor_id, type) -> alert
+        self.by_site = {}         # site_id -> {chiave: alert}
+        self.snapshot = []        # lista servita da /alerts/active
+        self.version = 0
+
+    def put(self, key, alert):
+        with self.lock:
+            self.alerts[key] = alert
+            self.by_site.setdefault(key[0], {})[key] = alert
+            self._changed()
+
+    def remove(self, key):
+        with self.lock:
+            if self.alerts.pop(key, None) is None:
+                return
+            site_alerts = self.by_site[key[0]]
+            del site_alerts[key]
+            if not site_alerts:
+                del self.by_site[key[0]]
+            self._changed()
+
+    def _changed(self):
+        self.snapshot = list(self.alerts.values())
+        self.version += 1
+
+    def active(self):
+        return self.snapshot
+
+    def for_site(self, site_id):
+        with self.lock:
+            return list(self.by_site.get(site_id, {}).values())
+
+    def count_for_site(self, site_id):
+        return len(self.by_site.get(site_id, ()))
+
+
+class AlertEngine:
+    """Valuta ogni lettura e pubblica solo le transizioni di stato"""
+
+    def __init__(self, rules=ALERT_RULES):
+        self.rules = rules
+        self.states = {}          # solo le chiavi non in stato normale
+        self.store = ActiveAlertStore()
+        self.lock = threading.Lock()
+
+    def subscriptions(self):
+        return [
+            ("dive/+/sensors/data", self.on_sensor_message),
+            ("dive/+/sensors/bin", self.on_sensor_message),
+        ]
+
+    def on_sensor_message(self, client, userdata, msg):
+        try:
+            data = decode_payload(msg.payload)
+        except ValueError:
+            return
+        if not isinstance(data, dict) or "site_id" not in data:
+            return
+
+        for alert in self.process(data):
+            client.publish(f"dive/{alert['site_id']}/alerts", json.dumps(alert))
+
+    def process(self, data, now=None):
+        """Aggiorna gli stati con una lettura, ritorna le transizioni da pubblicare"""
+        now = now or time.time()
+        site_id = data["site_id"]
+        sensor_id = data.get("sensor_id", "unknown")
+        transitions = []
+
+        with self.lock:
+            for rule in self.rules:
+                value = data.get(rule.field)
+                if not isinstance(value, (int, float)):
+                    continue
+
+                key = (site_id, sensor_id, rule.type)
+                state = self.states.get(key)
+                triggered = rule.is_triggered(value)
+
+                if state is None:
+                    if not triggered:
+                        continue
+                    state = self.states[key] = AlertState("pending", now)
+
+                if state.status == "pending":
+                    if not triggered:
+                        del self.states[key]
+                    elif now - state.since >= rule.min_duration:
+                        transitions.append(self._open(key, state, rule, data, value, now))
+
+                elif state.status == "open":
+                    if rule.is_cleared(value):
+                        state.status, state.since = "clearing", now
+                    elif triggered and rule.level_for(value) != state.level:
+                        transitions.append(self._update(key, state, rule, value, now))
+
+                if state.status == "clearing":
+                    if not rule.is_cleared(value):
+                        state.status = "open"
+                    elif now - state.since >= rule.clear_duration:
+                        transitions.append(self._clear(key, state, value, now))
+
+        return transitions
+
+    def _open(self, key, state, rule, data, value, now):
+        state.status = "open"
+        state.level = rule.level_for(value)
+        state.alert = {
+            "type": rule.type,
+            "level": state.level,
+            "message": f"{rule.message}: {value}{rule.unit}",
+            "value": value,
+            "threshold": rule.threshold,
+            "site_id": key[0],
+            "sensor_id": key[1],
+            "depth": data.get("depth"),
+            "timestamp": iso_utc(now),
+            "opened_at": iso_utc(now),
+            "state": "open"
+        }
+        self.store.put(key, state.alert)
+        return state.alert
+
+    def _update(self, key, state, rule, value, now):
+        state.level = rule.level_for(value)
+        state.alert = dict(state.alert, level=state.level, value=value,
+                           message=f"{rule.message}: {value}{rule.unit}",
+                           timestamp=iso_utc(now), state="updated")
+        self.store.put(key, state.alert)
+        return state.alert
+
+    def _clear(self, key, state, value, now):
+        del self.states[key]
+        self.store.remove(key)
+        return dict(state.alert, value=value, timestamp=iso_utc(now), state="cleared")
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - API Server Python
+Endpoint REST: stato attuale e alert attivi da tabelle in memoria alimentate da MQTT,
+storico da InfluxDB con downsampling lato server e cache dei risultati
+"""
+
+import paho.mqtt.client as mqtt
+from influxdb_client import InfluxDBClient
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from collections import OrderedDict
+from datetime import datetime, timezone
+import argparse
+import hashlib
+import json
+import numpy as np
+import re
+import threading
+import time
+
+from database_init import (INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, RETENTION_TIERS,
+                           available_tiers, choose_tier, window_mean_flux)
+from dive_schema import DIVE_CONDITIONS
+from flux_reader import FluxReader, iso_times
+from latest_state import LatestStateStore
+from alert_engine import AlertEngine
+
+API_PORT = 8080
+
+# Downsampling: la finestra più fine che restituisce al massimo MAX_HISTORY_POINTS per serie
+MAX_HISTORY_POINTS = 300
+MAX_HISTORY_HOURS = 24 * 365
+HISTORY_RESOLUTIONS = [
+    ("1m", 60),
+    ("5m", 300),
+    ("15m", 900),
+    ("30m", 1800),
+    ("1h", 3600),
+    ("3h", 10800),
+    ("6h", 21600),
+    ("12h", 43200),
+    ("1d", 86400),
+]
+
+SITE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_\-]+$")
+SENSOR_FIELDS = list(DIVE_CONDITIONS.fields)
+HISTORY_COLUMNS = ["_time", "site_id", "sensor_id", "depth"] + SENSOR_FIELDS
+
+
+def choose_resolution(hours, max_points=MAX_HISTORY_POINTS):
+    """Sceglie la finestra di aggregateWindow in base all'intervallo richiesto"""
+    span = hours * 3600
+    for name, seconds in HISTORY_RESOLUTIONS:
+        if span / seconds <= max_points:
+            return name, seconds
+    return HISTORY_RESOLUTIONS[-1]
+
+
+class TTLCache:
+    """Cache LRU con scadenza per voce, sicura tra thread"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class APIError(Exception):
+    """Errore restituito al client nel formato documentato in API.md"""
+
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+class HistoryService:
+    def __init__(self, client, cache=None, tiers=RETENTION_TIERS[:1]):
+        self.reader = FluxReader(client.query_api(), INFLUXDB_ORG)
+        self.cache = cache or TTLCache()
+        self.tiers = tiers
+
+    def history(self, site_id, hours=24, resolution=None, depth=None):
+        """Storico aggregato di un sito, dalla cache se ancora valido"""
+        if resolution is None:
+            resolution = choose_resolution(hours)
+        window, window_seconds = resolution
+
+        key = (site_id, hours, window, depth)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Livello di retention più aggregato che basta per la finestra richiesta
+        bucket = choose_tier(hours * 3600, window_seconds, self.tiers).bucket
+        rows = self.query_history(site_id, hours, window, depth, bucket)
+
+        # Un bucket aggregato cambia al più una volta per finestra
+        self.cache.put(key, rows, ttl=min(max(window_seconds / 2, 5), 300))
+        return rows
+
+    def query_history(self, site_id, hours, window, depth=None, bucket=RETENTION_TIERS[0].bucket):
+        depth_filter = f'\n          |> filter(fn: (r) => r["depth"] == "{depth}")' if depth else ""
+        query = window_mean_flux(f'''
+        from(bucket: "{bucket}")
+          |> range(start: -{hours}h)
+          |> filter(fn: (r) => r["_measurement"] == "dive_conditions")
+          |> filter(fn: (r) => r["site_id"] == "{site_id}"){depth_filter}
+        ''', window)
+        # CSV in streaming decodificato per colonna, una riga per istante e sensore
+        columns = self.reader.columns(query, columns=HISTORY_COLUMNS, pivot=True)
+        return self.format_rows(columns)
+
+    @staticmethod
+    def format_rows(columns):
+        """Righe nel formato SensorData usato dall'app, ordinate per timestamp"""
+        if not columns:
+            return []
+        order = np.argsort(columns["_time"], kind="stable")
+        count = len(order)
+        keys = ["timestamp", "site_id", "sensor_id", "depth"] + SENSOR_FIELDS
+        values = [iso_times(columns["_time"][order])]
+        for tag in ("site_id", "sensor_id", "depth"):
+            values.append(columns[tag][order].tolist() if tag in columns else [None] * count)
+        for field in SENSOR_FIELDS:
+            if field not in columns:
+                values.append([None] * count)
+                continue
+            column = columns[field][order].astype(np.float64)
+            if field == "current_direction":
+                rounded = [None if v != v else int(v) for v in (np.round(column) % 360).tolist()]
+            else:
+                rounded = [None if v != v else v for v in np.round(column, 2).tolist()]
+            values.append(rounded)
+        return [dict(zip(keys, row)) for row in zip(*values)]
+
+
+class OverviewService:
+    """/api/dive/overview serializzata una volta per versione: un poll invariato costa un confronto"""
+
+    def __init__(self, state_store, alert_store):
+        self.state_store = state_store
+        self.alert_store = alert_store
+        self.lock = threading.Lock()
+        self.key = None
+        self.body = None
+        self.etag = None
+
+    def snapshot(self):
+        """(body JSON, ETag) della panoramica; ricostruita solo se stato, alert o status dei siti cambiano"""
+        now = time.time()
+        key = (self.state_store.version, self.alert_store.version, self.state_store.statuses(now))
+        with self.lock:
+            if key != self.key:
+                payload = self.state_store.overview(self.alert_store.count_for_site, now)
+                self.body = json.dumps(payload).encode()
+                # Hash del contenuto, non delle versioni: resta valido dopo un riavvio del server
+                self.etag = f'"{hashlib.sha1(self.body).hexdigest()[:20]}"'
+                self.key = key
+            return self.body, self.etag
+
+
+def etag_matches(header, etag):
+    """If-None-Match: lista di ETag (anche deboli, W/"...") oppure *"""
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or any(value.removeprefix("W/") == etag for value in candidates)
+
+
+class DiveAPIHandler(BaseHTTPRequestHandler):
+    """Router minimale: (metodo, regex del path, nome handler)"""
+
+    routes = [
+        ("GET", re.compile(r"^/api/dive/sites$"), "get_sites"),
+        ("GET", re.compile(r"^/api/dive/overview$"), "get_overview"),
+        ("GET", re.compile(r"^/api/dive/sites/(?P<site_id>[^/]+)/current$"), "get_current"),
+        ("GET", re.compile(r"^/api/dive/sites/(?P<site_id>[^/]+)/history$"), "get_history"),
+        ("GET", re.compile(r"^/api/dive/sites/(?P<site_id>[^/]+)/alerts$"), "get_site_alerts"),
+        ("GET", re.compile(r"^/api/dive/alerts/active$"), "get_active_alerts"),
+    ]
+
+    # Iniettati da create_server()
+    history_service = None
+    overview_service = None
+    state_store = None
+    alert_engine = None
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_cors_headers()
+        self.end_headers()
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        try:
+            for route_method, pattern, handler in self.routes:
+                match = pattern.match(url.path)
+                if route_method == method and match:
+                    getattr(self, handler)(query, **match.groupdict())
+                    return
+            raise APIError(404, "NOT_FOUND", f"Endpoint '{url.path}' not found")
+        except APIError as e:
+            self.send_error_json(e.status, e.code, e.message)
+        except Exception as e:
+            print(f"❌ Errore {method} {url.path}: {e}")
+            self.send_error_json(503, "SERVICE_UNAVAILABLE", str(e))
+
+    def get_sites(self, query):
+        self.send_json(200, self.state_store.sites())
+
+    def get_overview(self, query):
+        body, etag = self.overview_service.snapshot()
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(self.headers.get("If-None-Match"), etag):
+            self.send_response(304)
+            self.send_cors_headers()
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+        self.send_body(200, body, headers)
+
+    def get_current(self, query, site_id):
+        if not self.state_store.has_site(site_id):
+            raise APIError(404, "SITE_NOT_FOUND", f"Site '{site_id}' not found")
+
+        reading = self.state_store.current(site_id, query.get("depth"))
+        if reading is None:
+            raise APIError(404, "NO_DATA", f"Nessuna lettura recente per '{site_id}'")
+        self.send_json(200, reading)
+
+    def get_active_alerts(self, query):
+        self.send_json(200, self.alert_engine.store.active())
+
+    def get_site_alerts(self, query, site_id):
+        if not self.state_store.has_site(site_id):
+            raise APIError(404, "SITE_NOT_FOUND", f"Site '{site_id}' not found")
+        self.send_json(200, self.alert_engine.store.for_site(site_id))
+
+    def get_history(self, query, site_id):
+        if not SITE_ID_PATTERN.match(site_id):
+            raise APIError(400, "INVALID_SITE_ID", f"Site '{site_id}' non valido")
+
+        try:
+            hours = int(query.get("hours", 24))
+        except ValueError:
+            raise APIError(400, "INVALID_PARAMETER", "hours deve essere un intero")
+        if not 1 <= hours <= MAX_HISTORY_HOURS:
+            raise APIError(400, "INVALID_PARAMETER", f"hours deve essere tra 1 e {MAX_HISTORY_HOURS}")
+
+        resolution = None
+        if "interval" in query:
+            resolution = next((r for r in HISTORY_RESOLUTIONS if r[0] == query["interval"]), None)
+            if resolution is None:
+                valid = ", ".join(name for name, _ in HISTORY_RESOLUTIONS)
+                raise APIError(400, "INVALID_PARAMETER", f"interval deve essere uno tra: {valid}")
+
+        depth = query.get("depth")
+        if depth is not None and not SITE_ID_PATTERN.match(depth):
+            raise APIError(400, "INVALID_PARAMETER", f"depth '{depth}' non valido")
+
+        self.send_json(200, self.history_service.history(site_id, hours, resolution, depth))
+
+    def send_cors_headers(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "If-None-Match")
+        self.send_header("Access-Control-Expose-Headers", "ETag")
+
+    def send_json(self, status, payload, headers=None):
+        self.send_body(status, json.dumps(payload).encode(), headers)
+
+    def send_body(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_cors_headers()
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, code, message):
+        self.send_json(status, {
+            "error": {
+                "code": code,
+                "message": message,
+                "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+            }
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mqtt_consumers(consumers, host="localhost", port=1883, client_id="dive_api_server"):
+    """Un solo client MQTT: ogni consumer registra i propri topic e callback"""
+    callbacks = {}
+    for consumer in consumers:
+        for topic, callback in consumer.subscriptions():
+            callbacks.setdefault(topic, []).append(callback)
+    client = mqtt.Client(client_id=client_id)
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            print(f"✅ Connesso al broker MQTT {host}:{port}")
+            for topic in callbacks:
+                client.subscribe(topic)
+        else:
+            print(f"❌ Errore connessione MQTT: {rc}")
+
+    def fan_out(handlers):
+        # paho accetta una sola callback per filtro: più consumer sullo stesso topic
+        def on_message(client, userdata, msg):
+            for handler in handlers:
+                handler(client, userdata, msg)
+        return on_message
+
+    client.on_connect = on_connect
+    for topic, handlers in callbacks.items():
+        client.message_callback_add(topic, handlers[0] if len(handlers) == 1 else fan_out(handlers))
+
+    # Connessione asincrona: l'API parte anche se il broker non è ancora disponibile
+    client.connect_async(host, port, 60)
+    client.loop_start()
+    return client
+
+
+def create_server(host="0.0.0.0", port=API_PORT, mqtt_host="localhost", mqtt_port=1883):
+    """Crea il server HTTP con i servizi condivisi tra le richieste"""
+    client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
+    state_store = LatestStateStore()
+    alert_engine = AlertEngine()
+
+    try:
+        state_store.load_from_influx(client.query_api())
+    except Exception as e:
+        print(f"⚠️ Avvio a freddo da InfluxDB non riuscito: {e}")
+
+    try:
+        tiers = available_tiers(client)
+    except Exception as e:
+        print(f"⚠️ Livelli di retention non verificabili, uso solo i dati grezzi: {e}")
+        tiers = RETENTION_TIERS[:1]
+    print(f"🗂️ Storico da: {', '.join(tier.bucket for tier in tiers)}")
+
+    DiveAPIHandler.history_service = HistoryService(client, tiers=tiers)
+    DiveAPIHandler.overview_service = OverviewService(state_store, alert_engine.store)
+    DiveAPIHandler.state_store = state_store
+    DiveAPIHandler.alert_engine = alert_engine
+
+    server = ThreadingHTTPServer((host, port), DiveAPIHandler)
+    server.daemon_threads = True
+    server.influx_client = client
+    server.mqtt_client = start_mqtt_consumers([state_store, alert_engine], mqtt_host, mqtt_port)
+    return server
+
+
+def main():
+    print("🌐 Smart Dive Site Controller - API Server")
+    print("=" * 60)
+
+    parser = argparse.ArgumentParser(description="API REST Python per Smart Dive Controller")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--mqtt-host", default="localhost", help="Broker MQTT")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.mqtt_host, args.mqtt_port)
+    print(f"✅ API in ascolto su http://{args.host}:{args.port}")
+    print("   Premi Ctrl+C per fermare\n")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Server interrotto dall'utente")
+    finally:
+        server.server_close()
+        server.mqtt_client.loop_stop()
+        server.mqtt_client.disconnect()
+        server.influx_client.close()
+        print("✅ API Server chiuso")
+
+
+if __name__ == "__main__":
+    main()
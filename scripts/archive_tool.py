@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Archive Tool
+Esporta dive_conditions da InfluxDB in file Parquet compressi (uno per sito e giorno)
+e li reimporta con scritture parallele; l'export riprende dal manifest dei chunk
+"""
+
+from influxdb_client import InfluxDBClient, WritePrecision
+from bulk_loader import BulkLoader, print_load_report
+from database_init import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET
+from dive_schema import DIVE_CONDITIONS
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow serve solo per questo strumento
+    pa = pq = None
+
+MEASUREMENT = DIVE_CONDITIONS.name
+TAGS = [tag for tag in DIVE_CONDITIONS.tags if tag != "site_id"]
+FIELDS = list(DIVE_CONDITIONS.fields.items())
+
+MANIFEST_NAME = "manifest.json"
+
+
+def archive_schema():
+    return pa.schema(
+        [("time", pa.timestamp("ns", tz="UTC")), ("site_id", pa.string())]
+        + [(tag, pa.string()) for tag in TAGS]
+        + [(name, pa.int64() if kind == "int" else pa.float64()) for name, kind in FIELDS]
+    )
+
+
+def day_range(start, stop):
+    """Giorni UTC [start, stop) come date"""
+    day = start.date()
+    while datetime.combine(day, datetime.min.time(), timezone.utc) < stop:
+        yield day
+        day += timedelta(days=1)
+
+
+def rfc3339(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class ChunkManifest:
+    """Stato dei chunk esportati, salvato dopo ogni chunk per poter riprendere"""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.lock = threading.Lock()
+        self.chunks = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.chunks = json.load(f).get("chunks", {})
+
+    def is_done(self, key, directory):
+        entry = self.chunks.get(key)
+        if entry is None:
+            return False
+        return entry["rows"] == 0 or os.path.exists(os.path.join(directory, entry["file"]))
+
+    def mark_done(self, key, entry):
+        with self.lock:
+            self.chunks[key] = entry
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"measurement": MEASUREMENT, "chunks": self.chunks}, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+class ArchiveExporter:
+    def __init__(self, directory, workers=4, compression="zstd", bucket=INFLUXDB_BUCKET):
+        if pa is None:
+            raise ImportError("pyarrow non installato: pip install pyarrow")
+        self.directory = directory
+        self.workers = workers
+        self.compression = compression
+        self.bucket = bucket
+        self.schema = archive_schema()
+        self.client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG,
+                                     enable_gzip=True, connection_pool_maxsize=workers, timeout=300_000)
+        self.query_api = self.client.query_api()
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = ChunkManifest(directory)
+        self.rows = 0
+        self.bytes = 0
+        self.stats_lock = threading.Lock()
+
+    def site_ids(self, start):
+        query = f'''
+        import "influxdata/influxdb/schema"
+        schema.tagValues(bucket: "{self.bucket}", tag: "site_id", start: {rfc3339(start)},
+                         predicate: (r) => r["_measurement"] == "{MEASUREMENT}")
+        '''
+        tables = self.query_api.query(org=INFLUXDB_ORG, query=query)
+        return sorted(record.get_value() for table in tables for record in table.records)
+
+    def chunk_query(self, site_id, day):
+        start = datetime.combine(day, datetime.min.time(), timezone.utc)
+        keep = ", ".join(f'"{column}"' for column in ["_time"] + TAGS + [name for name, _ in FIELDS])
+        return f'''
+        from(bucket: "{self.bucket}")
+          |> range(start: {rfc3339(start)}, stop: {rfc3339(start + timedelta(days=1))})
+          |> filter(fn: (r) => r["_measurement"] == "{MEASUREMENT}" and r["site_id"] == "{site_id}")
+          |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+          |> keep(columns: [{keep}])
+          |> group()
+        '''
+
+    def fetch_columns(self, site_id, day):
+        """Risultato CSV letto in streaming direttamente in colonne (niente FluxRecord)"""
+        names = ["_time"] + TAGS + [name for name, _ in FIELDS]
+        columns = {name: [] for name in names}
+        index = missing = None
+        for row in self.query_api.query_csv(self.chunk_query(site_id, day), org=INFLUXDB_ORG):
+            if not row or not any(row) or row[0].startswith("#"):
+                continue
+            if "_time" in row:
+                # Intestazione (ripetuta per ogni tabella)
+                index = [(name, row.index(name)) for name in names if name in row]
+                missing = [name for name in names if name not in row]
+                continue
+            if index is None:
+                continue
+            for name, position in index:
+                columns[name].append(row[position])
+            for name in missing:
+                columns[name].append("")
+        return columns
+
+    def to_table(self, site_id, columns):
+        arrays = [
+            pa.array(columns["_time"]).cast(pa.timestamp("ns", tz="UTC")),
+            pa.array([site_id] * len(columns["_time"])),
+        ]
+        arrays += [pa.array([value or None for value in columns[tag]]) for tag in TAGS]
+        for name, kind in FIELDS:
+            convert = int if kind == "int" else float
+            arrays.append(pa.array([convert(value) if value else None for value in columns[name]],
+                                   type=pa.int64() if kind == "int" else pa.float64()))
+        return pa.Table.from_arrays(arrays, schema=self.schema).sort_by("time")
+
+    def export_chunk(self, site_id, day):
+        columns = self.fetch_columns(site_id, day)
+        rows = len(columns["_time"])
+        relative = os.path.join(site_id, f"{day.isoformat()}.parquet")
+        size = 0
+        if rows:
+            path = os.path.join(self.directory, relative)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            compression = None if self.compression == "none" else self.compression
+            pq.write_table(self.to_table(site_id, columns), tmp_path, compression=compression)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+
+        # Un giorno non ancora concluso viene riesportato alla prossima esecuzione
+        day_end = datetime.combine(day + timedelta(days=1), datetime.min.time(), timezone.utc)
+        if day_end <= datetime.now(timezone.utc):
+            self.manifest.mark_done(f"{site_id}/{day.isoformat()}", {"file": relative, "rows": rows, "bytes": size})
+        with self.stats_lock:
+            self.rows += rows
+            self.bytes += size
+        return rows
+
+    def export(self, start, stop, sites=None):
+        sites = sites or self.site_ids(start)
+        chunks = [(site_id, day) for site_id in sites for day in day_range(start, stop)]
+        pending = [(site_id, day) for site_id, day in chunks
+                   if not self.manifest.is_done(f"{site_id}/{day.isoformat()}", self.directory)]
+        print(f"📦 {len(sites)} siti x {len(chunks) // max(len(sites), 1)} giorni = {len(chunks)} chunk "
+              f"({len(chunks) - len(pending)} già esportati)")
+
+        started = time.monotonic()
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.export_chunk, site_id, day): (site_id, day) for site_id, day in pending}
+            for done, future in enumerate(as_completed(futures), start=1):
+                site_id, day = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"   ❌ {site_id} {day}: {e}")
+                if done % 50 == 0 or done == len(futures):
+                    elapsed = max(time.monotonic() - started, 1e-9)
+                    print(f"   📈 {done}/{len(futures)} chunk | {self.rows} righe ({self.rows / elapsed:.0f}/s) | "
+                          f"{self.bytes / 1e6:.1f} MB")
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(f"✅ Export: {self.rows} righe in {elapsed:.1f}s ({self.rows / elapsed:.0f} righe/s), "
+              f"{self.bytes / 1e6:.1f} MB, {failed} chunk falliti (rilanciare per riprendere)")
+        return failed == 0
+
+    def close(self):
+        self.client.close()
+
+
+def batch_to_lines(batch, encoder=DIVE_CONDITIONS.encoder("ns")):
+    """RecordBatch Arrow → righe line protocol (precisione ns); i campi nulli sono omessi"""
+    def column(name):
+        return batch.column(batch.schema.get_field_index(name))
+
+    # La colonna time passa da int64: to_pylist su timestamp ns richiede pandas
+    times = column("time").cast(pa.int64()).to_pylist()
+    tags = {tag: column(tag).to_pylist() for tag in ["site_id"] + TAGS}
+    return encoder.encode_columns(tags, {name: column(name).to_pylist() for name, _ in FIELDS}, times)
+
+
+def archive_files(directory, sites=None):
+    files = []
+    for site_id in sorted(os.listdir(directory)):
+        site_dir = os.path.join(directory, site_id)
+        if not os.path.isdir(site_dir) or (sites and site_id not in sites):
+            continue
+        files += [os.path.join(site_dir, name) for name in sorted(os.listdir(site_dir)) if name.endswith(".parquet")]
+    return files
+
+
+def import_archive(directory, sites=None, workers=4, batch_size=5000, bucket=INFLUXDB_BUCKET):
+    """Legge i file in parallelo e scrive tramite BulkLoader (coda limitata: memoria costante)"""
+    if pa is None:
+        raise ImportError("pyarrow non installato: pip install pyarrow")
+    files = archive_files(directory, sites)
+    total_bytes = sum(os.path.getsize(path) for path in files)
+    print(f"📥 Import di {len(files)} file ({total_bytes / 1e6:.1f} MB) in {bucket}")
+
+    loader = BulkLoader(
+        url=INFLUXDB_URL,
+        token=INFLUXDB_TOKEN,
+        org=INFLUXDB_ORG,
+        bucket=bucket,
+        batch_size=batch_size,
+        workers=workers,
+        max_inflight=workers * 2,
+        precision=WritePrecision.NS
+    )
+
+    def load_file(path):
+        for record_batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            lines = batch_to_lines(record_batch)
+            if lines:
+                loader.submit(lines)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for path, future in zip(files, [pool.submit(load_file, path) for path in files]):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"   ❌ {path}: {e}")
+        loader.flush()
+    finally:
+        loader.close()
+
+    stats = loader.stats
+    print_load_report(stats)
+    print(f"   Archivio letto a {total_bytes / 1e6 / stats.elapsed:.1f} MB/s")
+    return stats.failed_batches == 0
+
+
+def parse_day(value):
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+def main():
+    print("🗄️ Smart Dive Site Controller - Archive Tool")
+    print("=" * 60)
+
+    parser = argparse.ArgumentParser(description="Export/import di dive_conditions in archivio Parquet")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Esporta da InfluxDB (riprende dal manifest)")
+    export.add_argument("directory", help="Cartella dell'archivio")
+    export.add_argument("--start", type=parse_day, help="Primo giorno (default: oggi - --days)")
+    export.add_argument("--stop", type=parse_day, help="Fine esclusa (default: ora)")
+    export.add_argument("--days", type=int, default=30, help="Giorni da esportare se --start non è indicato")
+    export.add_argument("--sites", help="Siti separati da virgola (default: tutti)")
+    export.add_argument("--workers", type=int, default=4, help="Query in parallelo")
+    export.add_argument("--compression", default="zstd", choices=["zstd", "snappy", "gzip", "none"])
+
+    restore = commands.add_parser("import", help="Reimporta un archivio in InfluxDB")
+    restore.add_argument("directory")
+    restore.add_argument("--sites", help="Siti separati da virgola (default: tutti)")
+    restore.add_argument("--bucket", default=INFLUXDB_BUCKET)
+    restore.add_argument("--workers", type=int, default=4, help="Lettori e writer in parallelo")
+    restore.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    sites = args.sites.split(",") if args.sites else None
+    try:
+        if args.command == "export":
+            stop = args.stop or datetime.now(timezone.utc)
+            start = args.start or (stop - timedelta(days=args.days)).replace(hour=0, minute=0, second=0, microsecond=0)
+            exporter = ArchiveExporter(args.directory, workers=args.workers, compression=args.compression)
+            try:
+                exporter.export(start, stop, sites)
+            finally:
+                exporter.close()
+        else:
+            import_archive(args.directory, sites=sites, workers=args.workers, batch_size=args.batch_size,
+                           bucket=args.bucket)
+    except KeyboardInterrupt:
+        print("\n🛑 Interrotto dall'utente (l'export riprende dal manifest)")
+    except Exception as e:
+        print(f"❌ Errore: {e}")
+        print("💡 Verifica che Docker sia avviato e InfluxDB sia accessibile")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,65 +5,177 @@ Simula i dati di un sensore Arduino subacqueo realistico
 """
 
 import paho.mqtt.client as mqtt
+import argparse
 import json
 import time
-import random
 import math
-from datetime import datetime
 import threading
 import sys
 import os
 
+import metrics
+from edge_aggregator import EDGE_FIELDS, EdgeAggregator, FidelityTracker
+from mqtt_connection import CONNECT_TIMEOUT, KEEPALIVE, ConnectionManager
+from offline_buffer import CATCH_UP_RATE, BATCH_RECORDS, OfflineForwarder, RingBuffer, RingBufferError
+from sensor_codec import BINARY_TOPIC, encode_sensor_data
+from sim_clock import VirtualClock, WallClock, sensor_rng
+
+PAYLOAD_FORMATS = ["json", "binary"]
+
+# Profili di pubblicazione:
+#   full      - record completo + un topic per campo (comportamento storico)
+#   aggregate - solo il record completo su sensors/data
+#   delta     - record completo + topic per-campo solo se il valore supera la deadband
+PUBLISH_PROFILES = ["full", "aggregate", "delta"]
+
+# Topic per-campo: (suffisso, campi del record)
+FIELD_TOPICS = [
+    ("sensors/temperature", ("temperature",)),
+    ("sensors/current", ("current_speed", "current_direction")),
+    ("sensors/visibility", ("visibility",)),
+    ("sensors/luminosity", ("luminosity",)),
+    ("status/battery", ("battery_level",)),
+]
+
+DEFAULT_DEADBANDS = {
+    "temperature": 0.2,
+    "current_speed": 0.1,
+    "current_direction": 10,
+    "visibility": 0.5,
+    "luminosity": 50.0,
+    "battery_level": 1.0,
+}
+
+# Metriche condivise da tutti i simulatori del processo (serie risolte una volta sola)
+PUBLISHED = metrics.counter("dive_sim_published_total", "Messaggi MQTT pubblicati dal simulatore", ["kind"])
+PUBLISHED_RECORD = PUBLISHED.labels("record")
+PUBLISHED_FIELD = PUBLISHED.labels("field")
+PUBLISH_SECONDS = metrics.histogram("dive_sim_publish_seconds",
+                                    "Durata di publish() del record principale (accodamento nel client MQTT)")
+DISCONNECTS = metrics.counter("dive_sim_disconnects_total", "Disconnessioni dal broker MQTT")
+BUFFERED = metrics.counter("dive_sim_buffered_total", "Letture salvate nel buffer offline durante una disconnessione")
+BUFFER_DEPTH = metrics.gauge("dive_sim_offline_buffer_records", "Letture nel buffer offline in attesa di recupero")
+
+# Modelli legati al tempo dell'orologio (reale o virtuale), non al numero di letture
+TIDE_PERIOD = 12.42 * 3600          # marea semidiurna lunare, secondi
+BATTERY_DRAIN_PER_HOUR = 0.96       # % all'ora (0.008 ogni 30s)
+
+# Probabilità di evento casuale (meteo, spostamento, manutenzione) ogni 30 secondi di simulazione
+EVENT_PROBABILITY = 0.1
+EVENT_PERIOD = 30.0
+
+
+def parse_deadband(spec):
+    """Interpreta una deadband da riga di comando: "campo=valore" """
+    field, _, value = spec.partition("=")
+    if field not in DEFAULT_DEADBANDS or not value:
+        raise argparse.ArgumentTypeError(f"Deadband non valida: {spec} (campi: {', '.join(DEFAULT_DEADBANDS)})")
+    return field, float(value)
+
 class DiveSensorSimulator:
-    def __init__(self, site_id="capo_vaticano", sensor_id="sensor_01", mqtt_host="localhost", mqtt_port=1883):
+    def __init__(self, site_id="capo_vaticano", sensor_id="sensor_01", mqtt_host="localhost", mqtt_port=1883,
+                 depth="shallow", mqtt_client=None, verbose=True, payload_format="json",
+                 publish_profile="full", deadbands=None, clock=None, seed=None, edge_window=None,
+                 offline_buffer=None, catch_up_rate=CATCH_UP_RATE, catch_up_batch=BATCH_RECORDS,
+                 keepalive=KEEPALIVE):
         self.site_id = site_id
         self.sensor_id = sensor_id
         self.mqtt_host = mqtt_host
         self.mqtt_port = mqtt_port
+        self.verbose = verbose
+        self.payload_format = payload_format
+        self.publish_profile = publish_profile
+        self.deadbands = dict(DEFAULT_DEADBANDS, **(deadbands or {}))
+        self.last_published = {}
+        self.last_message = None        # MQTTMessageInfo dell'ultimo record pubblicato
+        # Modalità edge: campionamento veloce, riepilogo ogni edge_window secondi, eccezioni subito
+        self.edge = EdgeAggregator(self.deadbands, edge_window) if edge_window else None
+        
+        # Orologio e stream casuale del sensore (riproducibile se seed è impostato)
+        self.clock = clock or WallClock()
+        self.rng = sensor_rng(seed, site_id, sensor_id)
+        self.last_reading_at = None
         
         # Stato sensore
-        self.depth = "shallow"
+        self.depth = depth
         self.battery_level = 100.0
         self.is_running = False
         
         # Pattern realistici
         self.base_temperature = 18.0
         self.tide_cycle = 0
-        self.weather_pattern = random.choice(["calm", "stormy", "changing"])
+        self.weather_pattern = self.rng.choice(["calm", "stormy", "changing"])
+        
+        # Setup MQTT (in modalità flotta il client è condiviso e gestito dall'esterno)
+        self.connection = None
+        if mqtt_client is None:
+            # Client id stabile e unico per sensore: la sessione persistente sopravvive ai riavvii
+            self.connection = ConnectionManager(f"dive_simulator_{site_id}_{sensor_id}", mqtt_host, mqtt_port,
+                                                keepalive=keepalive, on_connect=self.on_mqtt_connect,
+                                                on_disconnect=self.on_mqtt_disconnect)
+            self.mqtt_client = self.connection.client
+        else:
+            self.mqtt_client = mqtt_client
+        
+        # Store-and-forward: senza broker le letture vanno nel ring buffer, recuperate alla riconnessione
+        self.forwarder = None
+        if offline_buffer is not None:
+            self.forwarder = OfflineForwarder(self.mqtt_client, offline_buffer, site_id,
+                                              rate=catch_up_rate, batch_records=catch_up_batch, rng=self.rng)
+            BUFFER_DEPTH.set_function(lambda: len(offline_buffer))
         
-        # Setup MQTT
-        self.mqtt_client = mqtt.Client(client_id=f"dive_simulator_{sensor_id}")
-        self.mqtt_client.on_connect = self.on_mqtt_connect
-        self.mqtt_client.on_disconnect = self.on_mqtt_disconnect
+        if not verbose:
+            return
         
         print(f"🤖 Inizializzazione simulatore Arduino")
         print(f"   Site: {site_id}")
         print(f"   Sensor: {sensor_id}")
         print(f"   Depth: {self.depth}")
         print(f"   Weather: {self.weather_pattern}")
+        print(f"   Format: {payload_format}, profilo {publish_profile}")
+        if self.edge:
+            print(f"   Edge: riepilogo ogni {edge_window:g}s, invio immediato su deadband/soglie")
     
     def on_mqtt_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print(f"✅ Connesso a MQTT broker {self.mqtt_host}:{self.mqtt_port}")
+            if self.forwarder:
+                pending = len(self.forwarder.buffer)
+                if pending:
+                    print(f"💾 {pending} letture nel buffer offline: recupero a {self.forwarder.rate:g} letture/s")
+                self.forwarder.on_connect()
         else:
             print(f"❌ Errore connessione MQTT: {rc}")
     
     def on_mqtt_disconnect(self, client, userdata, rc):
+        DISCONNECTS.inc()
+        if self.forwarder:
+            self.forwarder.on_disconnect()
         print(f"🔌 Disconnesso da MQTT broker")
     
     def connect_mqtt(self):
-        """Connette al broker MQTT"""
-        try:
-            self.mqtt_client.connect(self.mqtt_host, self.mqtt_port, 60)
-            self.mqtt_client.loop_start()
+        """Connette al broker MQTT; le riconnessioni seguono il backoff del ConnectionManager"""
+        if self.connection is None:
+            # Client iniettato: connessione e ciclo di rete sono di chi lo possiede
+            if self.forwarder:
+                if self.mqtt_client.is_connected():
+                    self.forwarder.on_connect()
+                self.forwarder.start()
+            return True
+        self.connection.start()
+        if self.forwarder:
+            # Con il buffer offline si parte anche senza broker
+            self.forwarder.start()
+            return True
+        if self.connection.wait_connected(CONNECT_TIMEOUT):
             return True
-        except Exception as e:
-            print(f"❌ Errore connessione MQTT: {e}")
-            return False
+        self.connection.stop()
+        print(f"❌ Errore connessione MQTT: {self.connection.last_error or 'timeout'}")
+        return False
     
     def simulate_temperature(self):
         """Simula lettura sensore temperatura DS18B20"""
-        hour = datetime.now().hour
+        hour = self.clock.local_hour()
         
         # Ciclo giornaliero temperatura
         daily_variation = 3 * math.sin(2 * math.pi * (hour - 6) / 24)
@@ -72,10 +184,10 @@ class DiveSensorSimulator:
         depth_effect = {"surface": 0, "shallow": -2, "deep": -5}[self.depth]
         
         # Effetto meteo
-        weather_effect = {"calm": 0, "stormy": -1, "changing": random.uniform(-1, 1)}[self.weather_pattern]
+        weather_effect = {"calm": 0, "stormy": -1, "changing": self.rng.uniform(-1, 1)}[self.weather_pattern]
         
         # Rumore sensore
-        noise = random.uniform(-0.1, 0.1)
+        noise = self.rng.uniform(-0.1, 0.1)
         
         temperature = self.base_temperature + daily_variation + depth_effect + weather_effect + noise
         return round(temperature, 2)
@@ -83,14 +195,14 @@ class DiveSensorSimulator:
     def simulate_current(self):
         """Simula corrente marina"""
         # Corrente base influenzata da marea
-        self.tide_cycle += 0.01
+        self.tide_cycle = 2 * math.pi * self.clock.time() / TIDE_PERIOD
         tide_current = 0.3 * math.sin(self.tide_cycle)
         
         # Corrente influenzata dal meteo
         weather_current = {
-            "calm": random.uniform(0, 0.2),
-            "stormy": random.uniform(0.5, 1.8),
-            "changing": random.uniform(0.1, 0.8)
+            "calm": self.rng.uniform(0, 0.2),
+            "stormy": self.rng.uniform(0.5, 1.8),
+            "changing": self.rng.uniform(0.1, 0.8)
         }[self.weather_pattern]
         
         # Corrente più forte in superficie
@@ -102,7 +214,7 @@ class DiveSensorSimulator:
         # Direzione corrente
         base_direction = 45
         tide_direction_change = 30 * math.sin(self.tide_cycle * 2)
-        weather_direction_change = random.uniform(-20, 20) if self.weather_pattern == "stormy" else random.uniform(-5, 5)
+        weather_direction_change = self.rng.uniform(-20, 20) if self.weather_pattern == "stormy" else self.rng.uniform(-5, 5)
         
         direction = (base_direction + tide_direction_change + weather_direction_change) % 360
         
@@ -110,7 +222,7 @@ class DiveSensorSimulator:
     
     def simulate_visibility(self):
         """Simula visibilità"""
-        hour = datetime.now().hour
+        hour = self.clock.local_hour()
         
         # Visibilità migliore durante il giorno
         daily_factor = 0.8 + 0.2 * max(0, math.sin(2 * math.pi * (hour - 6) / 24))
@@ -120,9 +232,9 @@ class DiveSensorSimulator:
         
         # Effetto meteo
         weather_factor = {
-            "calm": random.uniform(0.9, 1.1),
-            "stormy": random.uniform(0.3, 0.7),
-            "changing": random.uniform(0.6, 1.0)
+            "calm": self.rng.uniform(0.9, 1.1),
+            "stormy": self.rng.uniform(0.3, 0.7),
+            "changing": self.rng.uniform(0.6, 1.0)
         }[self.weather_pattern]
         
         visibility = base_visibility * daily_factor * weather_factor
@@ -132,7 +244,7 @@ class DiveSensorSimulator:
     
     def simulate_luminosity(self):
         """Simula luminosità"""
-        hour = datetime.now().hour
+        hour = self.clock.local_hour()
         
         # Luce solare
         solar_light = max(0, 1200 * math.sin(2 * math.pi * (hour - 6) / 24))
@@ -148,19 +260,22 @@ class DiveSensorSimulator:
         weather_factor = {
             "calm": 1.0,
             "stormy": 0.3,
-            "changing": random.uniform(0.5, 0.9)
+            "changing": self.rng.uniform(0.5, 0.9)
         }[self.weather_pattern]
         
         luminosity = solar_light * depth_attenuation * weather_factor
         
         if self.depth == "deep":
-            luminosity += random.uniform(0, 5)
+            luminosity += self.rng.uniform(0, 5)
         
         return round(max(0, luminosity), 1)
     
     def simulate_battery(self):
         """Simula livello batteria"""
-        consumption_rate = 0.008
+        now = self.clock.time()
+        elapsed_hours = (now - self.last_reading_at) / 3600 if self.last_reading_at is not None else 0
+        self.last_reading_at = now
+        consumption_rate = BATTERY_DRAIN_PER_HOUR * elapsed_hours
         
         if self.weather_pattern == "stormy":
             consumption_rate *= 1.5
@@ -170,7 +285,7 @@ class DiveSensorSimulator:
     
     def read_all_sensors(self):
         """Simula lettura completa sensori"""
-        timestamp = datetime.now().isoformat()
+        timestamp = self.clock.now().isoformat().replace("+00:00", "Z")
         
         temperature = self.simulate_temperature()
         current_speed, current_direction = self.simulate_current()
@@ -194,111 +309,115 @@ class DiveSensorSimulator:
         
         return sensor_data
     
-    def check_alerts(self, data):
-        """Controlla alert"""
-        alerts = []
-        
-        if data["temperature"] < 12:
-            alerts.append({
-                "type": "temperature",
-                "level": "critical",
-                "message": "Temperatura critica",
-                "value": data["temperature"],
-                "threshold": 12
-            })
-        
-        if data["current_speed"] > 1.5:
-            alerts.append({
-                "type": "current",
-                "level": "warning", 
-                "message": "Corrente forte",
-                "value": data["current_speed"],
-                "threshold": 1.5
-            })
-        
-        if data["visibility"] < 5:
-            alerts.append({
-                "type": "visibility",
-                "level": "warning",
-                "message": "Scarsa visibilità",
-                "value": data["visibility"],
-                "threshold": 5
-            })
-        
-        if data["battery_level"] < 20:
-            alerts.append({
-                "type": "battery",
-                "level": "critical" if data["battery_level"] < 10 else "warning",
-                "message": "Batteria scarica",
-                "value": data["battery_level"],
-                "threshold": 20
-            })
-        
-        return alerts
+    def field_topics(self, data):
+        """Topic per-campo e relativi payload"""
+        return {
+            f"dive/{self.site_id}/{suffix}": (
+                data[fields[0]] if len(fields) == 1
+                else {key: data[field] for key, field in zip(("speed", "direction"), fields)}
+            )
+            for suffix, fields in FIELD_TOPICS
+        }
+    
+    def changed_field_topics(self, data):
+        """Profilo delta: solo i topic con almeno un campo oltre la deadband"""
+        changed = {}
+        topics = self.field_topics(data)
+        for (suffix, fields), (topic, payload) in zip(FIELD_TOPICS, topics.items()):
+            values = tuple(data[field] for field in fields)
+            last = self.last_published.get(suffix)
+            if last is None or any(abs(value - previous) > self.deadbands.get(field, 0)
+                                   for field, value, previous in zip(fields, values, last)):
+                self.last_published[suffix] = values
+                changed[topic] = payload
+        return changed
+    
+    def buffer_offline(self, data):
+        """Lettura nel buffer offline (binario v1, timestamp originale)"""
+        self.forwarder.store(encode_sensor_data(data))
+        BUFFERED.inc()
     
     def publish_data(self, data):
-        """Pubblica dati su MQTT"""
-        # Topic principale
-        main_topic = f"dive/{self.site_id}/sensors/data"
-        self.mqtt_client.publish(main_topic, json.dumps(data))
-        
-        # Topic separati
-        topics = {
-            f"dive/{self.site_id}/sensors/temperature": data["temperature"],
-            f"dive/{self.site_id}/sensors/current": {
-                "speed": data["current_speed"],
-                "direction": data["current_direction"]
-            },
-            f"dive/{self.site_id}/sensors/visibility": data["visibility"],
-            f"dive/{self.site_id}/sensors/luminosity": data["luminosity"],
-            f"dive/{self.site_id}/status/battery": data["battery_level"]
-        }
+        """Pubblica dati su MQTT, ritorna il numero di messaggi inviati"""
+        if self.forwarder and not self.forwarder.connected.is_set():
+            self.buffer_offline(data)
+            return 0
+        
+        if self.payload_format == "binary":
+            # Un solo messaggio compatto: niente topic per-campo
+            payload = encode_sensor_data(data)
+            started = time.perf_counter()
+            self.last_message = self.mqtt_client.publish(BINARY_TOPIC.format(site_id=self.site_id), payload)
+            PUBLISH_SECONDS.observe(time.perf_counter() - started)
+            topics = {}
+        else:
+            # Topic principale
+            main_topic = f"dive/{self.site_id}/sensors/data"
+            payload = json.dumps(data)
+            started = time.perf_counter()
+            self.last_message = self.mqtt_client.publish(main_topic, payload)
+            PUBLISH_SECONDS.observe(time.perf_counter() - started)
+            
+            # Topic separati secondo il profilo di pubblicazione
+            if self.publish_profile == "full":
+                topics = self.field_topics(data)
+            elif self.publish_profile == "delta":
+                topics = self.changed_field_topics(data)
+            else:
+                topics = {}
+        
+        if self.forwarder and self.last_message.rc != mqtt.MQTT_ERR_SUCCESS:
+            # Connessione persa tra il controllo e la publish
+            self.buffer_offline(data)
+            return 0
         
         for topic, payload in topics.items():
             self.mqtt_client.publish(topic, json.dumps(payload))
+        PUBLISHED_RECORD.inc()
+        if topics:
+            PUBLISHED_FIELD.inc(len(topics))
         
-        # Pubblica alert
-        alerts = self.check_alerts(data)
-        if alerts:
-            alert_topic = f"dive/{self.site_id}/alerts"
-            for alert in alerts:
-                alert["timestamp"] = data["timestamp"]
-                alert["site_id"] = self.site_id
-                self.mqtt_client.publish(alert_topic, json.dumps(alert))
+        return 1 + len(topics)
     
     def run_simulation(self, interval=30):
-        """Avvia simulazione"""
+        """Avvia simulazione (in modalità edge `interval` è il periodo di campionamento)"""
         if not self.connect_mqtt():
             return
         
         self.is_running = True
         print(f"\n🚀 Avvio simulazione (intervallo: {interval}s)")
         print("   Premi Ctrl+C per fermare\n")
+        event_probability = EVENT_PROBABILITY * interval / EVENT_PERIOD
         
         try:
             while self.is_running:
                 sensor_data = self.read_all_sensors()
-                self.publish_data(sensor_data)
-                
-                # Log dei dati
-                print(f"📊 {sensor_data['timestamp'][:19]} | "
-                      f"T:{sensor_data['temperature']:5.1f}°C | "
-                      f"C:{sensor_data['current_speed']:4.1f}m/s@{sensor_data['current_direction']:3d}° | "
-                      f"V:{sensor_data['visibility']:5.1f}m | "
-                      f"L:{sensor_data['luminosity']:6.1f}lux | "
-                      f"B:{sensor_data['battery_level']:5.1f}%")
+                if self.edge:
+                    sensor_data = self.edge.process(sensor_data, self.clock.time())
+                if sensor_data:
+                    self.publish_data(sensor_data)
+                    self.log_reading(sensor_data)
                 
                 # Eventi casuali
-                if random.random() < 0.1:
+                if self.rng.random() < event_probability:
                     self.simulate_random_event()
                 
-                time.sleep(interval)
+                self.clock.sleep(interval)
                 
         except KeyboardInterrupt:
             print("\n🛑 Simulazione interrotta dall'utente")
         finally:
             self.stop_simulation()
     
+    def log_reading(self, sensor_data):
+        reason = f" [{sensor_data['reason']}]" if "reason" in sensor_data else ""
+        print(f"📊 {sensor_data['timestamp'][:19]} | "
+              f"T:{sensor_data['temperature']:5.1f}°C | "
+              f"C:{sensor_data['current_speed']:4.1f}m/s@{sensor_data['current_direction']:3d}° | "
+              f"V:{sensor_data['visibility']:5.1f}m | "
+              f"L:{sensor_data['luminosity']:6.1f}lux | "
+              f"B:{sensor_data['battery_level']:5.1f}%{reason}")
+    
     def simulate_random_event(self):
         """Eventi casuali"""
         events = [
@@ -307,40 +426,138 @@ class DiveSensorSimulator:
             ("maintenance", "Manutenzione")
         ]
         
-        event_type, description = random.choice(events)
+        event_type, description = self.rng.choice(events)
         
         if event_type == "weather_change":
             old_weather = self.weather_pattern
-            self.weather_pattern = random.choice(["calm", "stormy", "changing"])
-            print(f"🌊 {description}: {old_weather} → {self.weather_pattern}")
+            self.weather_pattern = self.rng.choice(["calm", "stormy", "changing"])
+            if self.verbose:
+                print(f"🌊 {description}: {old_weather} → {self.weather_pattern}")
         
         elif event_type == "depth_change":
             old_depth = self.depth
-            self.depth = random.choice(["surface", "shallow", "deep"])
-            print(f"📏 {description}: {old_depth} → {self.depth}")
+            self.depth = self.rng.choice(["surface", "shallow", "deep"])
+            if self.verbose:
+                print(f"📏 {description}: {old_depth} → {self.depth}")
         
         elif event_type == "maintenance":
             self.battery_level = 100.0
-            print(f"🔧 {description}: Batteria ricaricata")
+            if self.verbose:
+                print(f"🔧 {description}: Batteria ricaricata")
     
     def stop_simulation(self):
         """Ferma simulazione"""
         self.is_running = False
-        self.mqtt_client.loop_stop()
-        self.mqtt_client.disconnect()
+        if self.forwarder:
+            self.forwarder.stop()
+        if self.connection is not None:
+            self.connection.stop()
+        if self.forwarder:
+            buffer = self.forwarder.buffer
+            print(f"💾 Buffer offline: {len(buffer)} letture in coda, {self.forwarder.forwarded} recuperate, "
+                  f"{buffer.dropped} scartate (buffer pieno)")
+            buffer.close()
         print("✅ Simulazione terminata")
 
+def edge_fidelity_report(hours=24.0, window=300.0, sample_interval=1.0, interval=30, depth="surface",
+                         deadbands=None, seed="edge"):
+    """Cadenza fissa vs modalità edge sulla stessa serie campionata, in tempo virtuale"""
+    sensor = DiveSensorSimulator(site_id="edge_report", depth=depth, verbose=False,
+                                 deadbands=deadbands, clock=VirtualClock(), seed=seed)
+    edge = EdgeAggregator(sensor.deadbands, window)
+    fixed, edged = FidelityTracker(), FidelityTracker()
+    event_probability = EVENT_PROBABILITY * sample_interval / EVENT_PERIOD
+    steps = int(hours * 3600 / sample_interval)
+    every = max(1, round(interval / sample_interval))
+
+    started = time.perf_counter()
+    for step in range(steps):
+        now = sensor.clock.time()
+        truth = sensor.read_all_sensors()
+        record = truth if step % every == 0 else None
+        fixed.observe(truth, record, now, len(json.dumps(record)) if record else 0)
+        record = edge.process(truth, now)
+        edged.observe(truth, record, now, len(json.dumps(record)) if record else 0)
+        if sensor.rng.random() < event_probability:
+            sensor.simulate_random_event()
+        sensor.clock.sleep(sample_interval)
+    fixed.finish(sensor.clock.time())
+    edged.finish(sensor.clock.time())
+
+    print(f"\n📊 Fedeltà su {hours:g}h virtuali ({steps} campioni ogni {sample_interval:g}s, "
+          f"profondità {depth}, {time.perf_counter() - started:.1f}s reali)")
+    print(f"{'':24}{'cadenza ' + str(interval) + 's':>18}{'edge ' + format(window, 'g') + 's':>18}")
+    print(f"{'messaggi':24}{fixed.messages:>18}{edged.messages:>18}")
+    print(f"{'messaggi/ora':24}{fixed.messages / hours:>18.1f}{edged.messages / hours:>18.1f}")
+    print(f"{'KB JSON':24}{fixed.bytes / 1024:>18.1f}{edged.bytes / 1024:>18.1f}")
+    for field in EDGE_FIELDS:
+        print(f"{'RMSE ' + field:24}{fixed.rmse(field):>18.3f}{edged.rmse(field):>18.3f}")
+        print(f"{'  max ' + field:24}{fixed.worst[field]:>18.3f}{edged.worst[field]:>18.3f}")
+    print(f"{'episodi alert':24}{fixed.episodes:>18}{edged.episodes:>18}")
+    mean_delay = [sum(t.delays) / len(t.delays) if t.delays else 0.0 for t in (fixed, edged)]
+    max_delay = [max(t.delays, default=0.0) for t in (fixed, edged)]
+    print(f"{'ritardo medio alert (s)':24}{mean_delay[0]:>18.1f}{mean_delay[1]:>18.1f}")
+    print(f"{'ritardo max alert (s)':24}{max_delay[0]:>18.1f}{max_delay[1]:>18.1f}")
+    print(f"{'alert persi':24}{fixed.missed:>18}{edged.missed:>18}")
+    print(f"💡 Edge: {edge.published['window']} riepiloghi, {edge.published['deadband']} deadband, "
+          f"{edge.published['alert']} soglie ({1 - edged.messages / max(fixed.messages, 1):.0%} messaggi in meno)")
+    return fixed, edged
+
+
 def main():
     print("🤖 Smart Dive Site Controller - Arduino Simulator (Windows)")
     print("=" * 70)
     
-    site_id = sys.argv[1] if len(sys.argv) > 1 else "capo_vaticano"
-    depth = sys.argv[2] if len(sys.argv) > 2 else "shallow"
-    interval = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+    parser = argparse.ArgumentParser(description="Simulatore sensore Arduino")
+    parser.add_argument("site_id", nargs="?", default="capo_vaticano")
+    parser.add_argument("depth", nargs="?", default="shallow", choices=["surface", "shallow", "deep"])
+    parser.add_argument("interval", nargs="?", type=int, default=30, help="Secondi tra letture")
+    parser.add_argument("--format", default="json", choices=PAYLOAD_FORMATS,
+                        help="json (topic per-campo) o binary (un messaggio compatto)")
+    parser.add_argument("--profile", default="full", choices=PUBLISH_PROFILES,
+                        help="full (tutti i topic), aggregate (solo sensors/data), delta (campi cambiati)")
+    parser.add_argument("--deadband", type=parse_deadband, action="append", default=[],
+                        help="Deadband del profilo delta, es. temperature=0.5 (ripetibile)")
+    parser.add_argument("--seed", help="Seed per letture riproducibili")
+    parser.add_argument("--edge", type=float, metavar="SECONDI",
+                        help="Modalità edge: riepilogo ogni SECONDI, invio immediato su deadband o soglie")
+    parser.add_argument("--sample-interval", type=float, default=1.0,
+                        help="Secondi tra campioni interni in modalità edge")
+    parser.add_argument("--edge-report", type=float, metavar="ORE",
+                        help="Solo report fedeltà/messaggi edge vs cadenza fissa su ORE virtuali (niente MQTT)")
+    parser.add_argument("--offline-buffer", metavar="FILE",
+                        help="Ring buffer su file per le letture prodotte senza broker (store-and-forward)")
+    parser.add_argument("--buffer-mb", type=float, default=16, help="Capacità del buffer offline in MB")
+    parser.add_argument("--catch-up-rate", type=float, default=CATCH_UP_RATE,
+                        help="Letture/s inviate durante il recupero dopo la riconnessione")
+    parser.add_argument("--catch-up-batch", type=int, default=BATCH_RECORDS, help="Letture per messaggio batch")
+    parser.add_argument("--keepalive", type=int, default=KEEPALIVE, help="Keepalive MQTT in secondi")
+    parser.add_argument("--metrics-port", type=int,
+                        help=f"Espone /metrics Prometheus su questa porta (es. {metrics.METRICS_PORTS['simulator']})")
+    args = parser.parse_args()
+    
+    if args.edge_report:
+        edge_fidelity_report(args.edge_report, args.edge or 300.0, args.sample_interval, args.interval,
+                             args.depth, dict(args.deadband), args.seed or "edge")
+        return
+    
+    if args.metrics_port:
+        metrics.start_metrics_server(args.metrics_port)
+    
+    offline_buffer = None
+    if args.offline_buffer:
+        try:
+            offline_buffer = RingBuffer(args.offline_buffer, capacity=int(args.buffer_mb * 1024 * 1024))
+        except RingBufferError as e:
+            print(f"❌ Buffer offline non utilizzabile: {e}")
+            return
     
-    simulator = DiveSensorSimulator(site_id=site_id)
-    simulator.depth = depth
-    simulator.run_simulation(interval=interval)
+    simulator = DiveSensorSimulator(site_id=args.site_id, depth=args.depth, payload_format=args.format,
+                                    publish_profile=args.profile, deadbands=dict(args.deadband),
+                                    seed=args.seed, edge_window=args.edge, offline_buffer=offline_buffer,
+                                    catch_up_rate=args.catch_up_rate, catch_up_batch=args.catch_up_batch,
+                                    keepalive=args.keepalive)
+    simulator.run_simulation(interval=args.sample_interval if args.edge else args.interval)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
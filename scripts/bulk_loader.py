@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Bulk Loader InfluxDB
+Scrittura in streaming a memoria limitata: batch in volo limitati,
+writer concorrenti, compressione gzip e retry con backoff per batch
+"""
+
+from influxdb_client import InfluxDBClient, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.rest import ApiException
+import queue
+import random
+import threading
+import time
+
+import metrics
+
+# Stati HTTP per cui ha senso ritentare la scrittura
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+POINTS = metrics.counter("dive_loader_points_total", "Punti scritti su InfluxDB", ["bucket"])
+BATCHES = metrics.counter("dive_loader_batches_total", "Batch completati per esito", ["bucket", "result"])
+RETRIES = metrics.counter("dive_loader_retries_total", "Tentativi di scrittura ripetuti", ["bucket"])
+BATCH_SECONDS = metrics.histogram("dive_loader_batch_seconds", "Durata della scrittura di un batch, retry inclusi",
+                                  ["bucket"])
+QUEUED = metrics.gauge("dive_loader_queued_batches", "Batch in coda in attesa di un writer", ["bucket"])
+
+
+class LoaderStats:
+    """Contatori condivisi tra i writer"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.points = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.failed_points = 0
+        self.rejected_batches = 0       # sottoinsieme dei falliti: rifiutati da InfluxDB (4xx), inutile ritentare
+        self.retries = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return max(time.monotonic() - self.started_at, 1e-9)
+
+    @property
+    def points_per_s(self):
+        return self.points / self.elapsed
+
+    def as_dict(self):
+        return {
+            "points": self.points,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "failed_points": self.failed_points,
+            "rejected_batches": self.rejected_batches,
+            "retries": self.retries,
+            "elapsed_s": round(self.elapsed, 2),
+            "points_per_s": round(self.points_per_s, 1),
+        }
+
+
+class BulkLoader:
+    """Pool di writer InfluxDB alimentato da una coda limitata di batch"""
+
+    def __init__(self, url, token, org, bucket, batch_size=5000, workers=4, max_inflight=8,
+                 gzip=True, retries=5, backoff=0.5, max_backoff=30.0,
+                 precision=WritePrecision.S, on_failure=None):
+        self.org = org
+        self.bucket = bucket
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.precision = precision
+        self.on_failure = on_failure        # on_failure(batch, retryable): retryable=False per i 4xx
+
+        self.client = InfluxDBClient(
+            url=url,
+            token=token,
+            org=org,
+            enable_gzip=gzip,
+            connection_pool_maxsize=workers
+        )
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+
+        # La coda limita i batch in volo: il produttore si blocca invece di accumulare
+        self.queue = queue.Queue(maxsize=max_inflight)
+        self.stats = LoaderStats()
+        self.points_metric = POINTS.labels(bucket)
+        self.ok_metric = BATCHES.labels(bucket, "ok")
+        self.failed_metric = BATCHES.labels(bucket, "failed")
+        self.rejected_metric = BATCHES.labels(bucket, "rejected")
+        self.retries_metric = RETRIES.labels(bucket)
+        self.latency_metric = BATCH_SECONDS.labels(bucket)
+        QUEUED.labels(bucket).set_function(self.queue.qsize)
+        self.workers = [
+            threading.Thread(target=self._worker, name=f"influx_writer_{n}", daemon=True)
+            for n in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, batch, block=True, timeout=None):
+        """Accoda un batch pronto; ritorna False se la coda è piena e block=False"""
+        try:
+            self.queue.put(batch, block=block, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def load(self, records, report_every=5.0):
+        """Consuma un iterabile di record (line protocol o Point) in batch"""
+        batch = []
+        last_report = time.monotonic()
+
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.submit(batch)
+                batch = []
+
+                if report_every and time.monotonic() - last_report >= report_every:
+                    last_report = time.monotonic()
+                    print(f"   📈 {self.stats.points} punti scritti ({self.stats.points_per_s:.0f} punti/s)")
+
+        if batch:
+            self.submit(batch)
+
+        self.flush()
+        return self.stats
+
+    def flush(self):
+        """Attende che tutti i batch accodati siano scritti (o falliti)"""
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.client.close()
+
+    def _worker(self):
+        while True:
+            batch = self.queue.get()
+            try:
+                if batch is None:
+                    return
+                self._write_with_retry(batch)
+            finally:
+                self.queue.task_done()
+
+    def _write_with_retry(self, batch):
+        delay = self.backoff
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                self.write_api.write(bucket=self.bucket, org=self.org, record=batch,
+                                     write_precision=self.precision)
+                with self.stats.lock:
+                    self.stats.points += len(batch)
+                    self.stats.batches += 1
+                self.latency_metric.observe(time.perf_counter() - started)
+                self.points_metric.inc(len(batch))
+                self.ok_metric.inc()
+                return True
+            except ApiException as e:
+                error = e
+                if e.status not in RETRYABLE_STATUS:
+                    break
+            except Exception as e:
+                error = e
+
+            if attempt < self.retries:
+                with self.stats.lock:
+                    self.stats.retries += 1
+                self.retries_metric.inc()
+                # Backoff esponenziale con jitter per non sincronizzare i writer
+                time.sleep(random.uniform(0, delay))
+                delay = min(delay * 2, self.max_backoff)
+
+        # Errore di connessione o stato ritentabile: il batch può riuscire più tardi;
+        # un 4xx (400 line protocol malformato, 422 fuori retention...) fallirebbe sempre
+        retryable = not isinstance(error, ApiException) or error.status in RETRYABLE_STATUS
+        with self.stats.lock:
+            self.stats.failed_batches += 1
+            self.stats.failed_points += len(batch)
+            if not retryable:
+                self.stats.rejected_batches += 1
+        self.latency_metric.observe(time.perf_counter() - started)
+        (self.failed_metric if retryable else self.rejected_metric).inc()
+        print(f"   ❌ Batch da {len(batch)} punti {'scartato' if retryable else 'rifiutato'}: {error}")
+
+        if self.on_failure:
+            self.on_failure(batch, retryable)
+        return False
+
+
+def print_load_report(stats):
+    """Riepilogo caricamento"""
+    print(f"✅ Scritti {stats.points} punti in {stats.elapsed:.1f}s ({stats.points_per_s:.0f} punti/s)")
+    print(f"   Batch: {stats.batches} ok, {stats.failed_batches} falliti "
+          f"({stats.rejected_batches} rifiutati), {stats.retries} retry")
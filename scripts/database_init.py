@@ -4,20 +4,230 @@ Smart Dive Site Controller - InfluxDB Fix & Reset Script
 Risolve conflitti di tipo e resetta il database
 """
 
-from influxdb_client import InfluxDBClient, Point, WritePrecision
+from influxdb_client import BucketRetentionRules, InfluxDBClient
 from influxdb_client.client.write_api import SYNCHRONOUS
 from influxdb_client.client.delete_api import DeleteApi
+from metrics import METRICS_PORTS, start_metrics_server
+from bulk_loader import BulkLoader, print_load_report
+from dive_schema import DIVE_CONDITIONS, MEASUREMENTS
+from flux_reader import FluxReader
+import argparse
+import itertools
 import json
 from datetime import datetime, timedelta, timezone
 import random
 import math
 
+try:
+    import numpy as np
+except ImportError:  # NumPy serve solo per il generatore veloce
+    np = None
+
 # Configurazione InfluxDB
 INFLUXDB_URL = "http://localhost:8086"
 INFLUXDB_TOKEN = "dive-monitoring-token-2024"
 INFLUXDB_ORG = "DivingCenter"
 INFLUXDB_BUCKET = "dive_data"
 
+# Dati di esempio
+SAMPLE_SITES = ["capo_vaticano", "tropea_reef", "stromboli_east"]
+SAMPLE_DEPTHS = ["surface", "shallow", "deep"]
+DEPTH_FACTORS = {"surface": 0, "shallow": 0.3, "deep": 0.6}
+
+# Encoder dei dati di esempio (precisione secondi, come il bulk loader)
+SAMPLE_LINES = DIVE_CONDITIONS.encoder("s", decimals={
+    "temperature": 2, "current_speed": 2, "visibility": 1, "luminosity": 1, "battery_level": 1
+})
+
+
+def window_mean_flux(data, every):
+    """Medie per finestra della pipeline Flux `data`, con current_direction mediata sul cerchio
+
+    La media aritmetica di 350° e 10° darebbe 180°: per la direzione si sommano seno e coseno
+    nella finestra e si torna all'angolo con atan2. Stesse finestre e _time di aggregateWindow.
+    """
+    return f'''
+        import "math"
+
+        data = {data.strip()}
+        scalars = data
+          |> filter(fn: (r) => r["_field"] != "current_direction")
+          |> aggregateWindow(every: {every}, fn: mean, createEmpty: false)
+        direction = data
+          |> filter(fn: (r) => r["_field"] == "current_direction")
+          |> window(every: {every}, createEmpty: false)
+          |> reduce(identity: {{sin: 0.0, cos: 0.0}}, fn: (r, accumulator) => ({{
+              sin: accumulator.sin + math.sin(x: float(v: r._value) * math.pi / 180.0),
+              cos: accumulator.cos + math.cos(x: float(v: r._value) * math.pi / 180.0)
+          }}))
+          |> map(fn: (r) => {{
+              angle = math.atan2(y: r.sin, x: r.cos) * 180.0 / math.pi
+              return {{r with _time: r._stop, _value: if angle < 0.0 then angle + 360.0 else angle}}
+          }})
+          |> drop(columns: ["sin", "cos"])
+          |> window(every: inf)
+
+        union(tables: [scalars, direction])'''
+
+
+class RetentionTier:
+    """Bucket di un livello di retention; i livelli aggregati sono mantenuti da un task"""
+
+    def __init__(self, bucket, retention_days, every=None, resolution_s=0, source=None):
+        self.bucket = bucket
+        self.retention_s = retention_days * 86400      # 0 = conservazione infinita
+        self.every = every                              # finestra di aggregazione Flux
+        self.resolution_s = resolution_s                # 0 = dati grezzi
+        self.source = source
+
+    @property
+    def task_name(self):
+        return f"downsample_{self.bucket}"
+
+    def covers(self, seconds):
+        return self.retention_s == 0 or seconds <= self.retention_s
+
+    def window_end(self, moment):
+        """Fine della finestra di aggregazione che contiene `moment` (allineamento in su)"""
+        return datetime.fromtimestamp(math.ceil(moment.timestamp() / self.resolution_s) * self.resolution_s,
+                                      timezone.utc)
+
+    def downsample_flux(self, source, start, stop=None):
+        """Media per finestra da `source` verso il bucket del livello (idempotente)"""
+        stop = f", stop: {stop}" if stop else ""
+        data = f'''
+        from(bucket: "{source}")
+          |> range(start: {start}{stop})
+          |> filter(fn: (r) => r["_measurement"] == "dive_conditions")
+        '''
+        return window_mean_flux(data, self.every) + f'''
+          |> map(fn: (r) => ({{r with _value: float(v: r._value)}}))
+          |> to(bucket: "{self.bucket}", org: "{INFLUXDB_ORG}")
+        '''
+
+
+# Grezzi 7 giorni, medie a 5 minuti 90 giorni, medie orarie per sempre
+RETENTION_TIERS = [
+    RetentionTier(INFLUXDB_BUCKET, 7),
+    RetentionTier(f"{INFLUXDB_BUCKET}_5m", 90, every="5m", resolution_s=300, source=INFLUXDB_BUCKET),
+    RetentionTier(f"{INFLUXDB_BUCKET}_1h", 0, every="1h", resolution_s=3600, source=f"{INFLUXDB_BUCKET}_5m"),
+]
+
+
+def choose_tier(range_seconds, resolution_seconds=0, tiers=RETENTION_TIERS):
+    """Livello più economico che copre l'intervallo alla risoluzione richiesta
+
+    Tra i livelli che conservano ancora l'inizio dell'intervallo sceglie il più
+    aggregato non più grossolano della risoluzione; se nessuno basta, il più fine.
+    """
+    covering = [tier for tier in tiers if tier.covers(range_seconds)]
+    if not covering:
+        return max(tiers, key=lambda tier: tier.retention_s or float("inf"))
+    candidates = [tier for tier in covering if tier.resolution_s <= resolution_seconds]
+    if candidates:
+        return max(candidates, key=lambda tier: tier.resolution_s)
+    return min(covering, key=lambda tier: tier.resolution_s)
+
+
+def available_tiers(client):
+    """Livelli i cui bucket esistono (solo il grezzo se i tier non sono stati creati)"""
+    buckets_api = client.buckets_api()
+    tiers = [tier for tier in RETENTION_TIERS[1:] if buckets_api.find_bucket_by_name(tier.bucket)]
+    return RETENTION_TIERS[:1] + tiers
+
+
+def sample_site_ids(count):
+    """Siti di esempio: i tre reali più siti sintetici per i benchmark"""
+    sites = SAMPLE_SITES[:count]
+    sites += [f"site_{i:03d}" for i in range(len(sites) + 1, count + 1)]
+    return sites
+
+
+class SampleDataGenerator:
+    """Genera le serie di esempio con NumPy per tutti i siti e profondità in un solo passo"""
+
+    def __init__(self, sites=None, depths=None, hours_back=24, step_minutes=10, seed=None, end_time=None):
+        if np is None:
+            raise ImportError("NumPy non installato: pip install numpy")
+
+        self.sites = sites or SAMPLE_SITES
+        self.depths = depths or SAMPLE_DEPTHS
+        self.step_seconds = step_minutes * 60
+        self.steps = hours_back * 60 // step_minutes
+        end_time = end_time or datetime.now(timezone.utc)
+        self.start_ts = int((end_time - timedelta(hours=hours_back)).timestamp())
+        self.rng = np.random.default_rng(seed)
+
+        # Tag di ogni serie (sito, profondità), nell'ordine degli array generati
+        self.series = [(site, depth) for site in self.sites for depth in self.depths]
+        self.depth_factor = np.array([DEPTH_FACTORS[d] for d in self.depths])
+        self.is_deep = np.array([d == "deep" for d in self.depths])
+
+    @property
+    def total_points(self):
+        return self.steps * len(self.series)
+
+    def generate(self, start_step=0, count=None):
+        """Calcola i campi per un blocco di step: array di forma (step, siti, profondità)"""
+        count = self.steps - start_step if count is None else count
+        shape = (count, len(self.sites), len(self.depths))
+        uniform = self.rng.uniform
+
+        i = np.arange(start_step, start_step + count)
+        timestamps = self.start_ts + i * self.step_seconds
+        hour = (timestamps // 3600) % 24
+        day_wave = np.sin(2 * np.pi * hour / 24)[:, None, None]
+        i3 = i[:, None, None]
+        df = self.depth_factor[None, None, :]
+
+        # Temperatura: più fredda in profondità e di notte
+        temperature = 18 + 4 * day_wave - df * 5 + uniform(-1, 1, shape)
+
+        # Corrente: più forte in superficie, pattern semi-random
+        current_speed = (0.5 + 0.3 * (1 - df) + 0.2 * np.sin(2 * np.pi * i3 / 144)
+                         + uniform(-0.1, 0.1, shape))
+        current_direction = (45 + 30 * np.sin(2 * np.pi * i3 / 72) + uniform(-15, 15, shape)) % 360
+
+        # Visibilità: meglio in profondità durante il giorno
+        visibility = np.clip(15 + 5 * day_wave + df * 3 + uniform(-2, 2, shape), 1, 30)
+
+        # Luminosità: zero in profondità di notte
+        luminosity = np.where(self.is_deep[None, None, :],
+                              10 * day_wave,
+                              1000 * day_wave * (1 - df * 0.8))
+
+        # Batteria: degrado graduale
+        battery_level = np.clip(100.0 - i3 * 0.01 + uniform(-1.0, 1.0, shape), 0.0, 100.0)
+
+        return {
+            "time": timestamps,
+            "temperature": temperature,
+            "current_speed": np.maximum(current_speed, 0),
+            "current_direction": current_direction.astype(np.int64),
+            "visibility": visibility,
+            "luminosity": np.maximum(np.broadcast_to(luminosity, shape), 0),
+            "battery_level": battery_level,
+        }
+
+    def iter_line_protocol(self, chunk_steps=1000):
+        """Produce blocchi di righe line protocol (precisione secondi) senza creare Point"""
+        sites = [site for site, _ in self.series]
+        tags = {
+            "site_id": sites,
+            "sensor_id": [f"{site}_sensor_01" for site in sites],
+            "depth": [depth for _, depth in self.series],
+        }
+        for start in range(0, self.steps, chunk_steps):
+            data = self.generate(start, min(chunk_steps, self.steps - start))
+            count = len(data["time"])
+            fields = {name: data[name].ravel().tolist() for name in DIVE_CONDITIONS.fields}
+            yield SAMPLE_LINES.encode_columns(
+                {key: values * count for key, values in tags.items()},
+                fields,
+                np.repeat(data["time"], len(self.series)).tolist(),
+                time_unit="s"
+            )
+
 class DiveSiteDBFixed:
     def __init__(self):
         self.client = InfluxDBClient(
@@ -29,6 +239,11 @@ class DiveSiteDBFixed:
         self.query_api = self.client.query_api()
         self.delete_api = self.client.delete_api()
     
+    @property
+    def reader(self):
+        """Lettore Flux colonnare in streaming (richiede NumPy)"""
+        return FluxReader(self.query_api, INFLUXDB_ORG)
+    
     def reset_database(self):
         """Pulisce completamente il database per ripartire da zero"""
         print("🧹 Pulizia database...")
@@ -58,38 +273,17 @@ class DiveSiteDBFixed:
         """Crea la struttura del database per i dati di immersione"""
         print("🏗️  Inizializzazione schema database...")
         
-        schema_info = {
-            "measurements": {
-                "dive_conditions": {
-                    "fields": {
-                        "temperature": "float (°C)",
-                        "current_speed": "float (m/s)", 
-                        "current_direction": "int (degrees 0-360)",
-                        "visibility": "float (meters)",
-                        "luminosity": "float (lux)",
-                        "battery_level": "float (percentage)"
-                    },
-                    "tags": {
-                        "site_id": "string (location identifier)",
-                        "sensor_id": "string (device identifier)",
-                        "depth": "string (depth category: surface/shallow/deep)"
-                    }
-                }
-            }
-        }
+        schema_info = {"measurements": {name: m.describe() for name, m in MEASUREMENTS.items()}}
         
         print("📋 Schema definito:")
         print(json.dumps(schema_info, indent=2))
         return schema_info
     
-    def insert_sample_data(self, hours_back=24):
-        """Inserisce dati di esempio per testare il sistema (FIXED)"""
-        print(f"📊 Inserimento dati di esempio per le ultime {hours_back} ore...")
+    def iter_sample_points(self, hours_back=24):
+        """Genera i punti di esempio uno alla volta, senza accumularli in memoria"""
+        sites = SAMPLE_SITES
+        depths = SAMPLE_DEPTHS
         
-        sites = ["capo_vaticano", "tropea_reef", "stromboli_east"]
-        depths = ["surface", "shallow", "deep"]
-        
-        points = []
         # FIX: Usa timezone-aware datetime
         base_time = datetime.now(timezone.utc) - timedelta(hours=hours_back)
         
@@ -100,7 +294,7 @@ class DiveSiteDBFixed:
                 for depth in depths:
                     # Simula dati realistici basati su profondità e ora
                     hour = timestamp.hour
-                    depth_factor = {"surface": 0, "shallow": 0.3, "deep": 0.6}[depth]
+                    depth_factor = DEPTH_FACTORS[depth]
                     
                     # Temperatura: più fredda in profondità e di notte
                     base_temp = 18 + 4 * math.sin(2 * math.pi * hour / 24)
@@ -128,37 +322,113 @@ class DiveSiteDBFixed:
                     battery_level = 100.0 - (i * 0.01) + random.uniform(-1.0, 1.0)
                     battery_level = max(0.0, min(100.0, battery_level))
                     
-                    # Crea point InfluxDB (FIX: Esplicita i tipi)
-                    point = (Point("dive_conditions")
-                           .tag("site_id", site)
-                           .tag("sensor_id", f"{site}_sensor_01")
-                           .tag("depth", depth)
-                           .field("temperature", float(round(temperature, 2)))
-                           .field("current_speed", float(round(max(0, current_speed), 2)))
-                           .field("current_direction", int(current_direction))
-                           .field("visibility", float(round(visibility, 1)))
-                           .field("luminosity", float(round(max(0, luminosity), 1)))
-                           .field("battery_level", float(round(battery_level, 1)))  # FIX: Esplicitamente float
-                           .time(timestamp, WritePrecision.S))
-                    
-                    points.append(point)
+                    # Riga line protocol: i tipi dei campi sono quelli dello schema
+                    yield SAMPLE_LINES.encode_record({
+                        "site_id": site,
+                        "sensor_id": f"{site}_sensor_01",
+                        "depth": depth,
+                        "temperature": round(temperature, 2),
+                        "current_speed": round(max(0, current_speed), 2),
+                        "current_direction": int(current_direction),
+                        "visibility": round(visibility, 1),
+                        "luminosity": round(max(0, luminosity), 1),
+                        "battery_level": round(battery_level, 1),
+                    }, timestamp)
+    
+    def insert_sample_data(self, hours_back=24, batch_size=5000, workers=4):
+        """Inserisce dati di esempio per testare il sistema (FIXED)"""
+        print(f"📊 Inserimento dati di esempio per le ultime {hours_back} ore...")
+        return self.bulk_write(self.iter_sample_points(hours_back), batch_size, workers)
+    
+    def insert_sample_data_fast(self, hours_back=24, sites=None, seed=None, batch_size=5000, workers=4):
+        """Inserisce dati di esempio generati con NumPy direttamente in line protocol"""
+        generator = SampleDataGenerator(sites=sites, hours_back=hours_back, seed=seed)
+        print(f"📊 Generazione vettoriale: {len(generator.sites)} siti, {hours_back} ore, "
+              f"{generator.total_points} punti...")
+        records = itertools.chain.from_iterable(generator.iter_line_protocol())
+        return self.bulk_write(records, batch_size, workers)
+    
+    def bulk_write(self, records, batch_size=5000, workers=4):
+        """Scrive un flusso di record con il bulk loader (gzip, writer paralleli, retry)"""
+        loader = BulkLoader(
+            url=INFLUXDB_URL,
+            token=INFLUXDB_TOKEN,
+            org=INFLUXDB_ORG,
+            bucket=INFLUXDB_BUCKET,
+            batch_size=batch_size,
+            workers=workers,
+            max_inflight=workers * 2
+        )
+        try:
+            stats = loader.load(records)
+        finally:
+            loader.close()
+        
+        print_load_report(stats)
+        return stats.failed_batches == 0
+    
+    def provision_tiers(self, backfill_days=365):
+        """Crea i bucket aggregati, li popola dallo storico grezzo, crea i task e riduce la retention del grezzo"""
+        print("🗂️ Provisioning livelli di retention...")
+        buckets_api = self.client.buckets_api()
+        organization = self.client.organizations_api().find_organizations(org=INFLUXDB_ORG)[0]
+        raw_tier, aggregate_tiers = RETENTION_TIERS[0], RETENTION_TIERS[1:]
         
-        # Scrivi punti in batch più piccoli per evitare timeout
-        batch_size = 100
-        total_points = len(points)
+        for tier in aggregate_tiers:
+            rules = [BucketRetentionRules(type="expire", every_seconds=tier.retention_s)] if tier.retention_s else []
+            if buckets_api.find_bucket_by_name(tier.bucket):
+                print(f"   ✅ Bucket {tier.bucket} già presente")
+            else:
+                buckets_api.create_bucket(bucket_name=tier.bucket, retention_rules=rules, org_id=organization.id)
+                print(f"   ✅ Bucket {tier.bucket} creato (retention {tier.retention_s // 86400 or '∞'} giorni)")
         
-        for i in range(0, total_points, batch_size):
-            batch = points[i:i + batch_size]
-            try:
-                self.write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=batch)
-                print(f"   ✅ Batch {i//batch_size + 1}/{(total_points + batch_size - 1)//batch_size} scritto ({len(batch)} punti)")
-            except Exception as e:
-                print(f"   ❌ Errore batch {i//batch_size + 1}: {e}")
-                return False
+        # Backfill prima di ridurre la retention: ogni livello dal grezzo, a blocchi di 7 giorni
+        # Blocchi allineati all'ora: nessuna finestra di aggregazione spezzata tra due blocchi
+        hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        backfilled = {}
+        for tier in aggregate_tiers:
+            days = backfill_days if not tier.retention_s else min(backfill_days, tier.retention_s // 86400)
+            print(f"   ⏳ Backfill {tier.bucket}: {days} giorni...")
+            backfilled[tier.bucket] = self.backfill_tier(tier, raw_tier.bucket, hour - timedelta(days=days))
         
-        print(f"✅ Inseriti {total_points} punti dati nel database")
+        # Task: ricalcolano le ultime due finestre per includere i dati arrivati in ritardo
+        tasks_api = self.client.tasks_api()
+        for tier in aggregate_tiers:
+            # Il backfill degli altri livelli ha richiesto tempo: si recupera fino alla finestra in
+            # corso subito prima di creare il task, la cui prima esecuzione riparte da lì
+            self.backfill_tier(tier, raw_tier.bucket, backfilled[tier.bucket])
+            for task in tasks_api.find_tasks(name=tier.task_name):
+                tasks_api.delete_task(task.id)
+            seconds = tier.resolution_s * 2
+            tasks_api.create_task_every(tier.task_name, tier.downsample_flux(tier.source, f"-{seconds}s"),
+                                        tier.every, organization)
+            print(f"   ✅ Task {tier.task_name} ogni {tier.every} da {tier.source}")
+        
+        raw_bucket = buckets_api.find_bucket_by_name(raw_tier.bucket)
+        raw_bucket.retention_rules = [BucketRetentionRules(type="expire", every_seconds=raw_tier.retention_s)]
+        buckets_api.update_bucket(raw_bucket)
+        print(f"   ✅ Retention {raw_tier.bucket}: {raw_tier.retention_s // 86400} giorni")
         return True
     
+    def backfill_tier(self, tier, source, start):
+        """Aggrega `source` nel livello da `start` fino alla fine della finestra in corso, ritorna lo stop
+        
+        La fine è ricalcolata a ogni blocco e allineata in su: la finestra parziale scritta qui viene
+        riscritta (stesso _time) dal task, che guarda indietro due finestre.
+        """
+        while True:
+            end = tier.window_end(datetime.now(timezone.utc))
+            stop = min(start + timedelta(days=7), end)
+            if stop <= start:
+                return start
+            flux = tier.downsample_flux(source, start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                                        stop.strftime("%Y-%m-%dT%H:%M:%SZ"))
+            # count() finale: la risposta contiene solo i conteggi, non i punti scritti
+            self.query_api.query(org=INFLUXDB_ORG, query=flux + "  |> count()")
+            if stop >= end:
+                return stop
+            start = stop
+    
     def test_queries(self):
         """Testa alcune query di esempio"""
         print("\n🔍 Test query database...")
@@ -174,14 +444,15 @@ class DiveSiteDBFixed:
         '''
         
         try:
-            result = self.query_api.query(org=INFLUXDB_ORG, query=query)
+            columns = self.reader.columns(query, pivot=True)
             
             print("📊 Condizioni attuali Capo Vaticano (shallow):")
-            for table in result:
-                for record in table.records:
-                    print(f"   {record.get_field()}: {record.get_value()}")
+            for field in DIVE_CONDITIONS.fields:
+                for value in columns.get(field, []):
+                    if value == value:      # NaN: campo senza valore in questa riga del pivot
+                        print(f"   {field}: {value}")
             
-            if not result or not any(table.records for table in result):
+            if not columns:
                 print("   ⚠️ Nessun dato trovato (normale se appena inizializzato)")
             
         except Exception as e:
@@ -196,22 +467,18 @@ class DiveSiteDBFixed:
             health = self.client.health()
             print(f"   ✅ Connessione: {health.status}")
             
-            # Conta record totali
+            # Conta i punti degli ultimi 30 giorni sul livello più economico (orario se presente)
+            tier = choose_tier(30 * 86400, 3600, available_tiers(self.client))
             count_query = f'''
-            from(bucket: "{INFLUXDB_BUCKET}")
+            from(bucket: "{tier.bucket}")
               |> range(start: -30d)
               |> filter(fn: (r) => r["_measurement"] == "dive_conditions")
               |> count()
             '''
             
-            result = self.query_api.query(org=INFLUXDB_ORG, query=count_query)
-            total_records = 0
-            for table in result:
-                for record in table.records:
-                    if record.get_field() == "_value":
-                        total_records += record.get_value()
+            total_records = self.reader.total(count_query)
             
-            print(f"   📊 Record totali: {total_records}")
+            print(f"   📊 Punti ultimi 30 giorni ({tier.bucket}): {total_records}")
             
             # Verifica tipi campi
             schema_query = f'''
@@ -219,11 +486,10 @@ class DiveSiteDBFixed:
             schema.fieldKeys(bucket: "{INFLUXDB_BUCKET}")
             '''
             
-            result = self.query_api.query(org=INFLUXDB_ORG, query=schema_query)
+            field_keys = self.reader.columns(schema_query, columns=["_value"]).get("_value", [])
             print("   🔧 Campi nel database:")
-            for table in result:
-                for record in table.records:
-                    print(f"      - {record.get_value()}")
+            for field in field_keys:
+                print(f"      - {field}")
             
         except Exception as e:
             print(f"   ❌ Errore verifica: {e}")
@@ -237,9 +503,30 @@ def main():
     print("🚀 Smart Dive Site Controller - Database Fix & Reset")
     print("=" * 60)
     
+    parser = argparse.ArgumentParser(description="Reset e inizializzazione database InfluxDB")
+    parser.add_argument("--hours", type=int, default=24, help="Ore di dati di esempio")
+    parser.add_argument("--sites", type=int, default=len(SAMPLE_SITES), help="Numero di siti di esempio")
+    parser.add_argument("--fast", action="store_true", help="Generatore vettoriale NumPy (per backfill lunghi)")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Punti per richiesta di scrittura")
+    parser.add_argument("--workers", type=int, default=4, help="Writer concorrenti")
+    parser.add_argument("--tiers", action="store_true",
+                        help="Solo provisioning dei livelli di retention (nessun reset dei dati)")
+    parser.add_argument("--backfill-days", type=int, default=365, help="Giorni di storico da aggregare nei livelli")
+    parser.add_argument("--metrics-port", type=int,
+                        help=f"Espone /metrics Prometheus su questa porta (es. {METRICS_PORTS['bulk_loader']})")
+    args = parser.parse_args()
+    
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    
     try:
         db = DiveSiteDBFixed()
         
+        if args.tiers:
+            db.provision_tiers(backfill_days=args.backfill_days)
+            db.verify_database_health()
+            return
+        
         # Step 1: Reset database
         print("\n🎯 STEP 1: Reset Database")
         db.reset_database()
@@ -250,7 +537,12 @@ def main():
         
         # Step 3: Inserisci dati di test
         print("\n🎯 STEP 3: Inserisci Dati Test")
-        success = db.insert_sample_data(hours_back=24)  # Solo 24h per velocità
+        if args.fast or args.sites > len(SAMPLE_SITES):
+            success = db.insert_sample_data_fast(hours_back=args.hours, sites=sample_site_ids(args.sites),
+                                                 batch_size=args.batch_size, workers=args.workers)
+        else:
+            success = db.insert_sample_data(hours_back=args.hours, batch_size=args.batch_size,
+                                            workers=args.workers)
         
         if success:
             # Step 4: Test query
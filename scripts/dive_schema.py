@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Schema Registry
+Measurement InfluxDB dichiarati in un solo punto e encoder line protocol a batch
+con escaping, precisione e coercizione dei tipi: un campo è sempre scritto con il
+tipo dichiarato, quindi niente conflitti di tipo in scrittura
+"""
+
+from datetime import datetime, timezone
+import math
+
+PRECISIONS = {"s": 1_000_000_000, "ms": 1_000_000, "us": 1_000, "ns": 1}
+
+# Escaping line protocol
+_MEASUREMENT_ESCAPES = str.maketrans({",": "\\,", " ": "\\ "})
+# Il line protocol non ammette "a capo" nei valori: sostituiti dalla sequenza \n
+_TAG_ESCAPES = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ ", "\n": "\\n"})
+_STRING_ESCAPES = str.maketrans({'"': '\\"', "\\": "\\\\", "\n": "\\n"})
+
+
+class SchemaError(ValueError):
+    """Valore non convertibile nel tipo dichiarato"""
+
+
+class Measurement:
+    """Measurement con tag e campi tipizzati (float, int, string, bool)"""
+
+    def __init__(self, name, tags, fields, tag_defaults=None):
+        self.name = name
+        self.tags = tuple(tags)
+        self.fields = dict(fields)
+        self.tag_defaults = tag_defaults or {}
+
+    def encoder(self, precision="ns", decimals=None):
+        return LineEncoder(self, precision, decimals)
+
+    def describe(self):
+        return {"tags": list(self.tags), "fields": dict(self.fields)}
+
+
+DIVE_CONDITIONS = Measurement(
+    "dive_conditions",
+    tags=["site_id", "sensor_id", "depth"],
+    fields={
+        "temperature": "float",         # °C
+        "current_speed": "float",       # m/s
+        "current_direction": "int",     # gradi 0-359
+        "visibility": "float",          # m
+        "luminosity": "float",          # lux
+        "battery_level": "float",       # %
+    },
+    tag_defaults={"depth": "unknown"},
+)
+
+SYSTEM_ALERTS = Measurement(
+    "system_alerts",
+    tags=["site_id", "sensor_id", "type", "level"],
+    fields={
+        "value": "float",
+        "threshold": "float",
+        "message": "string",
+        "state": "string",              # open / updated / cleared
+    },
+)
+
+# Punti sonda di health_check.py (scrittura → query): non entrano nei livelli aggregati
+HEALTH_PROBE = Measurement(
+    "health_probe",
+    tags=["probe"],
+    fields={"seq": "int"},
+)
+
+MEASUREMENTS = {measurement.name: measurement for measurement in (DIVE_CONDITIONS, SYSTEM_ALERTS, HEALTH_PROBE)}
+
+
+def to_ns(timestamp, unit="s"):
+    """datetime, ISO 8601 (naive = ora locale) o numero in `unit` → ns dall'epoch"""
+    if isinstance(timestamp, datetime):
+        seconds = int(timestamp.replace(microsecond=0).timestamp())
+        return seconds * 1_000_000_000 + timestamp.microsecond * 1000
+    if isinstance(timestamp, str):
+        return to_ns(datetime.fromisoformat(timestamp.replace("Z", "+00:00")))
+    if isinstance(timestamp, int):
+        return timestamp * PRECISIONS[unit]
+    # Parte intera e frazione separate: t * 1e9 in float perderebbe le cifre meno significative
+    whole = int(timestamp)
+    return whole * PRECISIONS[unit] + round((timestamp - whole) * PRECISIONS[unit])
+
+
+class LineEncoder:
+    """Codifica batch di righe per un measurement; i prefissi (measurement + tag) sono in cache"""
+
+    def __init__(self, measurement, precision="ns", decimals=None):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Precisione non valida: {precision}")
+        self.measurement = measurement
+        self.precision = precision
+        self.divisor = PRECISIONS[precision]
+        self.escaped_name = measurement.name.translate(_MEASUREMENT_ESCAPES)
+        self.tag_keys = tuple(sorted(measurement.tags))     # ordine consigliato da InfluxDB
+        self.fields = measurement.fields
+        self.keys = {name: name.translate(_TAG_ESCAPES) + "=" for name in measurement.fields}
+        # Formato %-style per campo; cifre decimali fisse opzionali per i float (più veloce della repr)
+        decimals = decimals or {}
+        self.templates = {}
+        for name, kind in measurement.fields.items():
+            key = self.keys[name].replace("%", "%%")
+            if kind == "float":
+                self.templates[name] = f"{key}%.{decimals[name]}f" if name in decimals else f"{key}%r"
+            elif kind == "int":
+                self.templates[name] = f"{key}%di"
+        self.prefixes = {}
+        self.dropped_values = 0
+
+    def prefix(self, tag_values):
+        """Measurement e tag (valori in ordine di tag_keys), con escaping"""
+        prefix = self.prefixes.get(tag_values)
+        if prefix is None:
+            parts = [self.escaped_name]
+            for key, value in zip(self.tag_keys, tag_values):
+                value = value or self.measurement.tag_defaults.get(key)
+                if value:
+                    parts.append(f"{key}={str(value).translate(_TAG_ESCAPES)}")
+            prefix = self.prefixes[tag_values] = ",".join(parts) + " "
+        return prefix
+
+    def timestamp(self, value, unit="ns"):
+        ns = to_ns(value, unit)
+        return ns // self.divisor if self.divisor > 1 else ns
+
+    def format_field(self, name, value):
+        """"nome=valore" nel tipo dichiarato; SchemaError, TypeError o ValueError se non convertibile"""
+        kind = self.fields[name]
+        if kind == "float":
+            value = float(value)
+            if not math.isfinite(value):
+                raise SchemaError(f"{name}: valore non finito")
+            return self.templates[name] % value
+        if kind == "int":
+            return self.templates[name] % round(float(value))
+        if kind == "string":
+            return f'{self.keys[name]}"{str(value).translate(_STRING_ESCAPES)}"'
+        if isinstance(value, str):
+            value = value.lower() in ("true", "t", "1", "yes")
+        return f"{self.keys[name]}{'true' if value else 'false'}"
+
+    @staticmethod
+    def coerce_column(kind, values):
+        """Colonna numerica completa convertita nel tipo dichiarato, None se serve il percorso per valore"""
+        try:
+            if kind == "float":
+                floats = list(map(float, values))
+                if all(map(math.isfinite, floats)):
+                    return floats
+            elif kind == "int":
+                return list(map(round, values))
+        except (TypeError, ValueError):
+            pass
+        return None
+
+    def render_column(self, name, values):
+        """Una colonna di campi "nome=valore"; None dove il valore manca o non è convertibile"""
+        rendered = []
+        for value in values:
+            try:
+                rendered.append(None if value is None else self.format_field(name, value))
+            except (TypeError, ValueError):
+                self.dropped_values += 1
+                rendered.append(None)
+        return rendered
+
+    def encode_columns(self, tags, fields, times, time_unit="ns"):
+        """Batch colonnare: tag e campi come liste (o scalari per i tag), tempi numerici in `time_unit`
+
+        I campi non dichiarati nello schema sono ignorati; le righe senza campi sono scartate.
+        """
+        count = len(times)
+        tag_columns = [tags.get(key) for key in self.tag_keys]
+        if all(column is None or isinstance(column, str) for column in tag_columns):
+            prefixes = [self.prefix(tuple(tag_columns))] * count
+        else:
+            tag_columns = [column if isinstance(column, (list, tuple)) else [column] * count
+                           for column in tag_columns]
+            prefixes = list(map(self.prefix, zip(*tag_columns)))
+
+        factor = PRECISIONS[time_unit]
+        if factor % self.divisor == 0 and set(map(type, times)) <= {int}:
+            scale = factor // self.divisor
+            stamps = times if scale == 1 else list(map(scale.__mul__, times))
+        else:
+            stamps = [self.timestamp(t, time_unit) for t in times]
+
+        names = [name for name in self.fields if name in fields]
+        if not names:
+            return []
+
+        # Percorso veloce: colonne numeriche complete, una sola % per riga (come un template fisso)
+        coerced = [self.coerce_column(self.fields[name], fields[name]) for name in names]
+        if all(column is not None for column in coerced):
+            template = "%s" + ",".join(self.templates[name] for name in names) + " %d"
+            return list(map(template.__mod__, zip(prefixes, *coerced, stamps)))
+
+        rendered = [self.render_column(name, fields[name]) for name in names]
+        lines = []
+        for prefix, stamp, parts in zip(prefixes, stamps, zip(*rendered)):
+            body = ",".join(filter(None, parts))
+            if body:
+                lines.append(f"{prefix}{body} {stamp}")
+        return lines
+
+    def encode_record(self, record, timestamp=None, time_unit="s"):
+        """Una riga da un dict (formato sensor_data); tempo da `timestamp` o da record["timestamp"]"""
+        fields = []
+        for name in self.fields:
+            value = record.get(name)
+            if value is None:
+                continue
+            try:
+                fields.append(self.format_field(name, value))
+            except (TypeError, ValueError):
+                self.dropped_values += 1
+        if not fields:
+            return None
+
+        prefix = self.prefix(tuple(record.get(key) for key in self.tag_keys))
+        if timestamp is None:
+            timestamp = record.get("timestamp") or datetime.now(timezone.utc)
+        return f"{prefix}{','.join(fields)} {self.timestamp(timestamp, time_unit)}"
+
+    def encode_records(self, records, time_unit="s"):
+        """Batch di dict: una riga per record (record senza campi validi scartati)"""
+        lines = []
+        for record in records:
+            line = self.encode_record(record, time_unit=time_unit)
+            if line is not None:
+                lines.append(line)
+        return lines
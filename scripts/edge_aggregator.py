@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Edge Aggregator
+Modello di riferimento dell'elaborazione sul sensore: campionamento veloce con
+statistiche per finestra (min/media/max/deviazione standard), riepilogo a cadenza
+lenta e pubblicazione immediata solo oltre deadband o al passaggio di una soglia di alert
+"""
+
+import math
+
+from alert_engine import ALERT_RULES
+
+EDGE_FIELDS = ("temperature", "current_speed", "current_direction", "visibility", "luminosity", "battery_level")
+
+# Cifre decimali pubblicate, come le letture del simulatore (0 = intero)
+FIELD_DECIMALS = {
+    "temperature": 2,
+    "current_speed": 2,
+    "current_direction": 0,
+    "visibility": 1,
+    "luminosity": 1,
+    "battery_level": 1,
+}
+
+ANGLE_FIELDS = {"current_direction"}
+
+# Peso del nuovo campione nella media mobile esponenziale
+SMOOTHING = 0.2
+# Soglia di cambiamento minima in deviazioni standard del rumore del valore filtrato:
+# con un campionamento veloce il rumore del sensore supererebbe da solo le deadband
+NOISE_SIGMAS = 5.0
+CLEAR_SIGMAS = 2.0
+
+
+class RunningStats:
+    """Min, max, media e varianza in un passaggio (algoritmo di Welford), memoria costante"""
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+    def summary(self, decimals=3, angle=False):
+        """Per gli angoli min/media/max tornano in [0, 360): con min > max l'arco passa per lo 0"""
+        values = (self.min, self.mean, self.max)
+        if angle:
+            values = [value % 360 for value in values]
+        summary = dict(zip(("min", "mean", "max"), (round(value, decimals) for value in values)))
+        summary["std"] = round(self.stddev, decimals)
+        return summary
+
+
+def signed_delta(field, value, previous):
+    """value - previous; per gli angoli il percorso più breve (-180, 180]"""
+    delta = value - previous
+    if field in ANGLE_FIELDS:
+        delta = (delta + 180) % 360 - 180
+    return delta
+
+
+def field_delta(field, value, previous):
+    return abs(signed_delta(field, value, previous))
+
+
+def round_field(field, value):
+    if field in ANGLE_FIELDS:
+        return int(round(value)) % 360
+    decimals = FIELD_DECIMALS.get(field, 2)
+    return round(value, decimals) if decimals else int(round(value))
+
+
+class EdgeAggregator:
+    """Decide, campione per campione, se e cosa pubblicare
+
+    process() ritorna un record nel formato sensor_data (più "reason" ed eventualmente
+    "window") oppure None. Motivi: "alert" (soglia di ALERT_RULES attraversata),
+    "deadband" (valore filtrato oltre la deadband), "window" (riepilogo periodico).
+    """
+
+    def __init__(self, deadbands, window=300.0, rules=ALERT_RULES, smoothing=SMOOTHING, fields=EDGE_FIELDS):
+        self.deadbands = deadbands
+        self.window = window
+        self.rules = rules
+        self.smoothing = smoothing
+        self.fields = fields
+        self.stats = {field: RunningStats() for field in fields}
+        self.smoothed = {}
+        self.variance = {}        # varianza esponenziale del residuo campione - media mobile
+        self.reported = {}
+        self.alerting = {}        # tipo regola -> soglia superata
+        self.window_start = None
+        self.published = {"alert": 0, "deadband": 0, "window": 0}
+
+    def update(self, data):
+        """Statistiche e media mobile con un nuovo campione"""
+        for field in self.fields:
+            value = data.get(field)
+            if not isinstance(value, (int, float)):
+                continue
+            previous = self.smoothed.get(field)
+            if previous is None:
+                self.stats[field].add(value)
+                self.smoothed[field], self.variance[field] = value, 0.0
+                continue
+            delta = signed_delta(field, value, previous)
+            # Angoli "srotolati" attorno alla media: 355° dopo 5° vale -5°, non 355°
+            self.stats[field].add(previous + delta)
+            self.smoothed[field] = previous + self.smoothing * delta
+            self.variance[field] = (1 - self.smoothing) * (self.variance[field] + self.smoothing * delta * delta)
+
+    def alert_crossed(self):
+        """Passaggio di soglia del valore filtrato, con l'isteresi della regola (un picco di rumore non basta)"""
+        crossed = False
+        for rule in self.rules:
+            value = self.smoothed.get(rule.field)
+            if value is None:
+                continue
+            # Chiusura oltre l'isteresi della regola più il rumore residuo: il filtrato non oscilla sulla soglia
+            margin = CLEAR_SIGMAS * self.noise(rule.field)
+            if not self.alerting.get(rule.type):
+                if rule.is_triggered(value):
+                    self.alerting[rule.type] = crossed = True
+            elif rule.is_cleared(value - margin if rule.direction == "below" else value + margin):
+                self.alerting[rule.type] = False
+                crossed = True
+        return crossed
+
+    def noise(self, field):
+        """Deviazione standard del rumore rimasto nella media mobile"""
+        return math.sqrt(self.variance[field] * self.smoothing / (2 - self.smoothing))
+
+    def change_threshold(self, field):
+        """Deadband, alzata al livello di rumore residuo della media mobile se più alto"""
+        return max(self.deadbands.get(field, 0), NOISE_SIGMAS * self.noise(field))
+
+    def beyond_deadband(self):
+        for field, value in self.smoothed.items():
+            reported = self.reported.get(field)
+            if reported is None or field_delta(field, value, reported) > self.change_threshold(field):
+                return True
+        return False
+
+    def process(self, data, now):
+        """Un campione al tempo `now` (secondi dell'orologio del simulatore)"""
+        if self.window_start is None:
+            self.window_start = now
+        self.update(data)
+
+        if self.alert_crossed():
+            return self.record(data, "alert")
+        if now - self.window_start >= self.window:
+            record = self.record(data, "window")
+            record["window"] = {
+                "seconds": round(now - self.window_start, 3),
+                "samples": self.stats[self.fields[0]].count,
+                "stats": {field: stats.summary(angle=field in ANGLE_FIELDS)
+                          for field, stats in self.stats.items() if stats.count},
+            }
+            for stats in self.stats.values():
+                stats.reset()
+            self.window_start = now
+            return record
+        if self.beyond_deadband():
+            return self.record(data, "deadband")
+        return None
+
+    def record(self, data, reason):
+        """Record da pubblicare: metadati dell'ultimo campione, valori filtrati"""
+        record = dict(data, reason=reason)
+        for field in self.fields:
+            if field in self.smoothed:
+                record[field] = round_field(field, self.smoothed[field])
+                self.reported[field] = record[field]
+        self.published[reason] += 1
+        return record
+
+
+class FidelityTracker:
+    """Errore di ricostruzione (ultimo valore ricevuto vs serie campionata) e ritardo degli alert di una politica"""
+
+    def __init__(self, rules=ALERT_RULES, fields=EDGE_FIELDS):
+        self.rules = rules
+        self.fields = fields
+        self.messages = 0
+        self.bytes = 0
+        self.held = {}
+        self.squared = dict.fromkeys(fields, 0.0)
+        self.worst = dict.fromkeys(fields, 0.0)
+        self.compared = dict.fromkeys(fields, 0)
+        self.episode_start = {}     # tipo regola -> inizio dell'episodio reale in corso
+        self.notified = {}          # tipo regola -> ritardo di notifica (None finché non notificato)
+        self.episodes = 0
+        self.delays = []
+        self.missed = 0
+
+    def observe(self, truth, record, now, size=0):
+        """Un passo: `truth` è il campione reale, `record` ciò che è stato pubblicato (o None)"""
+        if record is not None:
+            self.messages += 1
+            self.bytes += size
+            self.held.update((field, record[field]) for field in self.fields if field in record)
+
+        for field in self.fields:
+            if field in self.held and field in truth:
+                error = field_delta(field, truth[field], self.held[field])
+                self.squared[field] += error * error
+                self.compared[field] += 1
+                if error > self.worst[field]:
+                    self.worst[field] = error
+
+        for rule in self.rules:
+            value = truth.get(rule.field)
+            if not isinstance(value, (int, float)):
+                continue
+            start = self.episode_start.get(rule.type)
+            if start is None:
+                if not rule.is_triggered(value):
+                    continue
+                start = self.episode_start[rule.type] = now
+                self.notified[rule.type] = None
+            held = self.held.get(rule.field)
+            if self.notified[rule.type] is None and held is not None and rule.is_triggered(held):
+                self.notified[rule.type] = now - start
+            if rule.is_cleared(value):
+                self.close_episode(rule, now)
+
+    def close_episode(self, rule, now):
+        """Conta solo gli episodi lunghi almeno min_duration: quelli che l'AlertEngine aprirebbe"""
+        start = self.episode_start.pop(rule.type)
+        if now - start < rule.min_duration:
+            return
+        self.episodes += 1
+        delay = self.notified[rule.type]
+        if delay is None:
+            self.missed += 1
+        else:
+            self.delays.append(delay)
+
+    def finish(self, now):
+        for rule in self.rules:
+            if rule.type in self.episode_start:
+                self.close_episode(rule, now)
+
+    def rmse(self, field):
+        return math.sqrt(self.squared[field] / self.compared[field]) if self.compared[field] else 0.0
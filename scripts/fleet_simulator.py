@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Fleet Simulator
+Simula una flotta di sensori Arduino in un unico processo asyncio,
+condividendo un piccolo pool di connessioni MQTT
+"""
+
+import argparse
+import asyncio
+import heapq
+import random
+import shlex
+import subprocess
+import threading
+import time
+from collections import Counter
+
+import metrics
+from arduino_simulator import DISCONNECTS, DiveSensorSimulator, PAYLOAD_FORMATS, PUBLISH_PROFILES, parse_deadband
+from mqtt_connection import (ADMISSION_BURST, ADMISSION_RATE, BACKOFF_BASE, CONNECT_TIMEOUT, KEEPALIVE,
+                             ConnectionManager, DecorrelatedJitter, TokenBucket)
+
+KNOWN_SITES = ["capo_vaticano", "tropea_reef", "stromboli_east"]
+DEPTHS = ["surface", "shallow", "deep"]
+
+RESTART_COMMAND = "docker restart dive_mosquitto"
+SETTLE_AFTER_RECOVERY = 5.0     # secondi di carico a regime dopo il recupero, poi fine dello scenario
+
+
+def fleet_site_ids(count):
+    """Genera gli identificativi dei siti della flotta"""
+    sites = KNOWN_SITES[:count]
+    sites += [f"site_{i:03d}" for i in range(len(sites) + 1, count + 1)]
+    return sites
+
+
+def parse_interval(spec):
+    """Interpreta un intervallo fisso ("10") o un range per sensore ("5-30")"""
+    if "-" in spec:
+        low, high = spec.split("-", 1)
+        low, high = float(low), float(high)
+    else:
+        low = high = float(spec)
+
+    if low <= 0 or high < low:
+        raise argparse.ArgumentTypeError(f"Intervallo non valido: {spec}")
+    return low, high
+
+
+class RecoveryTracker:
+    """Cadute e riconnessioni del pool: tempo di recupero completo e picco di connessioni al secondo"""
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.up = set()
+        self.ready = False            # tutte connesse almeno una volta: da qui una caduta è un'interruzione
+        self.outage_start = None
+        self.recovered_at = None
+        self.dropped = 0
+        self.attempts = Counter()     # secondo (monotonic) -> tentativi di connessione
+        self.connects = Counter()     # secondo (monotonic) -> connessioni riuscite
+        self.recovered = threading.Event()
+
+    def attempt(self):
+        with self.lock:
+            self.attempts[int(time.monotonic())] += 1
+
+    def connected(self, index):
+        now = time.monotonic()
+        with self.lock:
+            self.connects[int(now)] += 1
+            self.up.add(index)
+            if len(self.up) < self.size:
+                return
+            self.ready = True
+            if self.outage_start is not None and self.recovered_at is None:
+                self.recovered_at = now
+                self.recovered.set()
+
+    def disconnected(self, index, rc):
+        with self.lock:
+            self.up.discard(index)
+            # Misura solo la prima interruzione (non la chiusura del pool, rc = 0)
+            if rc != 0 and self.ready and self.recovered_at is None:
+                if self.outage_start is None:
+                    self.outage_start = time.monotonic()
+                self.dropped += 1
+
+    def summary(self):
+        """None se non c'è stata un'interruzione"""
+        with self.lock:
+            if self.outage_start is None:
+                return None
+            first = int(self.outage_start)
+            last = int(self.recovered_at if self.recovered_at is not None else time.monotonic())
+            attempts = [count for second, count in self.attempts.items() if first <= second <= last]
+            connects = [count for second, count in self.connects.items() if first <= second <= last]
+            return {
+                "recovered": self.recovered_at is not None,
+                "recovery_s": round((self.recovered_at or time.monotonic()) - self.outage_start, 2),
+                "dropped": self.dropped,
+                "attempts": sum(attempts),
+                "peak_attempts_per_s": max(attempts, default=0),
+                "peak_connects_per_s": max(connects, default=0),
+            }
+
+
+class MQTTConnectionPool:
+    """Piccolo pool di connessioni MQTT condivise tra i sensori virtuali
+
+    Client id stabili ({prefisso}_NN, da `first_index`) e sessioni persistenti: due flotte sullo
+    stesso broker devono usare prefissi o intervalli di indici diversi. Con `lockstep` ogni connessione ritenta ogni secondo
+    senza jitter né ammissione (il comportamento da evitare, utile come confronto).
+    """
+
+    def __init__(self, host="localhost", port=1883, size=4, client_prefix="dive_fleet", keepalive=KEEPALIVE,
+                 reconnect_rate=ADMISSION_RATE, lockstep=False, first_index=0):
+        self.host = host
+        self.port = port
+        self.client_prefix = client_prefix
+        # Ammissione propria del pool: il suo ritmo è il picco di connessioni che la flotta impone al broker
+        self.admission = None if lockstep else TokenBucket(reconnect_rate, ADMISSION_BURST)
+        self.tracker = RecoveryTracker(size)
+        self.connections = []
+
+        for index in range(size):
+            connection = ConnectionManager(
+                f"{client_prefix}_{first_index + index:02d}", host, port, keepalive=keepalive,
+                backoff=DecorrelatedJitter(cap=BACKOFF_BASE) if lockstep else None,
+                admission=self.admission,
+                on_connect=self._make_on_connect(index),
+                on_disconnect=self._make_on_disconnect(index),
+                on_attempt=self.tracker.attempt
+            )
+            self.connections.append(connection)
+        self.clients = [connection.client for connection in self.connections]
+
+    def _make_on_connect(self, index):
+        def on_connect(client, userdata, flags, rc):
+            if rc == 0:
+                self.tracker.connected(index)
+            else:
+                print(f"❌ Errore connessione MQTT: {rc}")
+        return on_connect
+
+    def _make_on_disconnect(self, index):
+        def on_disconnect(client, userdata, rc):
+            self.tracker.disconnected(index, rc)
+            DISCONNECTS.inc()
+            if rc != 0:
+                print(f"🔌 Connessione {index} persa (rc: {rc})")
+        return on_disconnect
+
+    def connect(self, timeout=CONNECT_TIMEOUT):
+        """Apre tutte le connessioni e attende la conferma del broker (ammissione inclusa)"""
+        for connection in self.connections:
+            connection.start()
+
+        if self.admission:
+            timeout += len(self.connections) / self.admission.rate
+        deadline = time.monotonic() + timeout
+        for connection in self.connections:
+            if not connection.wait_connected(max(0, deadline - time.monotonic())):
+                error = connection.last_error or "timeout"
+                print(f"❌ Connessione a {self.host}:{self.port} non riuscita: {error}")
+                self.close()
+                return False
+
+        print(f"✅ {len(self.clients)} connessioni MQTT aperte verso {self.host}:{self.port}")
+        return True
+
+    def client_for(self, index):
+        """Assegna i sensori alle connessioni in round-robin"""
+        return self.clients[index % len(self.clients)]
+
+    def close(self):
+        for connection in self.connections:
+            connection.stop_event.set()
+        for connection in self.connections:
+            connection.stop()
+
+
+class FleetStats:
+    """Contatori di throughput della flotta"""
+
+    def __init__(self):
+        self.readings = 0
+        self.messages = 0
+        self.started_at = time.monotonic()
+        self._last_report = (self.started_at, 0, 0)
+
+    def window_rates(self):
+        """Letture/s e messaggi/s dall'ultima chiamata"""
+        now = time.monotonic()
+        last_time, last_readings, last_messages = self._last_report
+        elapsed = max(now - last_time, 1e-9)
+        self._last_report = (now, self.readings, self.messages)
+        return (self.readings - last_readings) / elapsed, (self.messages - last_messages) / elapsed
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "readings": self.readings,
+            "messages": self.messages,
+            "readings_per_s": round(self.readings / elapsed, 1),
+            "messages_per_s": round(self.messages / elapsed, 1),
+            "messages_per_reading": round(self.messages / self.readings, 2) if self.readings else 0,
+        }
+
+
+class FleetSimulator:
+    def __init__(self, sites=3, depths=None, mqtt_host="localhost", mqtt_port=1883,
+                 connections=4, interval=(30.0, 30.0), jitter=0.1, ramp_up=0.0,
+                 event_probability=0.1, seed=None, payload_format="json",
+                 publish_profile="full", deadbands=None, client_prefix="dive_fleet", keepalive=KEEPALIVE,
+                 reconnect_rate=ADMISSION_RATE, lockstep=False, site_ids=None, shard=None, verbose=True):
+        """`site_ids` sostituisce i primi `sites` siti; `shard` (vedi sharded_fleet.py) sceglie il seed
+        della pianificazione e l'intervallo di client id, i dati dei sensori non dipendono dallo shard"""
+        self.depths = depths or DEPTHS
+        self.interval = interval
+        self.jitter = jitter
+        self.ramp_up = ramp_up
+        self.event_probability = event_probability
+        self.rng = random.Random(seed if seed is None or shard is None else f"{seed}:shard{shard}")
+
+        self.pool = MQTTConnectionPool(mqtt_host, mqtt_port, connections, client_prefix, keepalive,
+                                       reconnect_rate, lockstep, first_index=(shard or 0) * connections)
+        self.stats = FleetStats()
+        self.sensors = []
+        self.intervals = []
+
+        for site_id in site_ids or fleet_site_ids(sites):
+            for n, depth in enumerate(self.depths, start=1):
+                sensor = DiveSensorSimulator(
+                    site_id=site_id,
+                    sensor_id=f"sensor_{n:02d}",
+                    mqtt_host=mqtt_host,
+                    mqtt_port=mqtt_port,
+                    depth=depth,
+                    mqtt_client=self.pool.client_for(len(self.sensors)),
+                    verbose=False,
+                    payload_format=payload_format,
+                    publish_profile=publish_profile,
+                    deadbands=deadbands,
+                    seed=seed
+                )
+                self.sensors.append(sensor)
+                self.intervals.append(self.rng.uniform(*interval))
+
+        if not verbose:
+            return
+        print(f"🤖 Flotta: {sites} siti x {len(self.depths)} profondità = {len(self.sensors)} sensori")
+        print(f"   Connessioni MQTT: {connections}, formato {payload_format}, profilo {publish_profile}")
+        print(f"   Intervallo: {interval[0]:g}-{interval[1]:g}s, jitter ±{jitter:.0%}, ramp-up {ramp_up:g}s")
+        if lockstep:
+            print("   Riconnessione: lockstep (ogni secondo, senza jitter né ammissione)")
+        else:
+            print(f"   Riconnessione: backoff con jitter decorrelato, ammissione {reconnect_rate:g} connessioni/s")
+
+    def next_delay(self, index):
+        """Intervallo del sensore con jitter casuale"""
+        return self.intervals[index] * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    def initial_schedule(self, start):
+        """Scadenze iniziali: distribuite sul ramp-up o con fase casuale"""
+        count = len(self.sensors)
+        schedule = []
+        for index in range(count):
+            if self.ramp_up > 0:
+                due = start + self.ramp_up * index / count
+            else:
+                due = start + self.rng.uniform(0, self.intervals[index])
+            schedule.append((due, index))
+        heapq.heapify(schedule)
+        return schedule
+
+    def publish_reading(self, index):
+        sensor = self.sensors[index]
+        self.stats.messages += sensor.publish_data(sensor.read_all_sensors())
+        self.stats.readings += 1
+
+        if self.rng.random() < self.event_probability:
+            sensor.simulate_random_event()
+
+    async def report_loop(self, every):
+        while True:
+            await asyncio.sleep(every)
+            readings_rate, messages_rate = self.stats.window_rates()
+            elapsed = time.monotonic() - self.stats.started_at
+            print(f"📈 t={elapsed:7.1f}s | letture {self.stats.readings:9d} | "
+                  f"{readings_rate:9.1f} letture/s | {messages_rate:9.1f} msg/s")
+
+    async def scheduler_loop(self, duration):
+        """Un solo task guida tutti i sensori tramite una coda di priorità"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        stop_at = start + duration if duration else None
+        schedule = self.initial_schedule(start)
+
+        while schedule:
+            now = loop.time()
+            if stop_at is not None and now >= stop_at:
+                break
+
+            published = 0
+            while schedule and schedule[0][0] <= now:
+                due, index = schedule[0]
+                self.publish_reading(index)
+                # Ripianifica rispetto alla scadenza, non all'istante attuale, per evitare deriva
+                heapq.heapreplace(schedule, (max(due + self.next_delay(index), now), index))
+                published += 1
+                # Cede periodicamente il controllo al task di report
+                if published % 1000 == 0:
+                    await asyncio.sleep(0)
+                    now = loop.time()
+
+            wake_at = schedule[0][0]
+            if stop_at is not None:
+                wake_at = min(wake_at, stop_at)
+            await asyncio.sleep(max(0, wake_at - loop.time()))
+
+    async def broker_restart(self, after, command):
+        """Scenario "riavvio broker": riavvia dopo `after` secondi, termina a recupero completo"""
+        await asyncio.sleep(after)
+        print(f"💥 Riavvio broker: {command}")
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                None, lambda: subprocess.run(shlex.split(command), capture_output=True, text=True))
+        except OSError as e:
+            print(f"❌ Riavvio non riuscito: {e}")
+            return
+        if result.returncode != 0:
+            print(f"❌ Riavvio non riuscito (exit {result.returncode}): {result.stderr.strip()}")
+            return
+
+        tracker = self.pool.tracker
+        while not tracker.recovered.is_set():
+            await asyncio.sleep(0.5)
+        recovery = tracker.summary()
+        print(f"✅ Flotta di nuovo connessa in {recovery['recovery_s']}s")
+        await asyncio.sleep(SETTLE_AFTER_RECOVERY)
+
+    async def run(self, duration=0, report_every=5.0, restart_after=None, restart_command=RESTART_COMMAND):
+        """Avvia la flotta per `duration` secondi (0 = fino a Ctrl+C o alla fine dello scenario)"""
+        if not self.pool.connect():
+            return None
+
+        print(f"\n🚀 Avvio flotta ({len(self.sensors)} sensori)")
+        print("   Premi Ctrl+C per fermare\n")
+
+        self.stats = FleetStats()
+        reporter = asyncio.create_task(self.report_loop(report_every))
+        tasks = [asyncio.create_task(self.scheduler_loop(duration))]
+        if restart_after is not None:
+            tasks.append(asyncio.create_task(self.broker_restart(restart_after, restart_command)))
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            for task in done:
+                task.result()
+        finally:
+            reporter.cancel()
+            self.pool.close()
+
+        return self.summary()
+
+    def summary(self):
+        summary = self.stats.summary()
+        summary["recovery"] = self.pool.tracker.summary()
+        return summary
+
+
+def print_summary(summary):
+    print("\n📊 Riepilogo flotta")
+    print(f"   Durata: {summary['elapsed_s']}s")
+    print(f"   Letture: {summary['readings']} ({summary['readings_per_s']}/s)")
+    print(f"   Messaggi MQTT: {summary['messages']} ({summary['messages_per_s']}/s, "
+          f"{summary['messages_per_reading']} per lettura)")
+    recovery = summary.get("recovery")
+    if recovery:
+        outcome = f"{recovery['recovery_s']}s" if recovery["recovered"] else f"non completo dopo {recovery['recovery_s']}s"
+        print(f"   Interruzione: {recovery['dropped']} connessioni cadute, recupero {outcome}")
+        print(f"   Tentativi di connessione: {recovery['attempts']} "
+              f"(picco {recovery['peak_attempts_per_s']}/s, riuscite al più {recovery['peak_connects_per_s']}/s)")
+
+
+def main():
+    print("🤖 Smart Dive Site Controller - Fleet Simulator")
+    print("=" * 70)
+
+    parser = argparse.ArgumentParser(description="Simulatore di flotta per test di carico MQTT")
+    parser.add_argument("--host", default="localhost", help="Broker MQTT")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--sites", type=int, default=100, help="Numero di siti virtuali")
+    parser.add_argument("--depths", default=",".join(DEPTHS), help="Profondità per sito (lista separata da virgole)")
+    parser.add_argument("--connections", type=int, default=4, help="Connessioni MQTT condivise")
+    parser.add_argument("--interval", type=parse_interval, default=(30.0, 30.0),
+                        help="Intervallo per sensore in secondi, fisso (10) o range (5-30)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Jitter relativo sull'intervallo (0.1 = ±10%%)")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Secondi su cui distribuire l'avvio dei sensori")
+    parser.add_argument("--duration", type=float, default=0, help="Durata in secondi (0 = fino a Ctrl+C)")
+    parser.add_argument("--report", type=float, default=5.0, help="Intervallo report throughput in secondi")
+    parser.add_argument("--events", type=float, default=0.1, help="Probabilità di evento casuale per lettura")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--format", default="json", choices=PAYLOAD_FORMATS, help="Formato payload letture")
+    parser.add_argument("--profile", default="full", choices=PUBLISH_PROFILES, help="Profilo di pubblicazione")
+    parser.add_argument("--deadband", type=parse_deadband, action="append", default=[],
+                        help="Deadband del profilo delta, es. temperature=0.5 (ripetibile)")
+    parser.add_argument("--client-prefix", default="dive_fleet",
+                        help="Prefisso dei client id (stabili: diverso per ogni flotta sullo stesso broker)")
+    parser.add_argument("--keepalive", type=int, default=KEEPALIVE, help="Keepalive MQTT in secondi")
+    parser.add_argument("--reconnect-rate", type=float, default=ADMISSION_RATE,
+                        help="Connessioni al secondo ammesse verso il broker (token bucket)")
+    parser.add_argument("--lockstep", action="store_true",
+                        help="Riconnessione ogni secondo senza jitter né ammissione (confronto)")
+    parser.add_argument("--scenario", default="steady", choices=["steady", "broker-restart"],
+                        help="broker-restart: riavvia il broker e misura il recupero della flotta")
+    parser.add_argument("--restart-after", type=float, default=30.0, help="Secondi prima del riavvio del broker")
+    parser.add_argument("--restart-command", default=RESTART_COMMAND, help="Comando che riavvia il broker")
+    parser.add_argument("--metrics-port", type=int,
+                        help=f"Espone /metrics Prometheus su questa porta (es. {metrics.METRICS_PORTS['simulator']})")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        metrics.start_metrics_server(args.metrics_port)
+
+    fleet = FleetSimulator(
+        sites=args.sites,
+        depths=args.depths.split(","),
+        mqtt_host=args.host,
+        mqtt_port=args.port,
+        connections=args.connections,
+        interval=args.interval,
+        jitter=args.jitter,
+        ramp_up=args.ramp_up,
+        event_probability=args.events,
+        seed=args.seed,
+        payload_format=args.format,
+        publish_profile=args.profile,
+        deadbands=dict(args.deadband),
+        client_prefix=args.client_prefix,
+        keepalive=args.keepalive,
+        reconnect_rate=args.reconnect_rate,
+        lockstep=args.lockstep
+    )
+
+    restart_after = args.restart_after if args.scenario == "broker-restart" else None
+    try:
+        summary = asyncio.run(fleet.run(duration=args.duration, report_every=args.report,
+                                        restart_after=restart_after, restart_command=args.restart_command))
+    except KeyboardInterrupt:
+        print("\n🛑 Simulazione interrotta dall'utente")
+        summary = fleet.summary()
+
+    if summary:
+        print_summary(summary)
+    print("✅ Simulazione terminata")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Flux Reader
+Query Flux lette in streaming dal CSV annotato e decodificate per colonna in array
+NumPy (o DataFrame pandas), senza creare un FluxRecord per ogni valore
+"""
+
+try:
+    import numpy as np
+except ImportError:  # NumPy serve per la decodifica colonnare
+    np = None
+
+try:
+    import pandas as pd
+except ImportError:  # pandas è opzionale: solo per frame()
+    pd = None
+
+# Righe per blocco in iter_chunks: memoria limitata anche su mesi di dati
+CHUNK_ROWS = 100_000
+
+# Colonne interne del risultato Flux, scartate se non richieste esplicitamente
+FLUX_INTERNAL = {"result", "table", "_start", "_stop"}
+
+PIVOT = '\n  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")'
+
+NUMERIC_TYPES = {"double", "long", "unsignedLong"}
+
+
+def decode_column(datatype, values):
+    """Stringhe CSV → array NumPy secondo l'annotazione #datatype (vuoto = NaN/NaT/None)"""
+    if datatype == "double" or (datatype in ("long", "unsignedLong") and "" in values):
+        if "" in values:
+            values = [value or "nan" for value in values]
+        return np.array(values, dtype=np.float64)
+    if datatype == "long":
+        return np.array(values, dtype=np.int64)
+    if datatype == "unsignedLong":
+        return np.array(values, dtype=np.uint64)
+    if datatype.startswith("dateTime"):
+        # RFC3339 sempre in UTC: NumPy vuole l'istante senza la "Z"
+        return np.array([value[:-1] if value else "NaT" for value in values], dtype="datetime64[ns]")
+    if datatype == "boolean":
+        return np.array(values) == "true"
+    return np.array([value or None for value in values], dtype=object)
+
+
+def merge_datatypes(current, other):
+    """Tipo comune di una colonna annotata diversamente in due tabelle (es. _value long e double)"""
+    if current == other:
+        return current
+    if current in NUMERIC_TYPES and other in NUMERIC_TYPES:
+        return "double"
+    return "string"
+
+
+def empty_column(sample, size):
+    """Colonna vuota compatibile con `sample` (NaN, NaT o None)"""
+    if sample.dtype.kind in "fiu":
+        return np.full(size, np.nan)
+    if sample.dtype.kind == "M":
+        return np.full(size, np.datetime64("NaT"), dtype=sample.dtype)
+    return np.full(size, None, dtype=object)
+
+
+class FluxReader:
+    """Esegue query Flux con query_csv (streaming) e restituisce colonne NumPy"""
+
+    def __init__(self, query_api, org=None, chunk_rows=CHUNK_ROWS):
+        if np is None:
+            raise ImportError("NumPy non installato: pip install numpy")
+        self.query_api = query_api
+        self.org = org
+        self.chunk_rows = chunk_rows
+
+    def iter_chunks(self, query, columns=None, pivot=False):
+        """Blocchi {colonna: array} di al più chunk_rows righe
+
+        Con pivot=True una riga per istante e serie con un campo per colonna (forma sensor_data).
+        Colonne assenti in una tabella sono vuote (NaN/None) nelle sue righe.
+        """
+        if pivot:
+            query = query.rstrip() + PIVOT
+        wanted = set(columns) if columns else None
+
+        data, datatypes = {}, {}
+        count = 0
+        appenders = missing = ()
+        header_next = False
+        row_types = []
+
+        def bind(header):
+            """Collega le posizioni dell'intestazione alle liste delle colonne"""
+            nonlocal appenders, missing
+            positions = {}
+            for position, name in enumerate(header):
+                if not name or (wanted is None and name in FLUX_INTERNAL) or (wanted and name not in wanted):
+                    continue
+                # Il tipo vale per la sola tabella: se cambia tra tabelle del blocco si promuove
+                datatype = row_types[position] if position < len(row_types) else "string"
+                if name not in data:
+                    data[name] = [""] * count
+                    datatypes[name] = datatype
+                else:
+                    datatypes[name] = merge_datatypes(datatypes[name], datatype)
+                positions[name] = position
+            appenders = [(data[name].append, position) for name, position in positions.items()]
+            missing = [data[name].append for name in data if name not in positions]
+
+        header = None
+        for row in self.query_api.query_csv(query, org=self.org):
+            if not row or not any(row):
+                continue
+            first = row[0]
+            if first.startswith("#"):
+                if first == "#datatype":
+                    row_types = row
+                    header_next = True
+                continue
+            if header_next or header is None:
+                # Intestazione: ripetuta per ogni tabella con colonne diverse
+                header_next = False
+                header = row
+                bind(header)
+                continue
+
+            for append, position in appenders:
+                append(row[position])
+            for append in missing:
+                append("")
+            count += 1
+
+            if count >= self.chunk_rows:
+                yield {name: decode_column(datatypes[name], values) for name, values in data.items()}
+                data = {name: [] for name in data}
+                count = 0
+                bind(header)
+
+        if count:
+            yield {name: decode_column(datatypes[name], values) for name, values in data.items()}
+
+    def columns(self, query, columns=None, pivot=False):
+        """Tutto il risultato come {colonna: array} (blocchi concatenati)"""
+        chunks = list(self.iter_chunks(query, columns, pivot))
+        if not chunks:
+            return {}
+        if len(chunks) == 1:
+            return chunks[0]
+        # Una colonna comparsa a metà risultato è vuota nei blocchi precedenti
+        result = {}
+        for name in chunks[-1]:
+            sample = next(chunk[name] for chunk in chunks if name in chunk)
+            parts = [chunk[name] if name in chunk else empty_column(sample, len(next(iter(chunk.values()))))
+                     for chunk in chunks]
+            result[name] = np.concatenate(parts)
+        return result
+
+    def frame(self, query, columns=None, pivot=False):
+        """Risultato come DataFrame pandas"""
+        if pd is None:
+            raise ImportError("pandas non installato: pip install pandas")
+        frame = pd.DataFrame(self.columns(query, columns, pivot))
+        if "_time" in frame:
+            frame["_time"] = frame["_time"].dt.tz_localize("UTC")
+        return frame
+
+    def total(self, query, column="_value"):
+        """Somma di una colonna numerica (es. risultati di count()) senza tenere il risultato in memoria"""
+        return sum(chunk[column].sum().item() for chunk in self.iter_chunks(query, [column]) if column in chunk)
+
+
+def iso_times(times):
+    """datetime64[ns] → stringhe ISO UTC al secondo ("...Z"), come i timestamp dell'API"""
+    return [f"{value}Z" for value in np.datetime_as_string(times, unit="s")]
@@ -1,68 +1,338 @@
 #!/usr/bin/env python3
 """
 Health Check per Smart Dive Controller
+Controlli in parallelo (asyncio) con latenze: servizi Docker/HTTP, round-trip MQTT,
+freschezza scrittura → query su InfluxDB ed età dell'ultimo dato per sito.
+In modalità daemon espone le metriche in formato Prometheus su /metrics
 """
 
-import requests
-import subprocess
+import paho.mqtt.client as mqtt
+from influxdb_client import InfluxDBClient, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+import argparse
+import asyncio
 import json
+import os
+import requests
+import sys
+import threading
+import time
 from datetime import datetime
 
-def check_service(name, url):
-    try:
-        response = requests.get(url, timeout=5)
-        if response.status_code == 200:
-            print(f"✅ {name}: OK")
-            return True
-        else:
-            print(f"❌ {name}: HTTP {response.status_code}")
-            return False
-    except Exception as e:
-        print(f"❌ {name}: {e}")
-        return False
-
-def check_docker_services():
+import metrics
+from database_init import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET
+from dive_schema import HEALTH_PROBE
+from flux_reader import FluxReader
+from latest_state import OFFLINE_AFTER, SITE_CATALOG
+
+HTTP_SERVICES = [
+    ("influxdb", "InfluxDB", f"{INFLUXDB_URL}/health"),
+    ("nodered", "Node-RED", "http://localhost:1880"),
+    ("grafana", "Grafana", "http://localhost:3000/api/health"),
+]
+DOCKER_CONTAINERS = ["dive_influxdb", "dive_mosquitto", "dive_nodered", "dive_grafana"]
+
+PROBE_TIMEOUT = 5.0         # secondi per singolo controllo (i controlli girano in parallelo)
+POLL_INTERVAL = 0.1         # attesa tra due query della sonda di freschezza
+CANARY_TOPIC = "dive/_health/canary"
+
+
+class ProbeResult:
+    """Esito di un controllo: latenza in secondi, `value` per le metriche con un valore proprio
+
+    Un esito `advisory` è solo informativo: mostrato ed esportato per sito, ma escluso dallo
+    stato complessivo (dive_health_up) e dal codice di uscita.
+    """
+
+    def __init__(self, check, name, ok, latency=None, detail="", labels=None, value=None, advisory=False):
+        self.check = check
+        self.name = name
+        self.ok = ok
+        self.latency = latency
+        self.detail = detail
+        self.labels = labels or {}
+        self.value = value
+        self.advisory = advisory
+
+    @property
+    def failed(self):
+        return not self.ok and not self.advisory
+
+
+def mqtt_roundtrip(host, port, timeout=PROBE_TIMEOUT):
+    """Pubblica un canary su dive/_health/canary/<id> e misura quando torna dal broker"""
+    probe_id = f"{os.getpid()}_{time.monotonic_ns()}"
+    topic = f"{CANARY_TOPIC}/{probe_id}"
+    subscribed = threading.Event()
+    arrived = threading.Event()
+    timings = {}
+
+    client = mqtt.Client(client_id=f"dive_health_{probe_id}")
+
+    def on_subscribe(client, userdata, mid, granted_qos):
+        subscribed.set()
+
+    def on_message(client, userdata, msg):
+        timings["arrived"] = time.perf_counter()
+        arrived.set()
+
+    client.on_subscribe = on_subscribe
+    client.on_message = on_message
+    deadline = time.monotonic() + timeout
+    started = time.perf_counter()
     try:
-        result = subprocess.run(['docker', 'ps'], capture_output=True, text=True)
-        if 'dive_influxdb' in result.stdout and 'dive_mosquitto' in result.stdout:
-            print("✅ Docker services: OK")
-            return True
-        else:
-            print("❌ Docker services: NOK")
-            return False
-    except Exception as e:
-        print(f"❌ Docker: {e}")
-        return False
+        client.connect(host, port, keepalive=int(timeout) + 5)
+        client.loop_start()
+        client.subscribe(topic, qos=1)
+        if not subscribed.wait(max(deadline - time.monotonic(), 0)):
+            raise TimeoutError("sottoscrizione non confermata")
+        connected = time.perf_counter() - started
+
+        timings["sent"] = time.perf_counter()
+        client.publish(topic, json.dumps({"probe": probe_id}), qos=1)
+        if not arrived.wait(max(deadline - time.monotonic(), 0)):
+            raise TimeoutError("canary non ricevuto")
+        return timings["arrived"] - timings["sent"], connected
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+def influx_freshness(client, bucket=INFLUXDB_BUCKET, timeout=PROBE_TIMEOUT):
+    """Scrive un punto sonda e interroga finché non è visibile: secondi tra scrittura e lettura"""
+    seq = time.time_ns()
+    line = HEALTH_PROBE.encoder("ns").encode_record({"probe": "freshness", "seq": seq}, seq, time_unit="ns")
+    query = f'''
+    from(bucket: "{bucket}")
+      |> range(start: -5m)
+      |> filter(fn: (r) => r["_measurement"] == "{HEALTH_PROBE.name}" and r["_field"] == "seq")
+      |> filter(fn: (r) => r["_value"] == {seq})
+      |> count()
+    '''
+    reader = FluxReader(client.query_api(), INFLUXDB_ORG)
+    write_api = client.write_api(write_options=SYNCHRONOUS)
+
+    started = time.perf_counter()
+    write_api.write(bucket=bucket, org=INFLUXDB_ORG, record=line, write_precision=WritePrecision.NS)
+    written = time.perf_counter() - started
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if reader.total(query) > 0:
+            return time.perf_counter() - started, written
+        time.sleep(POLL_INTERVAL)
+    raise TimeoutError("punto sonda non visibile nelle query")
+
+
+def site_data_ages(client, bucket=INFLUXDB_BUCKET, lookback="24h"):
+    """Età in secondi dell'ultima lettura di ogni sito (un solo campo)
+
+    last() per serie, poi il più recente per sito: dopo group() le righe non sono ordinate per
+    _time e last() darebbe l'ultima riga letta, non l'ultima lettura.
+    """
+    query = f'''
+    from(bucket: "{bucket}")
+      |> range(start: -{lookback})
+      |> filter(fn: (r) => r["_measurement"] == "dive_conditions" and r["_field"] == "battery_level")
+      |> last()
+      |> group(columns: ["site_id"])
+      |> max(column: "_time")
+    '''
+    columns = FluxReader(client.query_api(), INFLUXDB_ORG).columns(query, columns=["site_id", "_time"])
+    if not columns:
+        return {}
+    now_ns = time.time_ns()
+    ages = (now_ns - columns["_time"].astype("int64")) / 1e9
+    return dict(zip(columns["site_id"].tolist(), ages.tolist()))
+
+
+class HealthChecker:
+    def __init__(self, mqtt_host="localhost", mqtt_port=1883, timeout=PROBE_TIMEOUT,
+                 stale_after=OFFLINE_AFTER, docker=True, all_sites=False):
+        self.mqtt_host = mqtt_host
+        self.mqtt_port = mqtt_port
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.docker = docker
+        self.all_sites = all_sites          # anche i siti fuori catalogo incidono sull'esito
+        self.client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG,
+                                     timeout=int(timeout * 1000))
+
+    async def check_docker(self):
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            "docker", "ps", "--format", "{{.Names}}",
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, _ = await process.communicate()
+        latency = time.perf_counter() - started
+        running = set(stdout.decode().split())
+        missing = [name for name in DOCKER_CONTAINERS if name not in running]
+        detail = f"mancano: {', '.join(missing)}" if missing else f"{len(DOCKER_CONTAINERS)} container attivi"
+        return [ProbeResult("docker", "Docker Services", not missing, latency, detail)]
+
+    async def check_http(self, check, name, url):
+        started = time.perf_counter()
+        response = await asyncio.to_thread(requests.get, url, timeout=self.timeout)
+        latency = time.perf_counter() - started
+        return [ProbeResult(check, name, response.status_code == 200, latency, f"HTTP {response.status_code}")]
+
+    async def check_mqtt(self):
+        roundtrip, connected = await asyncio.to_thread(mqtt_roundtrip, self.mqtt_host, self.mqtt_port, self.timeout)
+        return [ProbeResult("mqtt_roundtrip", "Mosquitto round-trip", True, roundtrip,
+                            f"connessione+sottoscrizione {connected * 1000:.0f} ms")]
+
+    async def check_freshness(self):
+        visible, written = await asyncio.to_thread(influx_freshness, self.client, timeout=self.timeout)
+        return [ProbeResult("influx_freshness", "InfluxDB scrittura → query", True, visible,
+                            f"scrittura {written * 1000:.0f} ms")]
+
+    async def check_sites(self):
+        started = time.perf_counter()
+        ages = await asyncio.to_thread(site_data_ages, self.client)
+        latency = time.perf_counter() - started
+        results = []
+        for site_id in sorted(set(ages) | set(SITE_CATALOG)):
+            age = ages.get(site_id)
+            if age is None:
+                results.append(ProbeResult("site_data_age", f"Dati {site_id}", False, latency,
+                                           "nessun dato nelle ultime 24h", {"site_id": site_id}))
+            else:
+                # Siti di flotte e benchmark (site_NNN, bench_site_NNN) restano nelle 24h dopo la prova
+                advisory = site_id not in SITE_CATALOG and not self.all_sites
+                detail = f"ultimo dato {age:.0f}s fa" + (" (fuori catalogo, solo informativo)" if advisory else "")
+                results.append(ProbeResult("site_data_age", f"Dati {site_id}", age <= self.stale_after, latency,
+                                           detail, {"site_id": site_id}, value=age, advisory=advisory))
+        return results
+
+    async def guarded(self, check, name, probe):
+        """Esegue un controllo con timeout: un errore diventa un esito negativo, non un'eccezione"""
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(probe, self.timeout + 1)
+        except asyncio.TimeoutError:
+            detail = f"timeout dopo {self.timeout:g}s"
+        except Exception as e:
+            detail = str(e) or type(e).__name__
+        return [ProbeResult(check, name, False, time.perf_counter() - started, detail)]
+
+    async def run(self):
+        """Tutti i controlli in parallelo: la durata è quella del più lento"""
+        probes = []
+        if self.docker:
+            probes.append(self.guarded("docker", "Docker Services", self.check_docker()))
+        probes += [self.guarded(check, name, self.check_http(check, name, url)) for check, name, url in HTTP_SERVICES]
+        probes += [
+            self.guarded("mqtt_roundtrip", "Mosquitto round-trip", self.check_mqtt()),
+            self.guarded("influx_freshness", "InfluxDB scrittura → query", self.check_freshness()),
+            self.guarded("site_data_age", "Dati per sito", self.check_sites()),
+        ]
+        results = []
+        for group in await asyncio.gather(*probes):
+            results += group
+        return results
+
+    def close(self):
+        self.client.close()
+
+
+def print_results(results, elapsed):
+    for result in results:
+        latency = f" ({result.latency * 1000:.0f} ms)" if result.latency is not None else ""
+        status = "OK" if result.ok else "NOK"
+        icon = "✅" if result.ok else "ℹ️" if result.advisory else "❌"
+        print(f"{icon} {result.name}: {status}{latency} - {result.detail}")
+    print(f"\n⏱️ {len(results)} controlli in {elapsed:.2f}s")
+
+
+UP = metrics.gauge("dive_health_up", "Esito dell'ultimo controllo (1 = OK)", ["check"])
+SITE_UP = metrics.gauge("dive_health_site_up", "Dati recenti per sito (1 = OK)", ["site_id"])
+LATENCY = metrics.gauge("dive_health_latency_seconds", "Latenza dell'ultimo controllo", ["check"])
+CHECK_SECONDS = metrics.histogram("dive_health_check_seconds", "Distribuzione delle latenze dei controlli", ["check"])
+SITE_AGE = metrics.gauge("dive_health_site_data_age_seconds", "Età dell'ultima lettura ricevuta per sito", ["site_id"])
+LAST_RUN = metrics.gauge("dive_health_last_run_timestamp_seconds", "Fine dell'ultimo giro di controlli")
+
+
+def record_metrics(results, finished_at):
+    """Esiti di un giro nelle metriche esportate su /metrics"""
+    checks = {}
+    for result in results:
+        if result.check == "site_data_age" and "site_id" in result.labels:
+            SITE_UP.labels(result.labels["site_id"]).set(int(result.ok))
+            if result.value is not None:
+                SITE_AGE.labels(result.labels["site_id"]).set(round(result.value, 1))
+        # I controlli per sito condividono la stessa query: un esito e una latenza per controllo
+        ok, latency = checks.get(result.check, (True, result.latency))
+        checks[result.check] = (ok and not result.failed, latency)
+
+    for check, (ok, latency) in checks.items():
+        UP.labels(check).set(int(ok))
+        if latency is not None:
+            LATENCY.labels(check).set(latency)
+            CHECK_SECONDS.labels(check).observe(latency)
+    LAST_RUN.set(finished_at)
+
+
+class HealthDaemon:
+    """Ripete i controlli a intervallo fisso e serve l'ultimo esito su /metrics"""
+
+    def __init__(self, checker, interval=30.0):
+        self.checker = checker
+        self.interval = interval
+
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            results = await self.checker.run()
+            record_metrics(results, time.time())
+            failed = [result.name for result in results if result.failed]
+            print(f"[{datetime.now():%H:%M:%S}] {len(results) - len(failed)}/{len(results)} OK"
+                  + (f" - NOK: {', '.join(failed)}" if failed else ""))
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), 0))
+
 
 def main():
     print("🔍 Smart Dive Controller - Health Check")
     print("=" * 50)
     print(f"Timestamp: {datetime.now()}")
     print()
-    
-    services = [
-        ("Docker Services", None),
-        ("InfluxDB", "http://localhost:8086/health"),
-        ("Node-RED", "http://localhost:1880"),
-        ("Grafana", "http://localhost:3000/api/health"),
-    ]
-    
-    all_ok = True
-    
-    # Check Docker first
-    if not check_docker_services():
-        all_ok = False
-    
-    # Check other services
-    for name, url in services[1:]:
-        if not check_service(name, url):
-            all_ok = False
-    
+
+    parser = argparse.ArgumentParser(description="Controllo salute del sistema (controlli in parallelo)")
+    parser.add_argument("--mqtt-host", default="localhost", help="Broker MQTT")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--timeout", type=float, default=PROBE_TIMEOUT, help="Timeout per controllo (s)")
+    parser.add_argument("--stale-after", type=float, default=OFFLINE_AFTER,
+                        help="Secondi senza dati prima di segnalare un sito")
+    parser.add_argument("--no-docker", action="store_true", help="Salta il controllo dei container")
+    parser.add_argument("--all-sites", action="store_true",
+                        help="Anche i siti fuori catalogo (flotte, benchmark) con dati vecchi sono un errore")
+    parser.add_argument("--daemon", action="store_true", help="Controlli periodici con metriche Prometheus")
+    parser.add_argument("--interval", type=float, default=30.0, help="Secondi tra due giri (daemon)")
+    parser.add_argument("--metrics-port", type=int, default=metrics.METRICS_PORTS["health_check"], help="Porta di /metrics (daemon)")
+    args = parser.parse_args()
+
+    checker = HealthChecker(args.mqtt_host, args.mqtt_port, args.timeout, args.stale_after, not args.no_docker,
+                            args.all_sites)
+    try:
+        if args.daemon:
+            metrics.start_metrics_server(args.metrics_port)
+            asyncio.run(HealthDaemon(checker, args.interval).run())
+            return
+
+        started = time.perf_counter()
+        results = asyncio.run(checker.run())
+        print_results(results, time.perf_counter() - started)
+    except KeyboardInterrupt:
+        print("\n🛑 Health check interrotto dall'utente")
+        return
+    finally:
+        checker.close()
+
     print()
-    if all_ok:
+    if not any(result.failed for result in results):
         print("🎉 Sistema: TUTTO OK")
     else:
         print("⚠️ Sistema: PROBLEMI RILEVATI")
+        sys.exit(1)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Ingest Bridge MQTT → InfluxDB
+Sostituisce la scrittura HTTP per-messaggio di Node-RED con micro-batch
+line protocol, backpressure e buffer di spill su disco
+"""
+
+import paho.mqtt.client as mqtt
+from influxdb_client import WritePrecision
+import argparse
+import os
+import threading
+import time
+
+from metrics import METRICS_PORTS, start_metrics_server
+from bulk_loader import BulkLoader
+from sensor_codec import decode_payload
+from database_init import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET
+from dive_schema import DIVE_CONDITIONS, to_ns
+
+# sensors/batch: letture recuperate dal buffer offline dei sensori, con i timestamp originali
+SENSOR_TOPICS = ["dive/+/sensors/data", "dive/+/sensors/bin", "dive/+/sensors/batch"]
+
+# Stesse regole del nodo Node-RED "Validate Data"
+REQUIRED_FIELDS = ['timestamp', 'site_id', 'sensor_id', 'temperature', 'current_speed',
+                   'visibility', 'luminosity', 'battery_level']
+
+VALIDATION_RULES = [
+    {"field": "temperature", "min": -10, "max": 40, "unit": "°C"},
+    {"field": "current_speed", "min": 0, "max": 5, "unit": "m/s"},
+    {"field": "visibility", "min": 0, "max": 50, "unit": "m"},
+    {"field": "luminosity", "min": 0, "max": 100000, "unit": "lux"},
+    {"field": "battery_level", "min": 0, "max": 100, "unit": "%"},
+]
+
+DIVE_CONDITIONS_LINES = DIVE_CONDITIONS.encoder("ns")
+
+
+def validate_sensor_data(data):
+    """Valida una lettura, ritorna la lista degli errori (vuota se valida)"""
+    missing = [field for field in REQUIRED_FIELDS if field not in data]
+    if missing:
+        return [f"Campi mancanti: {', '.join(missing)}"]
+
+    errors = []
+    for rule in VALIDATION_RULES:
+        value = data[rule["field"]]
+        if not isinstance(value, (int, float)) or not rule["min"] <= value <= rule["max"]:
+            errors.append(f"{rule['field']}: {value}{rule['unit']} fuori range [{rule['min']}-{rule['max']}]")
+    return errors
+
+
+def reading_time_ns(data, fallback_ns):
+    """Timestamp della lettura in ns: ISO (simulatore) o Unix (ESP32), altrimenti arrivo"""
+    timestamp = data.get("timestamp")
+    try:
+        if (isinstance(timestamp, (int, float)) and timestamp > 0) or isinstance(timestamp, str):
+            return to_ns(timestamp)
+    except ValueError:
+        pass
+    return fallback_ns
+
+
+def to_line_protocol(data, timestamp_ns):
+    """Riga line protocol equivalente al nodo "Format for InfluxDB HTTP", tipi dallo schema"""
+    return DIVE_CONDITIONS_LINES.encode_record(data, timestamp_ns, time_unit="ns")
+
+
+class SpillBuffer:
+    """Buffer su disco per i batch che InfluxDB non riesce ad assorbire"""
+
+    def __init__(self, directory="spill", max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.dropped_lines = 0
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(os.path.getsize(path) for path in self.files())
+
+    def files(self):
+        """File in attesa, dal più vecchio"""
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".lp"))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def spill(self, lines):
+        data = "\n".join(lines).encode()
+        with self.lock:
+            if self.size + len(data) > self.max_bytes:
+                self.dropped_lines += len(lines)
+                print(f"⚠️ Spill pieno, scartate {len(lines)} righe")
+                return False
+            path = os.path.join(self.directory, f"batch_{time.time_ns()}.lp")
+            # Scrittura atomica: un file parziale non viene mai riletto
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+            self.size += len(data)
+        return True
+
+    def drain(self, submit, limit=8):
+        """Riaccoda fino a `limit` file; si ferma appena il writer è saturo"""
+        drained = 0
+        for path in self.files()[:limit]:
+            with open(path, "rb") as f:
+                data = f.read()
+            if not submit(data.decode().split("\n")):
+                break
+            with self.lock:
+                os.remove(path)
+                self.size -= len(data)
+            drained += 1
+        return drained
+
+
+class IngestBridge:
+    def __init__(self, mqtt_host="localhost", mqtt_port=1883, batch_lines=5000, max_latency=1.0,
+                 writers=2, max_inflight=4, spill_dir="spill", quarantine_dir="quarantine", retry_cooldown=10.0):
+        self.mqtt_host = mqtt_host
+        self.mqtt_port = mqtt_port
+        self.batch_lines = batch_lines
+        self.max_latency = max_latency
+        self.retry_cooldown = retry_cooldown
+        self.is_running = False
+
+        self.pending = []
+        self.pending_since = None
+        self.lock = threading.Lock()
+        self.last_failure = 0.0
+
+        self.received = 0
+        self.invalid = 0
+        self.spilled_batches = 0
+        self.quarantined_batches = 0
+
+        self.spill = SpillBuffer(spill_dir)
+        # Batch rifiutati da InfluxDB (4xx): mai riaccodati, restano su disco per l'analisi
+        self.quarantine = SpillBuffer(quarantine_dir)
+        self.loader = BulkLoader(
+            url=INFLUXDB_URL,
+            token=INFLUXDB_TOKEN,
+            org=INFLUXDB_ORG,
+            bucket=INFLUXDB_BUCKET,
+            batch_size=batch_lines,
+            workers=writers,
+            max_inflight=max_inflight,
+            retries=3,
+            precision=WritePrecision.NS,
+            on_failure=self.on_write_failure
+        )
+
+        self.client = mqtt.Client(client_id="dive_ingest_bridge")
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            print(f"✅ Connesso al broker MQTT {self.mqtt_host}:{self.mqtt_port}")
+            for topic in SENSOR_TOPICS:
+                client.subscribe(topic)
+                print(f"   📡 Subscribed: {topic}")
+        else:
+            print(f"❌ Errore connessione MQTT: {rc}")
+
+    def on_disconnect(self, client, userdata, rc):
+        print(f"🔌 Disconnesso dal broker (rc: {rc})")
+
+    def on_message(self, client, userdata, msg):
+        received_ns = time.time_ns()
+        try:
+            data = decode_payload(msg.payload)
+        except ValueError:
+            self.received += 1
+            self.invalid += 1
+            return
+
+        readings = data if isinstance(data, list) else (data,)
+        self.received += len(readings)
+        for reading in readings:
+            if not isinstance(reading, dict) or validate_sensor_data(reading):
+                self.invalid += 1
+                continue
+            self.add_line(to_line_protocol(reading, reading_time_ns(reading, received_ns)))
+
+    def add_line(self, line):
+        with self.lock:
+            if not self.pending:
+                self.pending_since = time.monotonic()
+            self.pending.append(line)
+            if len(self.pending) < self.batch_lines:
+                return
+            batch = self._take_pending()
+        self.dispatch(batch)
+
+    def _take_pending(self):
+        batch, self.pending = self.pending, []
+        self.pending_since = None
+        return batch
+
+    def dispatch(self, batch):
+        """Un batch = una richiesta; se i writer sono saturi il batch va su disco"""
+        if not self.loader.submit(batch, block=False):
+            self.spilled_batches += 1
+            self.spill.spill(batch)
+
+    def on_write_failure(self, batch, retryable):
+        if not retryable:
+            # Nello spill verrebbe ridrenato e rifiutato all'infinito, bloccando i batch dietro
+            self.quarantined_batches += 1
+            self.quarantine.spill(batch)
+            return
+        self.last_failure = time.monotonic()
+        self.spilled_batches += 1
+        self.spill.spill(batch)
+
+    def flush_loop(self):
+        """Chiude i batch per tempo e ridrena lo spill quando InfluxDB torna disponibile"""
+        while self.is_running:
+            time.sleep(min(self.max_latency / 4, 0.25))
+
+            with self.lock:
+                expired = (self.pending_since is not None and
+                           time.monotonic() - self.pending_since >= self.max_latency)
+                batch = self._take_pending() if expired else None
+            if batch:
+                self.dispatch(batch)
+
+            if time.monotonic() - self.last_failure >= self.retry_cooldown:
+                self.spill.drain(lambda lines: self.loader.submit(lines, block=False))
+
+    def print_stats(self):
+        stats = self.loader.stats
+        print(f"📈 ricevuti {self.received} | scartati {self.invalid} | "
+              f"scritti {stats.points} ({stats.points_per_s:.0f} punti/s, {stats.batches} richieste) | "
+              f"spill {self.spilled_batches} batch, {self.spill.size / 1024:.0f} KB in coda | "
+              f"quarantena {self.quarantined_batches} batch")
+
+    def run(self, report_every=10.0):
+        try:
+            self.client.connect(self.mqtt_host, self.mqtt_port, 60)
+        except Exception as e:
+            print(f"❌ Errore connessione MQTT: {e}")
+            return
+
+        self.is_running = True
+        flusher = threading.Thread(target=self.flush_loop, daemon=True)
+        flusher.start()
+        self.client.loop_start()
+
+        print(f"\n🚀 Ingest attivo (batch {self.batch_lines} righe / {self.max_latency}s)")
+        print("   Premi Ctrl+C per fermare\n")
+
+        try:
+            while True:
+                time.sleep(report_every)
+                self.print_stats()
+        except KeyboardInterrupt:
+            print("\n🛑 Ingest interrotto dall'utente")
+        finally:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.is_running = False
+            flusher.join()
+            with self.lock:
+                batch = self._take_pending()
+            if batch:
+                self.dispatch(batch)
+            self.loader.close()
+            self.print_stats()
+            print("✅ Ingest terminato")
+
+
+def main():
+    print("🌉 Smart Dive Site Controller - Ingest Bridge MQTT → InfluxDB")
+    print("=" * 70)
+
+    parser = argparse.ArgumentParser(description="Bridge MQTT → InfluxDB con micro-batch")
+    parser.add_argument("--host", default="localhost", help="Broker MQTT")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--batch-lines", type=int, default=5000, help="Righe massime per richiesta")
+    parser.add_argument("--max-latency", type=float, default=1.0, help="Secondi massimi di attesa di un batch")
+    parser.add_argument("--writers", type=int, default=2, help="Writer InfluxDB concorrenti")
+    parser.add_argument("--max-inflight", type=int, default=4, help="Batch in coda prima dello spill su disco")
+    parser.add_argument("--spill-dir", default="spill", help="Directory buffer su disco")
+    parser.add_argument("--quarantine-dir", default="quarantine",
+                        help="Directory dei batch rifiutati da InfluxDB (4xx), non ritentati")
+    parser.add_argument("--metrics-port", type=int,
+                        help=f"Espone /metrics Prometheus su questa porta (es. {METRICS_PORTS['bulk_loader']})")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    bridge = IngestBridge(
+        mqtt_host=args.host,
+        mqtt_port=args.port,
+        batch_lines=args.batch_lines,
+        max_latency=args.max_latency,
+        writers=args.writers,
+        max_inflight=args.max_inflight,
+        spill_dir=args.spill_dir,
+        quarantine_dir=args.quarantine_dir
+    )
+    bridge.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Latest State Cache
+Ultima lettura e stato di ogni sensore in memoria, aggiornati da MQTT:
+/sites e /current non interrogano più InfluxDB (solo all'avvio a freddo)
+"""
+
+from datetime import datetime, timezone
+import threading
+import time
+
+from database_init import INFLUXDB_ORG, INFLUXDB_BUCKET
+from sensor_codec import decode_payload
+
+# Anagrafica siti (prima hard-coded nel nodo Node-RED "Get All Sites")
+SITE_CATALOG = {
+    "capo_vaticano": {"name": "Capo Vaticano", "latitude": 38.6878, "longitude": 15.8742, "depth_category": "shallow"},
+    "tropea_reef": {"name": "Tropea Reef", "latitude": 38.6767, "longitude": 15.8989, "depth_category": "deep"},
+    "stromboli_east": {"name": "Stromboli East", "latitude": 38.7891, "longitude": 15.2134, "depth_category": "surface"},
+}
+
+OFFLINE_AFTER = 300       # secondi senza dati prima di considerare un sensore offline
+LOW_BATTERY = 20.0        # sotto questa soglia il sensore è in warning
+
+
+def iso_utc(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class SensorState:
+    """Riga compatta della tabella di stato"""
+    __slots__ = ("site_id", "sensor_id", "depth", "reading", "updated_at")
+
+    def __init__(self, site_id, sensor_id, depth):
+        self.site_id = site_id
+        self.sensor_id = sensor_id
+        self.depth = depth
+        self.reading = None
+        self.updated_at = 0.0
+
+
+class LatestStateStore:
+    """Tabella (site_id, sensor_id, depth) → ultima lettura, con indice per sito"""
+
+    def __init__(self, offline_after=OFFLINE_AFTER):
+        self.offline_after = offline_after
+        self.lock = threading.Lock()
+        self.sensors = {}        # (site_id, sensor_id, depth) -> SensorState
+        self.by_site = {}        # site_id -> {(sensor_id, depth): SensorState}
+        self.site_latest = {}    # site_id -> SensorState aggiornato più di recente
+        self.site_flags = {}     # site_id -> {"online": ..., "battery": ..., "rssi": ...} dai topic status
+        self.version = 0         # incrementato a ogni modifica
+
+    def subscriptions(self):
+        """Topic MQTT e callback da registrare sul client condiviso"""
+        return [
+            ("dive/+/sensors/data", self.on_sensor_message),
+            ("dive/+/sensors/bin", self.on_sensor_message),
+            ("dive/+/status/+", self.on_status_message),
+        ]
+
+    def on_sensor_message(self, client, userdata, msg):
+        try:
+            data = decode_payload(msg.payload)
+        except ValueError:
+            return
+        if isinstance(data, dict) and "site_id" in data:
+            self.update_reading(data)
+
+    def on_status_message(self, client, userdata, msg):
+        _, site_id, _, kind = msg.topic.split("/", 3)
+        value = msg.payload.decode(errors="replace").strip()
+        try:
+            value = float(value)
+        except ValueError:
+            value = value.strip('"')
+        self.update_status(site_id, kind, value)
+
+    def update_reading(self, data, updated_at=None):
+        site_id = data["site_id"]
+        sensor_id = data.get("sensor_id", "unknown")
+        depth = data.get("depth", "unknown")
+        key = (site_id, sensor_id, depth)
+
+        with self.lock:
+            state = self.sensors.get(key)
+            if state is None:
+                state = self.sensors[key] = SensorState(site_id, sensor_id, depth)
+                self.by_site.setdefault(site_id, {})[(sensor_id, depth)] = state
+            state.reading = data
+            state.updated_at = updated_at or time.time()
+
+            latest = self.site_latest.get(site_id)
+            if latest is None or latest.updated_at <= state.updated_at:
+                self.site_latest[site_id] = state
+            self.version += 1
+
+    def update_status(self, site_id, kind, value):
+        with self.lock:
+            flags = self.site_flags.setdefault(site_id, {})
+            flags[kind] = value
+            flags["updated_at"] = time.time()
+            self.version += 1
+
+    def sensor_status(self, state, now):
+        if now - state.updated_at > self.offline_after:
+            return "offline"
+        battery = state.reading.get("battery_level")
+        if isinstance(battery, (int, float)) and battery < LOW_BATTERY:
+            return "warning"
+        return "online"
+
+    def site_status(self, site_id, now=None):
+        """Stato del sito: il peggiore tra i suoi sensori e i messaggi di status"""
+        now = now or time.time()
+        with self.lock:
+            states = list(self.by_site.get(site_id, {}).values())
+        statuses = [self.sensor_status(state, now) for state in states]
+        flags = self.site_flags.get(site_id, {})
+
+        if not statuses or all(status == "offline" for status in statuses) or flags.get("online") == "offline":
+            return "offline"
+        battery = flags.get("battery")
+        if "offline" in statuses or "warning" in statuses or (
+                isinstance(battery, float) and battery < LOW_BATTERY):
+            return "warning"
+        return "online"
+
+    def known_sites(self):
+        sites = list(SITE_CATALOG)
+        sites += sorted(site for site in self.by_site if site not in SITE_CATALOG)
+        return sites
+
+    def has_site(self, site_id):
+        return site_id in SITE_CATALOG or site_id in self.by_site
+
+    def site_info(self, site_id, now=None):
+        """Voce di /api/dive/sites"""
+        now = now or time.time()
+        catalog = SITE_CATALOG.get(site_id, {})
+        latest = self.site_latest.get(site_id)
+        updated_at = max(latest.updated_at if latest else 0.0,
+                         self.site_flags.get(site_id, {}).get("updated_at", 0.0))
+        return {
+            "site_id": site_id,
+            "name": catalog.get("name", site_id.replace("_", " ").title()),
+            "latitude": catalog.get("latitude"),
+            "longitude": catalog.get("longitude"),
+            "depth_category": catalog.get("depth_category", latest.depth if latest else None),
+            "status": self.site_status(site_id, now),
+            "last_update": iso_utc(updated_at) if updated_at else None,
+        }
+
+    def sites(self):
+        now = time.time()
+        return [self.site_info(site_id, now) for site_id in self.known_sites()]
+
+    def overview(self, alert_count, now=None):
+        """Voci di /api/dive/overview: anagrafica, stato, ultima lettura e alert aperti di ogni sito"""
+        now = now or time.time()
+        return [dict(self.site_info(site_id, now),
+                     current=self.current(site_id),
+                     active_alerts=alert_count(site_id))
+                for site_id in self.known_sites()]
+
+    def statuses(self, now=None):
+        """Stato di ogni sito: cambia anche senza messaggi (sensori che vanno offline)"""
+        now = now or time.time()
+        return tuple(self.site_status(site_id, now) for site_id in self.known_sites())
+
+    def current(self, site_id, depth=None):
+        """Ultima lettura del sito (o di una profondità): lookup O(1)"""
+        if depth is None:
+            state = self.site_latest.get(site_id)
+        else:
+            with self.lock:
+                candidates = [s for (_, d), s in self.by_site.get(site_id, {}).items() if d == depth]
+            state = max(candidates, key=lambda s: s.updated_at, default=None)
+        return state.reading if state else None
+
+    def load_from_influx(self, query_api, lookback="24h"):
+        """Avvio a freddo: un'unica query last() raggruppata per sensore"""
+        query = f'''
+        from(bucket: "{INFLUXDB_BUCKET}")
+          |> range(start: -{lookback})
+          |> filter(fn: (r) => r["_measurement"] == "dive_conditions")
+          |> last()
+          |> group(columns: ["site_id", "sensor_id", "depth"])
+          |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+        '''
+
+        rows = {}
+        for table in query_api.query(org=INFLUXDB_ORG, query=query):
+            for record in table.records:
+                values = record.values
+                key = (values.get("site_id"), values.get("sensor_id"), values.get("depth"))
+                row = rows.setdefault(key, {"_time": values["_time"]})
+                row["_time"] = max(row["_time"], values["_time"])
+                for field, value in values.items():
+                    if not field.startswith("_") and value is not None and field not in ("result", "table"):
+                        row[field] = value
+
+        for (site_id, sensor_id, depth), row in rows.items():
+            updated_at = row.pop("_time").timestamp()
+            row.update({"timestamp": iso_utc(updated_at), "site_id": site_id,
+                        "sensor_id": sensor_id, "depth": depth})
+            if row.get("current_direction") is not None:
+                row["current_direction"] = int(row["current_direction"])
+            self.update_reading(row, updated_at=updated_at)
+
+        print(f"🧊 Avvio a freddo: {len(rows)} sensori caricati da InfluxDB")
+        return len(rows)
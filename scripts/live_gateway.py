@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Live Gateway
+Aggiornamenti in push via Server-Sent Events: snapshot alla connessione, poi delta
+per sito accorpati (al più uno per sito e intervallo, con limite per client) e alert
+inoltrati appena arrivano su dive/+/alerts
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from collections import deque
+import argparse
+import json
+import threading
+import time
+
+import requests
+
+from sensor_codec import decode_payload
+from latest_state import LatestStateStore
+from alert_engine import ActiveAlertStore
+from api_server import API_PORT, start_mqtt_consumers
+
+GATEWAY_PORT = 8081
+API_URL = f"http://localhost:{API_PORT}"
+SEED_TIMEOUT = 5.0        # secondi per leggere gli alert già aperti all'avvio
+ALERT_STATES = ("open", "updated", "cleared")
+
+MAX_CLIENTS = 200
+DEFAULT_RATE = 1.0        # flush di delta al secondo per client
+MAX_RATE = 10.0
+KEEPALIVE = 15.0          # commento SSE periodico: tiene aperti proxy e NAT
+STATUS_CHECK = 10.0       # secondi tra i controlli dei siti che diventano offline senza messaggi
+ALERT_BACKLOG = 256       # alert in coda per client lento prima di scartare i più vecchi
+
+
+def format_event(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+class LiveClient:
+    """Coda di un client: siti da aggiornare (accorpati) e alert (mai accorpati)"""
+
+    def __init__(self, sites=None, rate=DEFAULT_RATE):
+        self.sites = sites                   # None = tutti
+        self.min_interval = 1.0 / rate
+        self.condition = threading.Condition()
+        self.dirty = set()
+        self.alerts = deque(maxlen=ALERT_BACKLOG)
+        self.next_flush = 0.0
+        self.closed = False
+        self.dropped_alerts = 0
+
+    def wants(self, site_id):
+        return self.sites is None or site_id in self.sites
+
+    def mark(self, site_id):
+        with self.condition:
+            # Più letture dello stesso sito nello stesso intervallo diventano un solo delta
+            if site_id not in self.dirty:
+                self.dirty.add(site_id)
+                self.condition.notify()
+
+    def push_alert(self, alert):
+        with self.condition:
+            if len(self.alerts) == self.alerts.maxlen:
+                self.dropped_alerts += 1
+            self.alerts.append(alert)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def wait(self, keepalive=KEEPALIVE):
+        """Blocca fino al prossimo invio: (alert, siti); entrambi vuoti = keepalive"""
+        deadline = time.monotonic() + keepalive
+        with self.condition:
+            while not self.closed:
+                now = time.monotonic()
+                if self.alerts:
+                    break
+                if self.dirty and now >= self.next_flush:
+                    break
+                if now >= deadline:
+                    return [], []
+                wake = min(deadline, self.next_flush) if self.dirty else deadline
+                self.condition.wait(max(wake - now, 0.001))
+
+            alerts = list(self.alerts)
+            self.alerts.clear()
+            sites = []
+            if self.dirty and time.monotonic() >= self.next_flush:
+                sites = sorted(self.dirty)
+                self.dirty.clear()
+                self.next_flush = time.monotonic() + self.min_interval
+            return alerts, sites
+
+
+class LiveHub:
+    """Stato condiviso dai client: tabella ultime letture, alert aperti, elenco client"""
+
+    def __init__(self, state_store=None, max_clients=MAX_CLIENTS):
+        self.state_store = state_store or LatestStateStore()
+        self.alert_store = ActiveAlertStore()
+        self.max_clients = max_clients
+        self.clients = []
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.last_statuses = {}
+
+    def subscriptions(self):
+        return [
+            ("dive/+/sensors/data", self.on_sensor_message),
+            ("dive/+/sensors/bin", self.on_sensor_message),
+            ("dive/+/status/+", self.on_status_message),
+            ("dive/+/alerts", self.on_alert_message),
+        ]
+
+    def on_sensor_message(self, client, userdata, msg):
+        try:
+            data = decode_payload(msg.payload)
+        except ValueError:
+            return
+        if isinstance(data, dict) and "site_id" in data:
+            self.state_store.update_reading(data)
+            self.mark(data["site_id"])
+
+    def on_status_message(self, client, userdata, msg):
+        self.state_store.on_status_message(client, userdata, msg)
+        self.mark(msg.topic.split("/")[1])
+
+    def on_alert_message(self, client, userdata, msg):
+        try:
+            alert = json.loads(msg.payload)
+        except ValueError:
+            return
+        # Solo transizioni dell'alert engine: un messaggio senza stato non apre né chiude nulla
+        if not isinstance(alert, dict) or "site_id" not in alert or alert.get("state") not in ALERT_STATES:
+            return
+
+        key = self.alert_key(alert)
+        if alert["state"] == "cleared":
+            self.alert_store.remove(key)
+        else:
+            self.alert_store.put(key, alert)
+
+        for live_client in self.matching(alert["site_id"]):
+            live_client.push_alert(alert)
+        self.mark(alert["site_id"])     # cambia il conteggio alert del sito
+
+    @staticmethod
+    def alert_key(alert):
+        return alert["site_id"], alert.get("sensor_id", "unknown"), alert.get("type")
+
+    def seed_alerts(self, api_url=API_URL, timeout=SEED_TIMEOUT):
+        """Carica gli alert già aperti da /api/dive/alerts/active: su MQTT arrivano solo le transizioni
+        successive all'avvio, senza seed il primo snapshot non li conterrebbe"""
+        try:
+            response = requests.get(f"{api_url}/api/dive/alerts/active", timeout=timeout)
+            response.raise_for_status()
+            alerts = response.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"⚠️ Alert aperti non caricati da {api_url}: {e}")
+            return 0
+        seeded = 0
+        for alert in alerts if isinstance(alerts, list) else []:
+            if isinstance(alert, dict) and "site_id" in alert:
+                self.alert_store.put(self.alert_key(alert), alert)
+                seeded += 1
+        return seeded
+
+    def matching(self, site_id):
+        with self.lock:
+            return [live_client for live_client in self.clients if live_client.wants(site_id)]
+
+    def mark(self, site_id):
+        for live_client in self.matching(site_id):
+            live_client.mark(site_id)
+
+    def add_client(self, live_client):
+        with self.lock:
+            if len(self.clients) >= self.max_clients:
+                return False
+            self.clients.append(live_client)
+            return True
+
+    def remove_client(self, live_client):
+        with self.lock:
+            self.clients.remove(live_client)
+
+    def next_id(self):
+        with self.lock:
+            self.sequence += 1
+            return self.sequence
+
+    def site_delta(self, site_id, now=None):
+        """Delta di un sito: stato, ultima lettura e alert aperti (stessa forma di /overview)"""
+        now = now or time.time()
+        info = self.state_store.site_info(site_id, now)
+        return {
+            "site_id": site_id,
+            "status": info["status"],
+            "last_update": info["last_update"],
+            "current": self.state_store.current(site_id),
+            "active_alerts": self.alert_store.count_for_site(site_id),
+        }
+
+    def snapshot(self, sites=None):
+        overview = self.state_store.overview(self.alert_store.count_for_site)
+        alerts = self.alert_store.active()
+        if sites is not None:
+            overview = [site for site in overview if site["site_id"] in sites]
+            alerts = [alert for alert in alerts if alert["site_id"] in sites]
+        return {"sites": overview, "alerts": alerts}
+
+    def watch_statuses(self, interval=STATUS_CHECK):
+        """Un sito può passare offline senza messaggi: il cambio di stato diventa un delta"""
+        while True:
+            time.sleep(interval)
+            now = time.time()
+            for site_id in self.state_store.known_sites():
+                status = self.state_store.site_status(site_id, now)
+                if self.last_statuses.get(site_id, status) != status:
+                    self.mark(site_id)
+                self.last_statuses[site_id] = status
+
+    def stats(self):
+        with self.lock:
+            return len(self.clients), self.sequence
+
+
+class LiveHandler(BaseHTTPRequestHandler):
+    """GET /api/dive/live?sites=a,b&rate=2 → stream text/event-stream"""
+
+    # Iniettato da create_gateway()
+    hub = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/api/dive/live":
+            self.send_plain(404, "Not found")
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        sites = set(query["sites"].split(",")) if query.get("sites") else None
+        try:
+            rate = min(max(float(query.get("rate", DEFAULT_RATE)), 0.1), MAX_RATE)
+        except ValueError:
+            self.send_plain(400, "rate deve essere un numero")
+            return
+
+        live_client = LiveClient(sites, rate)
+        if not self.hub.add_client(live_client):
+            self.send_plain(503, "Troppi client connessi")
+            return
+
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            # Snapshot completo a ogni (ri)connessione: niente replay da Last-Event-ID
+            self.wfile.write(b"retry: 3000\n\n")
+            self.wfile.write(format_event("snapshot", self.hub.snapshot(sites), self.hub.next_id()))
+            self.wfile.flush()
+            self.stream(live_client)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            live_client.close()
+            self.hub.remove_client(live_client)
+
+    def stream(self, live_client):
+        while True:
+            alerts, sites = live_client.wait()
+            if not alerts and not sites:
+                self.wfile.write(b": keepalive\n\n")
+            now = time.time()
+            for alert in alerts:
+                self.wfile.write(format_event("alert", alert, self.hub.next_id()))
+            for site_id in sites:
+                self.wfile.write(format_event("site", self.hub.site_delta(site_id, now), self.hub.next_id()))
+            self.wfile.flush()
+
+    def send_plain(self, status, message):
+        body = message.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_gateway(host="0.0.0.0", port=GATEWAY_PORT, mqtt_host="localhost", mqtt_port=1883,
+                   max_clients=MAX_CLIENTS, api_url=API_URL):
+    hub = LiveHub(max_clients=max_clients)
+    # Seed prima della sottoscrizione: una transizione MQTT successiva prevale sempre sul seed
+    if api_url:
+        print(f"🔔 Alert aperti caricati dall'API: {hub.seed_alerts(api_url)}")
+    handler = type("BoundLiveHandler", (LiveHandler,), {"hub": hub})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.hub = hub
+    server.mqtt_client = start_mqtt_consumers([hub], mqtt_host, mqtt_port, client_id="dive_live_gateway")
+    threading.Thread(target=hub.watch_statuses, name="live_statuses", daemon=True).start()
+    return server
+
+
+def main():
+    print("📡 Smart Dive Site Controller - Live Gateway (SSE)")
+    print("=" * 60)
+
+    parser = argparse.ArgumentParser(description="Aggiornamenti live via Server-Sent Events")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=GATEWAY_PORT)
+    parser.add_argument("--mqtt-host", default="localhost", help="Broker MQTT")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--max-clients", type=int, default=MAX_CLIENTS, help="Connessioni SSE simultanee")
+    parser.add_argument("--api-url", default=API_URL,
+                        help="API da cui caricare gli alert già aperti all'avvio (stringa vuota = nessun seed)")
+    args = parser.parse_args()
+
+    server = create_gateway(args.host, args.port, args.mqtt_host, args.mqtt_port, args.max_clients,
+                            args.api_url)
+    threading.Thread(target=server.serve_forever, name="live_http", daemon=True).start()
+    print(f"✅ Stream su http://{args.host}:{args.port}/api/dive/live")
+    print("   Premi Ctrl+C per fermare\n")
+
+    try:
+        while True:
+            time.sleep(30)
+            clients, events = server.hub.stats()
+            print(f"📈 client {clients} | eventi inviati {events}")
+    except KeyboardInterrupt:
+        print("\n🛑 Gateway interrotto dall'utente")
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.mqtt_client.loop_stop()
+        server.mqtt_client.disconnect()
+        print("✅ Live Gateway chiuso")
+
+
+if __name__ == "__main__":
+    main()
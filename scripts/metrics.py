@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Metrics
+Contatori, gauge e istogrammi in memoria con esportazione in formato testuale
+Prometheus su /metrics; pensati per il percorso caldo (un lock per serie, niente I/O)
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import bisect
+import math
+import threading
+
+# Bucket di default per latenze in secondi (da 100 µs a 10 s)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Porte /metrics convenzionali (target di config/prometheus/prometheus.yml)
+METRICS_PORTS = {
+    "health_check": 9108,
+    "simulator": 9109,
+    "bulk_loader": 9110,
+    "mqtt_test": 9111,
+}
+
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class CounterChild:
+    __slots__ = ("lock", "value")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, label_names, label_values):
+        yield f"{name}{format_labels(label_names, label_values)} {format_value(self.value)}"
+
+
+class GaugeChild:
+    __slots__ = ("lock", "value", "function")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """Valore calcolato al momento della lettura (es. profondità di una coda): costo zero altrove"""
+        self.function = function
+
+    def samples(self, name, label_names, label_values):
+        value = self.function() if self.function else self.value
+        yield f"{name}{format_labels(label_names, label_values)} {format_value(value)}"
+
+
+class HistogramChild:
+    __slots__ = ("lock", "bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """(conteggi per bucket, somma, numero) coerenti tra loro"""
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    def samples(self, name, label_names, label_values):
+        counts, total, count = self.snapshot()
+        cumulative = 0
+        for bound, bucket in zip(self.bounds + (math.inf,), counts):
+            cumulative += bucket
+            labels = format_labels(label_names, label_values, f'le="{format_value(float(bound))}"')
+            yield f"{name}_bucket{labels} {cumulative}"
+        yield f"{name}_sum{format_labels(label_names, label_values)} {format_value(total)}"
+        yield f"{name}_count{format_labels(label_names, label_values)} {count}"
+
+
+class Metric:
+    """Famiglia di serie con le stesse etichette; senza etichette si usa direttamente"""
+
+    kind = None
+    child_class = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.label_names:
+            self.default = self.labels()
+
+    def new_child(self):
+        return self.child_class()
+
+    def labels(self, *values):
+        """Serie per i valori di etichetta dati; da risolvere una volta fuori dal percorso caldo"""
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name}: attese etichette {self.label_names}")
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self.children.items()):
+            lines.extend(child.samples(self.name, self.label_names, values))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+    child_class = CounterChild
+
+    def inc(self, amount=1):
+        self.default.inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+    child_class = GaugeChild
+
+    def set(self, value):
+        self.default.set(value)
+
+    def inc(self, amount=1):
+        self.default.inc(amount)
+
+    def dec(self, amount=1):
+        self.default.dec(amount)
+
+    def set_function(self, function):
+        self.default.set_function(function)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels)
+
+    def new_child(self):
+        return HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.default.observe(value)
+
+
+class MetricsRegistry:
+    """Metriche di un processo; ricreare una metrica con lo stesso nome restituisce quella esistente"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric_class, name, documentation, labels=(), **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, documentation, labels, **kwargs)
+            elif not isinstance(metric, metric_class) or metric.label_names != tuple(labels):
+                raise ValueError(f"Metrica {name} già registrata con tipo o etichette diversi")
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram, name, documentation, labels, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # Iniettato da start_metrics_server()
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, registry=REGISTRY, host="0.0.0.0"):
+    """Serve /metrics in un thread daemon; ritorna il server (shutdown() per fermarlo)"""
+    handler = type("BoundMetricsHandler", (MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="metrics_http", daemon=True).start()
+    print(f"📈 Metriche Prometheus su http://localhost:{port}/metrics")
+    return server
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - MQTT Connection Manager
+Connessione MQTT condivisa da simulatore e client: riconnessione con backoff
+esponenziale a jitter decorrelato, ammissione a token bucket (niente raffiche di
+riconnessioni dopo un riavvio del broker) e sessione persistente su client id stabile
+"""
+
+import paho.mqtt.client as mqtt
+import random
+import threading
+import time
+
+import metrics
+
+KEEPALIVE = 60              # secondi; con sessione persistente una caduta non perde le sottoscrizioni
+BACKOFF_BASE = 1.0          # primo ritardo minimo di riconnessione
+BACKOFF_CAP = 60.0          # ritardo massimo
+ADMISSION_RATE = 20.0       # tentativi di connessione al secondo per processo
+ADMISSION_BURST = 10
+CONNECT_TIMEOUT = 10.0
+
+DELAY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60)
+
+CONNECT_ATTEMPTS = metrics.counter("dive_mqtt_connect_attempts_total",
+                                   "Tentativi di connessione al broker per esito", ["result"])
+ATTEMPT_OK = CONNECT_ATTEMPTS.labels("ok")
+ATTEMPT_ERROR = CONNECT_ATTEMPTS.labels("error")
+CLIENT_ERRORS = metrics.counter("dive_mqtt_client_errors_total",
+                                "Errori segnalati da paho, eccezioni delle callback (on_message...) incluse")
+RECONNECT_DELAY = metrics.histogram("dive_mqtt_reconnect_delay_seconds",
+                                    "Ritardo di backoff prima di un nuovo tentativo", buckets=DELAY_BUCKETS)
+
+
+class DecorrelatedJitter:
+    """Backoff "decorrelated jitter": ritardo = min(cap, uniforme(base, 3 × ritardo precedente))
+
+    A differenza del raddoppio fisso, client caduti nello stesso istante si distribuiscono
+    subito su intervalli diversi e non ritentano più in sincronia.
+    """
+
+    def __init__(self, base=BACKOFF_BASE, cap=BACKOFF_CAP, rng=None):
+        self.base = base
+        self.cap = cap
+        self.rng = rng or random.Random()
+        self.delay = base
+
+    def next(self):
+        self.delay = min(self.cap, self.rng.uniform(self.base, self.delay * 3))
+        return self.delay
+
+    def reset(self):
+        self.delay = self.base
+
+
+class TokenBucket:
+    """Ammissione: al più `rate` tentativi al secondo, con raffiche fino a `burst`"""
+
+    def __init__(self, rate=ADMISSION_RATE, burst=ADMISSION_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, stop_event=None):
+        """Blocca fino a un gettone disponibile; False se `stop_event` viene impostato nell'attesa"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if stop_event is None:
+                time.sleep(wait)
+            elif stop_event.wait(wait):
+                return False
+
+
+# Condiviso da tutte le connessioni del processo (pool della flotta incluso)
+ADMISSION = TokenBucket()
+
+
+class ConnectionManager:
+    """Client paho con ciclo di rete e riconnessioni gestiti in un thread dedicato
+
+    `client_id` deve essere stabile tra un avvio e l'altro e unico sul broker: con
+    clean_session=False il broker conserva sottoscrizioni e messaggi QoS 1 in volo, ma
+    due client con lo stesso id si scollegano a vicenda. Le callback on_connect e
+    on_disconnect hanno la firma di paho; le altre si impostano direttamente su `client`.
+    """
+
+    def __init__(self, client_id, host="localhost", port=1883, keepalive=KEEPALIVE, clean_session=False,
+                 backoff=None, admission=ADMISSION, on_connect=None, on_disconnect=None, on_attempt=None):
+        self.client_id = client_id
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.backoff = backoff or DecorrelatedJitter()
+        self.admission = admission
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.on_attempt = on_attempt
+
+        self.client = mqtt.Client(client_id=client_id, clean_session=clean_session)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        # Unico scrittore del socket è il thread di run(): senza questa callback paho, fuori da
+        # loop_start(), scriverebbe dal thread che chiama publish(). Così le publish accodano e
+        # svegliano il select() del ciclo di rete tramite la sua socketpair interna
+        self.client.on_socket_register_write = lambda client, userdata, sock: None
+        # Un'eccezione in una callback non deve fermare il thread di rete: rilanciata da loop()
+        # lascerebbe il pacchetto a metà; paho la intercetta e la segnala a on_log
+        self.client.suppress_exceptions = True
+        self.client.on_log = self._on_log
+        self.connected = threading.Event()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.attempts = 0
+        self.connects = 0
+        self.last_error = None
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.connects += 1
+            self.backoff.reset()
+            self.connected.set()
+        if self.on_connect:
+            self.on_connect(client, userdata, flags, rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        # La caduta arriva da paho o da run() se il ciclo di rete esce senza notificarla:
+        # si inoltra una sola volta per connessione riuscita
+        with self.lock:
+            if not self.connected.is_set():
+                return
+            self.connected.clear()
+        if self.on_disconnect:
+            self.on_disconnect(client, userdata, rc)
+
+    def _on_log(self, client, userdata, level, buf):
+        if level == mqtt.MQTT_LOG_ERR:
+            CLIENT_ERRORS.inc()
+            print(f"❌ MQTT {self.client_id}: {buf}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f"mqtt_{self.client_id}", daemon=True)
+        self.thread.start()
+
+    def wait_connected(self, timeout=CONNECT_TIMEOUT):
+        return self.connected.wait(timeout)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.connected.is_set():
+            self.client.disconnect()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            if self.admission and not self.admission.acquire(self.stop_event):
+                break
+            if self.on_attempt:
+                self.on_attempt()
+            self.attempts += 1
+            try:
+                self.client.connect(self.host, self.port, self.keepalive)
+            except OSError as e:
+                ATTEMPT_ERROR.inc()
+                self.last_error = e
+                self.wait_backoff()
+                continue
+            ATTEMPT_OK.inc()
+
+            # Ciclo di rete finché la connessione regge (CONNACK rifiutato incluso)
+            rc = mqtt.MQTT_ERR_SUCCESS
+            while rc == mqtt.MQTT_ERR_SUCCESS and not self.stop_event.is_set():
+                rc = self.client.loop(timeout=1.0)
+            if self.stop_event.is_set():
+                # Invia il DISCONNECT di stop() se è rimasto in coda
+                self.client.loop(timeout=1.0)
+                break
+            self._on_disconnect(self.client, None, rc)
+            self.wait_backoff()
+
+    def wait_backoff(self):
+        """Anche il primo tentativo dopo una caduta aspetta: è lì che la flotta si sincronizza"""
+        delay = self.backoff.next()
+        RECONNECT_DELAY.observe(delay)
+        self.stop_event.wait(delay)
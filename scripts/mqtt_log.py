@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - MQTT Log
+Formato binario append-only per registrare messaggi MQTT grezzi
+(topic, payload, QoS e istante di arrivo), con lettura memory-mapped e indice
+"""
+
+from array import array
+import mmap
+import os
+import struct
+import sys
+
+FILE_MAGIC = b"DIVELOG1"
+
+# Record, network byte order:
+#   arrival f64 (epoch s) | qos u8 | topic_len u16 | payload_len u32 | topic | payload
+RECORD = struct.Struct("!dBHI")
+
+# Indice (file .idx accanto al log): byte del log già indicizzati u64 | offset dei record u64...
+INDEX_HEADER = struct.Struct("!Q")
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+class MQTTLogWriter:
+    """Scrittura bufferizzata di messaggi in coda al file"""
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self.file = open(path, "ab", buffering=buffer_size)
+        if self.file.tell() == 0:
+            self.file.write(FILE_MAGIC)
+        self.records = 0
+
+    def append(self, arrival, topic, payload, qos=0):
+        topic = topic.encode() if isinstance(topic, str) else topic
+        self.file.write(RECORD.pack(arrival, qos, len(topic), len(payload)))
+        self.file.write(topic)
+        self.file.write(payload)
+        self.records += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def iter_records(path):
+    """Legge in sequenza i record come (arrival, topic, payload, qos)"""
+    with open(path, "rb") as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"{path}: non è un log MQTT")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            arrival, qos, topic_len, payload_len = RECORD.unpack(header)
+            topic = f.read(topic_len)
+            payload = f.read(payload_len)
+            if len(payload) < payload_len:
+                return      # record troncato (scrittura interrotta)
+            yield arrival, topic.decode(), payload, qos
+
+
+class MQTTLogReader:
+    """Accesso casuale ai record tramite mmap e indice degli offset
+
+    L'indice viene salvato in `<log>.idx` ed esteso in modo incrementale
+    se il log è cresciuto dall'ultima apertura.
+    """
+
+    def __init__(self, path, save_index=True):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size < len(FILE_MAGIC):
+            raise ValueError(f"{path}: non è un log MQTT")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError(f"{path}: non è un log MQTT")
+
+        self.offsets, indexed = self._load_index()
+        end = self._scan(indexed)
+        if save_index and end != indexed:
+            self._save_index(end)
+
+    def _load_index(self):
+        offsets = array("Q")
+        try:
+            with open(self.index_path, "rb") as f:
+                (indexed,) = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+                offsets.frombytes(f.read())
+        except (OSError, struct.error, ValueError):
+            return array("Q"), len(FILE_MAGIC)
+
+        if indexed > self.size:
+            return array("Q"), len(FILE_MAGIC)       # log riscritto: indice non valido
+        if _LITTLE_ENDIAN:
+            offsets.byteswap()
+        return offsets, indexed
+
+    def _scan(self, offset):
+        """Aggiunge all'indice i record completi a partire da `offset`"""
+        data, size = self.data, self.size
+        while offset + RECORD.size <= size:
+            _, _, topic_len, payload_len = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + topic_len + payload_len
+            if end > size:
+                break       # record troncato in coda
+            self.offsets.append(offset)
+            offset = end
+        return offset
+
+    def _save_index(self, indexed):
+        offsets = array("Q", self.offsets)
+        if _LITTLE_ENDIAN:
+            offsets.byteswap()
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_HEADER.pack(indexed))
+            f.write(offsets.tobytes())
+        os.replace(tmp_path, self.index_path)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def arrival(self, index):
+        return RECORD.unpack_from(self.data, self.offsets[index])[0]
+
+    def record(self, index):
+        """(arrival, topic, payload, qos) del record `index`"""
+        offset = self.offsets[index]
+        arrival, qos, topic_len, payload_len = RECORD.unpack_from(self.data, offset)
+        start = offset + RECORD.size
+        topic = self.data[start:start + topic_len].decode()
+        payload = self.data[start + topic_len:start + topic_len + payload_len]
+        return arrival, topic, payload, qos
+
+    def find_time(self, arrival):
+        """Primo record con istante di arrivo >= `arrival` (ricerca binaria)"""
+        low, high = 0, len(self.offsets)
+        while low < high:
+            middle = (low + high) // 2
+            if self.arrival(middle) < arrival:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __iter__(self):
+        for index in range(len(self.offsets)):
+            yield self.record(index)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - MQTT Record & Replay
+Registra il traffico dive/# in un log indicizzato (mqtt_log) e lo ripubblica
+a velocità reale, accelerata o massima, con rimappatura e moltiplicazione dei siti
+"""
+
+import paho.mqtt.client as mqtt
+import argparse
+import os
+import time
+from collections import deque
+
+from fleet_simulator import MQTTConnectionPool
+from mqtt_log import MQTTLogReader, MQTTLogWriter
+from sensor_codec import (HEADER, MAX_ID_BYTES, CodecError, decode_batch, encode_batch, encode_sensor_data,
+                          is_batch_payload, is_binary_payload)
+
+# Messaggi per connessione tra due attese di scrittura su socket (limita la memoria di paho)
+BACKPRESSURE_EVERY = 1000
+
+
+def parse_remap(spec):
+    """Interpreta una rimappatura "sito_originale=nuovo_sito" """
+    if "=" not in spec:
+        raise argparse.ArgumentTypeError(f"Rimappatura non valida: {spec} (atteso vecchio=nuovo)")
+    old, new = spec.split("=", 1)
+    old, new = old.strip(), new.strip()
+    if not new or len(new.encode()) > MAX_ID_BYTES:
+        raise argparse.ArgumentTypeError(f"Sito di destinazione non valido: {new!r} (1-{MAX_ID_BYTES} byte)")
+    return old, new
+
+
+def site_suffix(k):
+    """Suffisso della k-esima copia di un sito con --multiply"""
+    return f"_{k:03d}"
+
+
+def rename_site(payload, old_site, new_site):
+    """Sostituisce il site_id dentro il payload (record binario, batch o JSON)
+
+    CodecError se il nuovo site_id non entra nel formato binario (oltre MAX_ID_BYTES byte).
+    """
+    if is_binary_payload(payload):
+        offset = HEADER.size
+        site_len = payload[offset]
+        new_bytes = new_site.encode()
+        if len(new_bytes) > MAX_ID_BYTES:
+            raise CodecError(f"site_id oltre {MAX_ID_BYTES} byte: {new_site}")
+        return b"".join((payload[:offset], bytes((len(new_bytes),)), new_bytes, payload[offset + 1 + site_len:]))
+
+    if is_batch_payload(payload):
+        # Letture recuperate dal buffer offline: ogni record porta il proprio site_id
+        readings = decode_batch(payload)
+        for reading in readings:
+            if reading["site_id"] == old_site:
+                reading["site_id"] = new_site
+        return encode_batch([encode_sensor_data(reading) for reading in readings])
+
+    for separator in (b'": "', b'":"'):
+        old_field = b'"site_id' + separator + old_site.encode() + b'"'
+        if old_field in payload:
+            return payload.replace(old_field, b'"site_id' + separator + new_site.encode() + b'"')
+    return payload
+
+
+class MQTTRecorder:
+    """Cattura dei messaggi: il thread di rete accoda, il main thread scrive sul log"""
+
+    def __init__(self, broker_host, broker_port, path, topic="dive/#"):
+        self.broker_host = broker_host
+        self.broker_port = broker_port
+        self.topic = topic
+        self.writer = MQTTLogWriter(path)
+        self.queue = deque()
+        self.client = mqtt.Client(client_id=f"dive_recorder_{os.getpid()}")
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            # QoS 2 in sottoscrizione: il QoS ricevuto è quello originale del publisher
+            client.subscribe(self.topic, qos=2)
+            print(f"✅ Connesso, registrazione di {self.topic} in {self.writer.path}")
+        else:
+            print(f"❌ Errore connessione MQTT: {rc}")
+
+    def on_message(self, client, userdata, msg):
+        self.queue.append((time.time(), msg.topic, msg.payload, msg.qos))
+
+    def drain(self):
+        queue, writer = self.queue, self.writer
+        while queue:
+            writer.append(*queue.popleft())
+
+    def run(self, duration=0):
+        self.client.connect(self.broker_host, self.broker_port, 60)
+        self.client.loop_start()
+        started = time.monotonic()
+        last_report = started
+        try:
+            while not duration or time.monotonic() - started < duration:
+                time.sleep(0.2)
+                self.drain()
+                if time.monotonic() - last_report >= 5:
+                    last_report = time.monotonic()
+                    print(f"📼 {self.writer.records} messaggi registrati")
+        except KeyboardInterrupt:
+            print("\n🛑 Registrazione interrotta dall'utente")
+        finally:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.drain()
+            self.writer.close()
+        print(f"💾 {self.writer.records} messaggi salvati in {self.writer.path}")
+
+
+class MQTTReplayer:
+    def __init__(self, pool, speed=1.0, remap=None, multiply=1, qos=None):
+        self.pool = pool
+        self.speed = speed              # 0 = massima velocità
+        self.remap = remap or {}
+        self.multiply = multiply
+        self.qos = qos
+        self.site_targets = {}
+        self.published = 0
+        self.errors = 0
+        self.max_lag = 0.0
+        self.pending = [None] * len(pool.clients)
+        self.sent = [0] * len(pool.clients)
+
+    def targets(self, site_id):
+        """Siti di destinazione di un sito registrato (rimappatura e moltiplicazione)"""
+        targets = self.site_targets.get(site_id)
+        if targets is None:
+            base = self.remap.get(site_id, site_id)
+            if self.multiply > 1:
+                targets = [base + site_suffix(k) for k in range(1, self.multiply + 1)]
+            else:
+                targets = [base]
+            self.site_targets[site_id] = targets
+        return targets
+
+    def publish(self, topic, payload, qos):
+        index = self.published % len(self.pool.clients)
+        client = self.pool.clients[index]
+        info = client.publish(topic, payload, qos=qos)
+        self.published += 1
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.errors += 1
+            return
+
+        self.sent[index] += 1
+        if self.sent[index] % BACKPRESSURE_EVERY == 0:
+            # Attende che il blocco precedente sia scritto sul socket prima di accodarne altri
+            previous = self.pending[index]
+            if previous is not None:
+                previous.wait_for_publish()
+            self.pending[index] = info
+
+    def replay(self, reader, start_index=0, report_every=5.0):
+        """Ripubblica i record da `start_index` rispettando i tempi originali scalati"""
+        if start_index >= len(reader):
+            return
+        first_arrival = reader.arrival(start_index)
+        started = time.monotonic()
+        last_report, last_published = started, self.published
+
+        for index in range(start_index, len(reader)):
+            arrival, topic, payload, qos = reader.record(index)
+
+            if self.speed > 0:
+                delay = (arrival - first_arrival) / self.speed - (time.monotonic() - started)
+                if delay > 0.001:
+                    time.sleep(delay)
+                elif -delay > self.max_lag:
+                    self.max_lag = -delay
+
+            qos = qos if self.qos is None else self.qos
+            parts = topic.split("/", 2)
+            if len(parts) < 3 or parts[0] != "dive":
+                self.publish(topic, payload, qos)
+                continue
+
+            site_id, rest = parts[1], parts[2]
+            for target in self.targets(site_id):
+                if target == site_id:
+                    self.publish(topic, payload, qos)
+                    continue
+                try:
+                    renamed = rename_site(payload, site_id, target)
+                except CodecError as e:
+                    # Payload binario malformato o site_id troppo lungo: non si pubblica sul sito sbagliato
+                    self.errors += 1
+                    print(f"⚠️ Record {index} non rimappato su {target}: {e}")
+                    continue
+                self.publish(f"dive/{target}/{rest}", renamed, qos)
+
+            if index % 1000 == 0 and time.monotonic() - last_report >= report_every:
+                now = time.monotonic()
+                rate = (self.published - last_published) / (now - last_report)
+                last_report, last_published = now, self.published
+                print(f"📈 {index - start_index + 1}/{len(reader) - start_index} record | "
+                      f"{self.published} pubblicati | {rate:.0f} msg/s | ritardo max {self.max_lag:.2f}s")
+
+        for info in self.pending:
+            if info is not None:
+                info.wait_for_publish()
+
+
+def print_log_info(reader):
+    """Riepilogo del contenuto di un log registrato"""
+    if not len(reader):
+        print("📭 Log vuoto")
+        return
+    first, last = reader.arrival(0), reader.arrival(len(reader) - 1)
+    kinds, sites = {}, set()
+    for _, topic, payload, _ in reader:
+        parts = topic.split("/", 2)
+        if len(parts) == 3:
+            sites.add(parts[1])
+            kinds[parts[2]] = kinds.get(parts[2], 0) + 1
+
+    print(f"📼 {reader.path}: {len(reader)} messaggi, {reader.size / 1e6:.1f} MB")
+    print(f"   Durata: {last - first:.1f}s ({len(reader) / max(last - first, 1e-9):.1f} msg/s)")
+    print(f"   Siti: {len(sites)}")
+    for kind, count in sorted(kinds.items(), key=lambda item: -item[1]):
+        print(f"   {kind:<22} {count:8d}")
+
+
+def main():
+    print("📼 Smart Dive Site Controller - MQTT Record & Replay")
+    print("=" * 60)
+
+    parser = argparse.ArgumentParser(description="Registrazione e riproduzione del traffico MQTT")
+    parser.add_argument("--host", default="localhost", help="Broker MQTT")
+    parser.add_argument("--port", type=int, default=1883)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="Registra il traffico in un log")
+    record.add_argument("log", help="File di log (append)")
+    record.add_argument("--topic", default="dive/#")
+    record.add_argument("--duration", type=float, default=0, help="Secondi di registrazione (0 = fino a Ctrl+C)")
+
+    replay = commands.add_parser("replay", help="Ripubblica un log registrato")
+    replay.add_argument("log")
+    replay.add_argument("--speed", type=float, default=1.0, help="Fattore di velocità (0 = massima)")
+    replay.add_argument("--skip", type=float, default=0, help="Secondi iniziali del log da saltare")
+    replay.add_argument("--remap", type=parse_remap, action="append", default=[],
+                        help="Rimappa un sito, es. capo_vaticano=test_site (ripetibile)")
+    replay.add_argument("--multiply", type=int, default=1, help="Copie di ogni sito (suffisso _001, _002, ...)")
+    replay.add_argument("--qos", type=int, choices=[0, 1, 2], help="QoS di pubblicazione (default: quello registrato)")
+    replay.add_argument("--connections", type=int, default=4, help="Connessioni MQTT in parallelo")
+    replay.add_argument("--loop", action="store_true", help="Ripete il log all'infinito")
+
+    info = commands.add_parser("info", help="Riepilogo di un log")
+    info.add_argument("log")
+    args = parser.parse_args()
+
+    if args.command == "replay" and args.multiply > 1:
+        # Il suffisso delle copie deve entrare anche lui nel site_id binario
+        suffix = len(site_suffix(args.multiply))
+        too_long = [new for _, new in args.remap if len(new.encode()) + suffix > MAX_ID_BYTES]
+        if too_long:
+            parser.error(f"--remap con --multiply {args.multiply}: {too_long[0]!r} oltre {MAX_ID_BYTES} byte")
+
+    if args.command == "record":
+        MQTTRecorder(args.host, args.port, args.log, args.topic).run(args.duration)
+        return
+
+    reader = MQTTLogReader(args.log)
+    if args.command == "info":
+        print_log_info(reader)
+        reader.close()
+        return
+
+    start_index = reader.find_time(reader.arrival(0) + args.skip) if args.skip and len(reader) else 0
+    if len(reader) - start_index <= 0:
+        # Con --loop un replay vuoto tornerebbe subito, girando a vuoto al 100% di CPU
+        print("📭 Nessun record da ripubblicare (log vuoto o --skip oltre la fine)")
+        reader.close()
+        return
+
+    pool = MQTTConnectionPool(args.host, args.port, args.connections, client_prefix="dive_replay")
+    if not pool.connect():
+        reader.close()
+        return
+
+    replayer = MQTTReplayer(pool, speed=args.speed, remap=dict(args.remap), multiply=args.multiply, qos=args.qos)
+    speed = "massima" if args.speed <= 0 else f"{args.speed:g}x"
+    print(f"🚀 Replay di {len(reader) - start_index} record a velocità {speed}, x{args.multiply} siti")
+
+    started = time.monotonic()
+    try:
+        while True:
+            replayer.replay(reader, start_index)
+            if not args.loop:
+                break
+    except KeyboardInterrupt:
+        print("\n🛑 Replay interrotto dall'utente")
+    finally:
+        pool.close()
+        reader.close()
+
+    elapsed = max(time.monotonic() - started, 1e-9)
+    print(f"\n📊 {replayer.published} messaggi in {elapsed:.1f}s ({replayer.published / elapsed:.0f} msg/s), "
+          f"{replayer.errors} errori, ritardo max {replayer.max_lag:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,37 +4,130 @@ MQTT Test Client per Smart Dive Controller
 Sostituisce mosquitto_sub su Windows
 """
 
-import paho.mqtt.client as mqtt
+import argparse
 import json
+import math
+import os
+import threading
 import time
+from collections import deque
 from datetime import datetime
 
+import metrics
+from mqtt_connection import KEEPALIVE, ConnectionManager
+from mqtt_log import MQTTLogWriter
+from sensor_codec import decode_payload, is_binary_payload
+
+MESSAGES = metrics.counter("dive_mqtt_messages_total", "Messaggi ricevuti per topic (sito come +)", ["topic"])
+MESSAGE_BYTES = metrics.counter("dive_mqtt_message_bytes_total", "Byte di payload ricevuti per topic", ["topic"])
+QUEUE_DEPTH = metrics.gauge("dive_mqtt_queue_depth", "Messaggi in coda per il worker statistiche")
+
+# Sottoscrizioni per profilo di pubblicazione del simulatore (vedi PUBLISH_PROFILES)
+PROFILE_TOPICS = {
+    "full": [
+        "dive/+/sensors/data",      # Dati sensori
+        "dive/+/alerts",            # Alert
+        "dive/+/status/+",          # Status vari
+        "dive/+/sensors/+",         # Sensori individuali
+    ],
+    "aggregate": [
+        "dive/+/sensors/data",      # Record completo JSON
+        "dive/+/sensors/bin",       # Record completo binario
+        "dive/+/alerts",
+        "dive/+/status/+",
+    ],
+    "delta": [
+        "dive/+/sensors/+",         # Record completo + campi cambiati
+        "dive/+/alerts",
+        "dive/+/status/+",
+    ],
+}
+
+# Topic per-campo → campi del record completo
+FIELD_TOPIC_FIELDS = {
+    "sensors/temperature": "temperature",
+    "sensors/visibility": "visibility",
+    "sensors/luminosity": "luminosity",
+    "status/battery": "battery_level",
+}
+
+# Messaggi elaborati dal worker per ciclo in modalità statistiche
+STATS_BATCH = 1000
+
+
+class SiteStats:
+    """Contatori per sito della modalità statistiche"""
+    __slots__ = ("messages", "bytes", "reported_messages", "last_seen", "alerts",
+                 "gap_count", "gap_mean", "gap_m2")
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.reported_messages = 0      # aggiornato solo dal thread della tabella
+        self.last_seen = None
+        self.alerts = 0
+        self.gap_count = 0
+        self.gap_mean = 0.0
+        self.gap_m2 = 0.0
+
+    def add_gap(self, gap):
+        """Welford sugli intervalli tra letture successive dello stesso sensore"""
+        self.gap_count += 1
+        delta = gap - self.gap_mean
+        self.gap_mean += delta / self.gap_count
+        self.gap_m2 += delta * (gap - self.gap_mean)
+
+    @property
+    def jitter(self):
+        if self.gap_count < 2:
+            return 0.0
+        return math.sqrt(self.gap_m2 / (self.gap_count - 1))
+
+
 class MQTTTestClient:
-    def __init__(self, broker_host="localhost", broker_port=1883):
+    def __init__(self, broker_host="localhost", broker_port=1883, profile="full",
+                 stats=False, record=None, refresh=2.0, top=30, keepalive=KEEPALIVE):
         self.broker_host = broker_host
         self.broker_port = broker_port
-        self.client = mqtt.Client(client_id="test_client_windows")
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
-        self.client.on_disconnect = self.on_disconnect
+        self.profile = profile
+        self.stats_mode = stats or record is not None
+        self.refresh = refresh
+        self.top = top
+        
+        # Ultimo stato noto per sito, ricostruito da record completi e aggiornamenti per-campo
+        self.site_state = {}
+        self.message_counts = {}
+        self.started_at = time.monotonic()
+        # Sessione persistente: dopo una caduta il broker conserva le sottoscrizioni
+        self.connection = ConnectionManager("test_client_windows", broker_host, broker_port, keepalive=keepalive,
+                                            on_connect=self.on_connect, on_disconnect=self.on_disconnect)
+        self.client = self.connection.client
+        self.client.on_message = self.enqueue_message if self.stats_mode else self.on_message
+        
+        # Modalità statistiche: il thread di rete accoda soltanto, il worker elabora a blocchi
+        self.queue = deque()
+        self.stop_event = threading.Event()
+        self.site_stats = {}
+        self.sensor_seen = {}
+        self.decode_errors = 0
+        self.recorder = MQTTLogWriter(record) if record else None
+        QUEUE_DEPTH.set_function(lambda: len(self.queue))
         
         print(f"🔗 MQTT Test Client per Smart Dive Controller")
         print(f"   Broker: {broker_host}:{broker_port}")
+        print(f"   Profilo: {profile}")
+        if self.stats_mode:
+            print(f"   Modalità statistiche (refresh {refresh:g}s)")
+        if record:
+            print(f"   Registrazione: {record}")
         print("=" * 60)
     
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print(f"✅ Connesso al broker MQTT")
             
-            # Subscribe a tutti i topic importanti
-            topics = [
-                "dive/+/sensors/data",      # Dati sensori
-                "dive/+/alerts",            # Alert
-                "dive/+/status/+",          # Status vari
-                "dive/+/sensors/+",         # Sensori individuali
-            ]
-            
-            for topic in topics:
+            # Subscribe ai topic del profilo scelto
+            for topic in PROFILE_TOPICS[self.profile]:
                 client.subscribe(topic)
                 print(f"   📡 Subscribed: {topic}")
                 
@@ -45,18 +138,27 @@ class MQTTTestClient:
         timestamp = datetime.now().strftime("%H:%M:%S")
         topic = msg.topic
         
+        kind = topic.split("/", 2)[-1]
+        self.message_counts[kind] = self.message_counts.get(kind, 0) + 1
+        MESSAGES.labels(f"dive/+/{kind}").inc()
+        MESSAGE_BYTES.labels(f"dive/+/{kind}").inc(len(msg.payload))
+        
         try:
-            # Prova a parsare come JSON
-            payload = json.loads(msg.payload.decode())
+            # Prova a parsare come JSON (o record binario)
+            payload = decode_payload(msg.payload)
             payload_str = json.dumps(payload, indent=2)
         except:
             # Se non è JSON, mostra come stringa
-            payload_str = msg.payload.decode()
+            payload = None
+            payload_str = msg.payload.decode(errors="replace")
+        
+        if payload is not None:
+            self.update_site_state(topic, payload)
         
         # Colora l'output in base al tipo di messaggio
         if "alerts" in topic:
             print(f"🚨 [{timestamp}] ALERT - {topic}")
-        elif "sensors/data" in topic:
+        elif "sensors/data" in topic or is_binary_payload(msg.payload):
             print(f"📊 [{timestamp}] DATA - {topic}")
         elif "status" in topic:
             print(f"💡 [{timestamp}] STATUS - {topic}")
@@ -66,14 +168,127 @@ class MQTTTestClient:
         print(f"   {payload_str}")
         print("-" * 60)
     
+    def enqueue_message(self, client, userdata, msg):
+        # deque.append è atomica: nessun lock sul thread di rete paho
+        self.queue.append((time.time(), msg.topic, msg.payload, msg.qos))
+    
+    def stats_worker(self):
+        """Svuota la coda a blocchi finché il client non viene fermato"""
+        while not self.stop_event.is_set() or self.queue:
+            batch = []
+            try:
+                while len(batch) < STATS_BATCH:
+                    batch.append(self.queue.popleft())
+            except IndexError:
+                pass
+            
+            if batch:
+                self.process_batch(batch)
+            else:
+                self.stop_event.wait(0.05)
+    
+    def process_batch(self, batch):
+        # Metriche aggregate per blocco: un incremento per topic, non per messaggio
+        batch_counts = {}
+        batch_bytes = {}
+        for arrival, topic, payload, qos in batch:
+            if self.recorder:
+                self.recorder.append(arrival, topic, payload, qos)
+            
+            parts = topic.split("/", 2)
+            if len(parts) < 3:
+                continue
+            site_id, kind = parts[1], parts[2]
+            self.message_counts[kind] = self.message_counts.get(kind, 0) + 1
+            batch_counts[kind] = batch_counts.get(kind, 0) + 1
+            batch_bytes[kind] = batch_bytes.get(kind, 0) + len(payload)
+            
+            stats = self.site_stats.get(site_id)
+            if stats is None:
+                stats = self.site_stats[site_id] = SiteStats()
+            stats.messages += 1
+            stats.bytes += len(payload)
+            stats.last_seen = arrival
+            
+            if kind == "alerts":
+                stats.alerts += 1
+            elif kind in ("sensors/data", "sensors/bin"):
+                try:
+                    data = decode_payload(payload)
+                except ValueError:
+                    self.decode_errors += 1
+                    continue
+                if isinstance(data, dict):
+                    key = (site_id, data.get("sensor_id"))
+                    previous = self.sensor_seen.get(key)
+                    self.sensor_seen[key] = arrival
+                    if previous is not None:
+                        stats.add_gap(arrival - previous)
+        
+        for kind, count in batch_counts.items():
+            MESSAGES.labels(f"dive/+/{kind}").inc(count)
+            MESSAGE_BYTES.labels(f"dive/+/{kind}").inc(batch_bytes[kind])
+    
+    def print_stats_table(self, window):
+        """Tabella per sito (i più attivi nella finestra), ridisegnata a ogni refresh"""
+        now = time.time()
+        rows = [(site_id, stats, stats.messages - stats.reported_messages)
+                for site_id, stats in list(self.site_stats.items())]
+        rows.sort(key=lambda row: -row[2])
+        total_rate = sum(row[2] for row in rows) / window
+        
+        os.system("cls" if os.name == "nt" else "clear")
+        print(f"📈 Statistiche MQTT - {datetime.now().strftime('%H:%M:%S')} | "
+              f"{len(rows)} siti | {total_rate:.1f} msg/s | coda {len(self.queue)} | "
+              f"errori decodifica {self.decode_errors}")
+        if self.recorder:
+            print(f"💾 Registrati {self.recorder.records} messaggi in {self.recorder.path}")
+        print("=" * 78)
+        print(f"{'Sito':<24} {'msg/s':>8} {'jitter ms':>10} {'B/msg':>8} {'ultimo s':>9} {'alert':>7} {'totale':>8}")
+        for site_id, stats, window_messages in rows[:self.top]:
+            age = now - stats.last_seen if stats.last_seen else 0
+            print(f"{site_id:<24} {window_messages / window:>8.1f} {stats.jitter * 1000:>10.0f} "
+                  f"{stats.bytes / max(stats.messages, 1):>8.0f} {age:>9.1f} {stats.alerts:>7d} {stats.messages:>8d}")
+        for _, stats, window_messages in rows:
+            stats.reported_messages += window_messages
+        if len(rows) > self.top:
+            print(f"... altri {len(rows) - self.top} siti")
+    
+    def update_site_state(self, topic, payload):
+        """Unisce record completi e aggiornamenti per-campo (profilo delta) nello stato del sito"""
+        parts = topic.split("/", 2)
+        if len(parts) < 3:
+            return
+        site_id, kind = parts[1], parts[2]
+        state = self.site_state.setdefault(site_id, {})
+        
+        if kind in ("sensors/data", "sensors/bin") and isinstance(payload, dict):
+            state.update(payload)
+        elif kind == "sensors/current" and isinstance(payload, dict):
+            state["current_speed"] = payload.get("speed")
+            state["current_direction"] = payload.get("direction")
+        elif kind in FIELD_TOPIC_FIELDS:
+            state[FIELD_TOPIC_FIELDS[kind]] = payload
+    
+    def print_message_summary(self):
+        """Messaggi ricevuti per tipo di topic: misura la riduzione tra profili"""
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        total = sum(self.message_counts.values())
+        print(f"\n📊 Messaggi ricevuti: {total} in {elapsed:.0f}s ({total / elapsed:.1f} msg/s)")
+        for kind, count in sorted(self.message_counts.items(), key=lambda item: -item[1]):
+            print(f"   {kind:<22} {count:8d} ({count / elapsed:.1f}/s)")
+    
     def on_disconnect(self, client, userdata, rc):
         print(f"🔌 Disconnesso dal broker (rc: {rc})")
     
     def start_listening(self):
+        worker = None
         try:
             print("🚀 Avvio listening MQTT...")
-            self.client.connect(self.broker_host, self.broker_port, 60)
-            self.client.loop_start()
+            if self.stats_mode:
+                worker = threading.Thread(target=self.stats_worker, daemon=True)
+                worker.start()
+            self.connection.start()
             
             print("✅ Listening attivo! Premi Ctrl+C per fermare")
             print("💡 Avvia il simulatore Arduino in un altro terminale:")
@@ -81,39 +296,67 @@ class MQTTTestClient:
             print()
             
             # Loop infinito
+            last_refresh = time.monotonic()
             while True:
-                time.sleep(1)
+                time.sleep(self.refresh if self.stats_mode else 1)
+                if self.stats_mode:
+                    now = time.monotonic()
+                    self.print_stats_table(max(now - last_refresh, 1e-9))
+                    last_refresh = now
                 
         except KeyboardInterrupt:
             print("\n🛑 Interruzione utente")
         except Exception as e:
             print(f"❌ Errore: {e}")
         finally:
-            self.client.loop_stop()
-            self.client.disconnect()
+            self.connection.stop()
+            if worker:
+                self.stop_event.set()
+                worker.join()
+            if self.recorder:
+                self.recorder.close()
+                print(f"💾 {self.recorder.records} messaggi registrati in {self.recorder.path}")
+            self.print_message_summary()
             print("✅ Client MQTT chiuso")
     
-    def test_connection(self):
+    def test_connection(self, timeout=10.0):
         """Test rapido di connessione"""
         print("🔍 Test connessione MQTT...")
-        try:
-            test_client = mqtt.Client(client_id="test_connection")
-            test_client.connect(self.broker_host, self.broker_port, 10)
-            test_client.disconnect()
+        # Sonda senza sessione persistente: qualche tentativo con backoff, poi si arrende
+        probe = ConnectionManager("test_connection", self.broker_host, self.broker_port, keepalive=10,
+                                  clean_session=True)
+        probe.start()
+        connected = probe.wait_connected(timeout)
+        probe.stop()
+        if connected:
             print("✅ Broker MQTT raggiungibile")
             return True
-        except Exception as e:
-            print(f"❌ Broker MQTT non raggiungibile: {e}")
-            print("💡 Assicurati che Docker sia avviato:")
-            print("   docker-compose up -d")
-            return False
+        print(f"❌ Broker MQTT non raggiungibile: {probe.last_error or 'timeout'}")
+        print("💡 Assicurati che Docker sia avviato:")
+        print("   docker-compose up -d")
+        return False
 
 def main():
-    import sys
+    parser = argparse.ArgumentParser(description="Client MQTT di test per Smart Dive Controller")
+    parser.add_argument("broker_host", nargs="?", default="localhost")
+    parser.add_argument("--profile", default="full", choices=list(PROFILE_TOPICS),
+                        help="Profilo di pubblicazione dei sensori da ascoltare")
+    parser.add_argument("--stats", action="store_true",
+                        help="Tabella aggregata per sito invece della stampa di ogni messaggio")
+    parser.add_argument("--refresh", type=float, default=2.0, help="Secondi tra aggiornamenti della tabella")
+    parser.add_argument("--top", type=int, default=30, help="Siti mostrati nella tabella")
+    parser.add_argument("--record", metavar="FILE",
+                        help="Registra i messaggi grezzi in un log append-only (attiva --stats)")
+    parser.add_argument("--keepalive", type=int, default=KEEPALIVE, help="Keepalive MQTT in secondi")
+    parser.add_argument("--metrics-port", type=int,
+                        help=f"Espone /metrics Prometheus su questa porta (es. {metrics.METRICS_PORTS['mqtt_test']})")
+    args = parser.parse_args()
     
-    broker_host = sys.argv[1] if len(sys.argv) > 1 else "localhost"
+    if args.metrics_port:
+        metrics.start_metrics_server(args.metrics_port)
     
-    client = MQTTTestClient(broker_host=broker_host)
+    client = MQTTTestClient(broker_host=args.broker_host, profile=args.profile, stats=args.stats,
+                            record=args.record, refresh=args.refresh, top=args.top, keepalive=args.keepalive)
     
     # Test connessione prima
     if client.test_connection():
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Offline Buffer
+Coda persistente e limitata su file (ring buffer mappato in memoria) per le letture
+prodotte mentre il broker non è raggiungibile, e forwarder che la svuota alla
+riconnessione in batch compatti a velocità limitata, con i timestamp originali
+"""
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+
+from sensor_codec import BATCH_TOPIC, encode_batch
+
+# Intestazione del file: magic | versione | dimensione intestazione | capacità area dati |
+# head e tail (offset logici crescenti, posizione fisica = offset % capacità) | record | scartati
+RING_MAGIC = b"DVRB"
+RING_VERSION = 1
+RING_HEADER = struct.Struct("<4sIIQQQQQ")
+HEADER_SIZE = 64
+RECORD_LENGTH = struct.Struct("<I")
+
+DEFAULT_CAPACITY = 16 * 1024 * 1024     # ~400k letture binarie v1
+SYNC_EVERY = 100                        # append tra due msync (in ogni caso a close())
+
+CATCH_UP_RATE = 50.0                    # letture/s inviate durante il recupero
+BATCH_RECORDS = 100                     # letture per messaggio batch
+RECONNECT_SPREAD = 10.0                 # ritardo casuale massimo prima del recupero (niente picchi di flotta)
+
+
+class RingBufferError(ValueError):
+    """File esistente che non è un ring buffer valido: mai sovrascritto"""
+
+
+class RingBuffer:
+    """Record di byte in coda FIFO su file; se pieno scarta i più vecchi (contati in `dropped`)
+
+    Un nuovo ring si crea solo se il file non esiste o è vuoto; con readonly=True il file
+    deve esistere e non viene mai modificato (solo lettura dello stato).
+    """
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, sync_every=SYNC_EVERY, readonly=False):
+        self.path = path
+        self.sync_every = sync_every
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self.unsynced = 0
+
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size == 0 and not readonly:
+            self.file = open(path, "w+b")
+            self.capacity, self.head, self.tail, self.count, self.dropped = capacity, 0, 0, 0, 0
+            self.file.truncate(HEADER_SIZE + capacity)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+            self._write_header()
+            return
+
+        self.file = open(path, "rb" if readonly else "r+b")
+        try:
+            header = self.file.read(RING_HEADER.size)
+            if len(header) < RING_HEADER.size:
+                raise RingBufferError(f"{path}: intestazione ring buffer assente")
+            magic, version, header_size, stored_capacity, head, tail, count, dropped = RING_HEADER.unpack(header)
+            if magic != RING_MAGIC or version != RING_VERSION or header_size != HEADER_SIZE:
+                raise RingBufferError(f"{path}: non è un ring buffer {RING_MAGIC.decode()} v{RING_VERSION}")
+            if size != HEADER_SIZE + stored_capacity:
+                raise RingBufferError(f"{path}: dimensione {size} byte diversa da quella dell'intestazione "
+                                      f"({HEADER_SIZE + stored_capacity})")
+        except RingBufferError:
+            self.file.close()
+            raise
+        # File esistente: riprende dai record non ancora inviati, con la capacità di creazione
+        self.capacity, self.head, self.tail, self.count, self.dropped = stored_capacity, head, tail, count, dropped
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+
+    def _write_header(self):
+        RING_HEADER.pack_into(self.map, 0, RING_MAGIC, RING_VERSION, HEADER_SIZE, self.capacity,
+                              self.head, self.tail, self.count, self.dropped)
+
+    def _write(self, position, data):
+        offset = position % self.capacity
+        first = min(len(data), self.capacity - offset)
+        start = HEADER_SIZE + offset
+        self.map[start:start + first] = data[:first]
+        if first < len(data):
+            self.map[HEADER_SIZE:HEADER_SIZE + len(data) - first] = data[first:]
+
+    def _read(self, position, size):
+        offset = position % self.capacity
+        first = min(size, self.capacity - offset)
+        start = HEADER_SIZE + offset
+        data = self.map[start:start + first]
+        if first < size:
+            data += self.map[HEADER_SIZE:HEADER_SIZE + size - first]
+        return data
+
+    def _record_size(self, position):
+        (length,) = RECORD_LENGTH.unpack(self._read(position, RECORD_LENGTH.size))
+        return RECORD_LENGTH.size + length
+
+    @property
+    def used(self):
+        return self.tail - self.head
+
+    def append(self, record):
+        size = RECORD_LENGTH.size + len(record)
+        if size > self.capacity:
+            raise ValueError(f"Record di {len(record)} byte oltre la capacità del buffer")
+        with self.lock:
+            while self.used + size > self.capacity:
+                self.head += self._record_size(self.head)
+                self.count -= 1
+                self.dropped += 1
+            # Prima i dati, poi l'intestazione: un arresto a metà non espone record parziali
+            self._write(self.tail, RECORD_LENGTH.pack(len(record)) + record)
+            self.tail += size
+            self.count += 1
+            self._write_header()
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every:
+                self.map.flush()
+                self.unsynced = 0
+
+    def peek(self, limit):
+        """Fino a `limit` record dal più vecchio, senza rimuoverli: (record, offset di fine per commit())"""
+        records = []
+        with self.lock:
+            position = self.head
+            while len(records) < limit and position < self.tail:
+                size = self._record_size(position)
+                records.append(self._read(position + RECORD_LENGTH.size, size - RECORD_LENGTH.size))
+                position += size
+            return records, position
+
+    def commit(self, end):
+        """Rimuove i record fino a `end` (da peek()) dopo la conferma del broker"""
+        with self.lock:
+            # Record già scartati da append() nel frattempo non vanno contati due volte
+            while self.head < end:
+                self.head += self._record_size(self.head)
+                self.count -= 1
+            self._write_header()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        with self.lock:
+            if not self.readonly:
+                self._write_header()
+                self.map.flush()
+            self.map.close()
+            self.file.close()
+
+
+class OfflineForwarder:
+    """Letture al broker se connesso, altrimenti nel ring buffer; alla riconnessione recupero a velocità limitata
+
+    Il recupero parte dopo un ritardo casuale (fino a `spread` secondi) e invia batch di `batch_records`
+    letture con QoS 1 a `rate` letture/s: i record lasciano il buffer solo dopo il PUBACK.
+    """
+
+    def __init__(self, client, buffer, site_id, rate=CATCH_UP_RATE, batch_records=BATCH_RECORDS,
+                 spread=RECONNECT_SPREAD, rng=None):
+        self.client = client
+        self.buffer = buffer
+        self.topic = BATCH_TOPIC.format(site_id=site_id)
+        self.rate = rate
+        self.batch_records = batch_records
+        self.spread = spread
+        self.rng = rng or random.Random()
+        self.connected = threading.Event()
+        self.stop_event = threading.Event()
+        self.buffered = 0
+        self.forwarded = 0
+        self.thread = None
+
+    def on_connect(self):
+        self.connected.set()
+
+    def on_disconnect(self):
+        self.connected.clear()
+
+    def store(self, record):
+        """Lettura codificata (binario v1) da conservare finché il broker non torna"""
+        self.buffer.append(record)
+        self.buffered += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="offline_forwarder", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.connected.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.connected.wait()
+            if self.stop_event.is_set():
+                break
+            if not len(self.buffer):
+                self.stop_event.wait(1.0)
+                continue
+
+            # Ritardo casuale: i sensori di una flotta non recuperano tutti nello stesso istante
+            if self.stop_event.wait(self.rng.uniform(0, self.spread)):
+                break
+            while len(self.buffer) and self.connected.is_set() and not self.stop_event.is_set():
+                if not self.send_batch():
+                    break
+
+    def send_batch(self):
+        records, end = self.buffer.peek(self.batch_records)
+        if not records:
+            return False
+        started = time.monotonic()
+        info = self.client.publish(self.topic, encode_batch(records), qos=1)
+        try:
+            info.wait_for_publish(timeout=30)
+        except (RuntimeError, ValueError):
+            return False
+        if not info.is_published():
+            return False
+        self.buffer.commit(end)
+        self.forwarded += len(records)
+
+        # Velocità di recupero: un batch ogni batch/rate secondi
+        pause = len(records) / self.rate - (time.monotonic() - started)
+        if pause > 0:
+            self.stop_event.wait(pause)
+        return True
+
+
+def main():
+    print("💾 Smart Dive Site Controller - Offline Buffer")
+    print("=" * 60)
+
+    parser = argparse.ArgumentParser(description="Stato di un buffer offline del simulatore")
+    parser.add_argument("path", help="File del ring buffer")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"❌ File non trovato: {args.path}")
+        return
+    try:
+        buffer = RingBuffer(args.path, readonly=True)
+    except RingBufferError as e:
+        print(f"❌ {e}")
+        return
+    print(f"📦 {len(buffer)} letture in coda, {buffer.used / 1024:.1f} KB di {buffer.capacity / 1024:.0f} KB")
+    print(f"🗑️ Letture scartate per buffer pieno: {buffer.dropped}")
+    buffer.close()
+
+
+if __name__ == "__main__":
+    main()
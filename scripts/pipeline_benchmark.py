@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Pipeline Benchmark
+Misura latenza publish → broker → subscriber, ritardo di visibilità su InfluxDB,
+perdita e riordino dei messaggi; scrive un report JSON confrontabile tra configurazioni
+"""
+
+import paho.mqtt.client as mqtt
+from influxdb_client import InfluxDBClient
+import argparse
+import json
+import platform
+import threading
+import time
+from datetime import datetime, timezone
+
+from arduino_simulator import DiveSensorSimulator
+from database_init import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET
+from fleet_simulator import DEPTHS
+
+
+def percentiles(values, points=(50, 90, 99, 99.9)):
+    """Percentili (nearest-rank) di una lista di valori"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {f"p{p:g}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+    result["min"] = ordered[0]
+    result["max"] = ordered[-1]
+    result["mean"] = sum(ordered) / len(ordered)
+    return {key: round(value, 3) for key, value in result.items()}
+
+
+def connect_client(client, host, port, timeout=10):
+    """Connessione bloccante fino al CONNACK"""
+    connected = threading.Event()
+    client.on_connect = lambda c, userdata, flags, rc: connected.set() if rc == 0 else None
+    client.connect(host, port, 60)
+    client.loop_start()
+    if not connected.wait(timeout):
+        raise ConnectionError(f"Timeout connessione a {host}:{port}")
+
+
+class LatencyCollector:
+    """Subscriber che misura latenza, perdite e riordino dei messaggi del run"""
+
+    def __init__(self, run_id, warmup_until_ns):
+        self.run_id = run_id
+        self.warmup_until_ns = warmup_until_ns
+        self.latencies_ms = []
+        self.received = {}        # sensor_id -> messaggi ricevuti
+        self.max_seq = {}         # sensor_id -> sequenza più alta vista
+        self.reordered = 0
+        self.foreign = 0
+
+    def on_message(self, client, userdata, msg):
+        received_ns = time.time_ns()
+        try:
+            data = json.loads(msg.payload)
+            if data.get("bench_run") != self.run_id:
+                self.foreign += 1
+                return
+            sensor_id = data["sensor_id"]
+            seq = data["bench_seq"]
+            sent_ns = data["bench_sent_ns"]
+        except (ValueError, KeyError, AttributeError):
+            self.foreign += 1
+            return
+
+        self.received[sensor_id] = self.received.get(sensor_id, 0) + 1
+        if seq < self.max_seq.get(sensor_id, -1):
+            self.reordered += 1
+        else:
+            self.max_seq[sensor_id] = seq
+
+        if sent_ns >= self.warmup_until_ns:
+            self.latencies_ms.append((received_ns - sent_ns) / 1e6)
+
+
+class InfluxVisibilityProbe:
+    """Pubblica letture marcatore e misura quando diventano interrogabili su InfluxDB"""
+
+    def __init__(self, run_id, publish, every=5.0, timeout=30.0):
+        self.sensor_id = f"bench_{run_id}_probe"
+        self.publish = publish
+        self.every = every
+        self.timeout = timeout
+        self.delays_ms = []
+        self.timeouts = 0
+        self.client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
+        self.query_api = self.client.query_api()
+
+    def is_visible(self, marker):
+        query = f'''
+        from(bucket: "{INFLUXDB_BUCKET}")
+          |> range(start: -15m)
+          |> filter(fn: (r) => r["_measurement"] == "dive_conditions")
+          |> filter(fn: (r) => r["sensor_id"] == "{self.sensor_id}")
+          |> filter(fn: (r) => r["_field"] == "luminosity" and r["_value"] == {float(marker)})
+          |> count()
+        '''
+        tables = self.query_api.query(org=INFLUXDB_ORG, query=query)
+        return any(record.get_value() for table in tables for record in table.records)
+
+    def run(self, stop_event):
+        marker = 0
+        while not stop_event.is_set():
+            marker += 1
+            # Il valore di luminosità identifica il marcatore
+            sent = time.monotonic()
+            self.publish(self.sensor_id, {"luminosity": float(marker)})
+
+            while time.monotonic() - sent < self.timeout:
+                try:
+                    if self.is_visible(marker):
+                        self.delays_ms.append((time.monotonic() - sent) * 1000)
+                        break
+                except Exception as e:
+                    print(f"   ⚠️ Query InfluxDB fallita: {e}")
+                time.sleep(0.05)
+            else:
+                self.timeouts += 1
+
+            stop_event.wait(self.every)
+        self.client.close()
+
+
+class PipelineBenchmark:
+    def __init__(self, mqtt_host="localhost", mqtt_port=1883, sites=10, rate=100.0, duration=30.0,
+                 warmup=2.0, drain=3.0, qos=0, influx_probe=True, probe_every=5.0):
+        self.mqtt_host = mqtt_host
+        self.mqtt_port = mqtt_port
+        self.rate = rate
+        self.duration = duration
+        self.warmup = warmup
+        self.drain = drain
+        self.qos = qos
+        self.influx_probe = influx_probe
+        self.probe_every = probe_every
+
+        self.run_id = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+        self.publisher = mqtt.Client(client_id=f"dive_bench_pub_{self.run_id}")
+        self.subscriber = mqtt.Client(client_id=f"dive_bench_sub_{self.run_id}")
+        self.publish_lock = threading.Lock()
+        self.published = {}
+        self.publish_errors = 0
+
+        self.sensors = [
+            DiveSensorSimulator(site_id=f"bench_site_{i:03d}", sensor_id=f"bench_{self.run_id}_{i:03d}_{n}",
+                                depth=depth, mqtt_client=self.publisher, verbose=False)
+            for i in range(sites) for n, depth in enumerate(DEPTHS)
+        ]
+
+    def publish_reading(self, sensor, overrides=None):
+        """Pubblica una lettura marcata con run, sequenza e istante di invio"""
+        data = sensor.read_all_sensors()
+        data["timestamp"] = datetime.now(timezone.utc).isoformat()
+        if overrides:
+            data.update(overrides)
+
+        with self.publish_lock:
+            seq = self.published.get(sensor.sensor_id, 0)
+            self.published[sensor.sensor_id] = seq + 1
+        data["bench_run"] = self.run_id
+        data["bench_seq"] = seq
+        data["bench_sent_ns"] = time.time_ns()
+
+        info = self.publisher.publish(f"dive/{sensor.site_id}/sensors/data", json.dumps(data), qos=self.qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            # Publisher e sonde girano su thread diversi
+            with self.publish_lock:
+                self.publish_errors += 1
+
+    def publish_probe(self, sensor_id, overrides):
+        probe = DiveSensorSimulator(site_id="bench_probe", sensor_id=sensor_id,
+                                    mqtt_client=self.publisher, verbose=False)
+        self.publish_reading(probe, overrides)
+
+    def run_publisher(self):
+        """Ritmo costante: la lettura i-esima parte a start + i / rate"""
+        start = time.monotonic()
+        count = 0
+        total = int(self.rate * self.duration)
+        while count < total:
+            due = start + count / self.rate
+            delay = due - time.monotonic()
+            if delay > 0.001:
+                time.sleep(delay)
+            self.publish_reading(self.sensors[count % len(self.sensors)])
+            count += 1
+        return time.monotonic() - start
+
+    def run(self):
+        collector = LatencyCollector(self.run_id, time.time_ns() + int(self.warmup * 1e9))
+        self.subscriber.on_message = collector.on_message
+        connect_client(self.subscriber, self.mqtt_host, self.mqtt_port)
+        self.subscriber.subscribe("dive/+/sensors/data", qos=self.qos)
+        connect_client(self.publisher, self.mqtt_host, self.mqtt_port)
+        time.sleep(0.5)
+
+        print(f"🚀 Run {self.run_id}: {len(self.sensors)} sensori, {self.rate:g} letture/s per {self.duration:g}s")
+
+        probe = None
+        stop_probe = threading.Event()
+        if self.influx_probe:
+            probe = InfluxVisibilityProbe(self.run_id, self.publish_probe, every=self.probe_every)
+            probe_thread = threading.Thread(target=probe.run, args=(stop_probe,), daemon=True)
+            probe_thread.start()
+
+        try:
+            publish_elapsed = self.run_publisher()
+            time.sleep(self.drain)
+        finally:
+            stop_probe.set()
+            if probe:
+                probe_thread.join(timeout=probe.timeout + 1)
+            self.publisher.loop_stop()
+            self.publisher.disconnect()
+            self.subscriber.loop_stop()
+            self.subscriber.disconnect()
+
+        return self.build_report(collector, probe, publish_elapsed)
+
+    def build_report(self, collector, probe, publish_elapsed):
+        bench_sensors = {sensor.sensor_id for sensor in self.sensors}
+        published = sum(count for sensor_id, count in self.published.items() if sensor_id in bench_sensors)
+        received = sum(count for sensor_id, count in collector.received.items() if sensor_id in bench_sensors)
+
+        report = {
+            "run_id": self.run_id,
+            "host": platform.node(),
+            "config": {
+                "mqtt": f"{self.mqtt_host}:{self.mqtt_port}",
+                "sensors": len(self.sensors),
+                "rate": self.rate,
+                "duration_s": self.duration,
+                "warmup_s": self.warmup,
+                "qos": self.qos,
+            },
+            "publish": {
+                "messages": published,
+                "errors": self.publish_errors,
+                "achieved_rate": round(published / max(publish_elapsed, 1e-9), 1),
+            },
+            "subscribe": {
+                "messages": received,
+                "lost": max(published - received, 0),
+                "loss_ratio": round(max(published - received, 0) / published, 6) if published else 0,
+                "reordered": collector.reordered,
+                "latency_ms": percentiles(collector.latencies_ms),
+            },
+        }
+        if probe:
+            report["influxdb"] = {
+                "probes": len(probe.delays_ms) + probe.timeouts,
+                "timeouts": probe.timeouts,
+                "visible_delay_ms": percentiles(probe.delays_ms),
+            }
+        return report
+
+
+def print_report(report):
+    sub = report["subscribe"]
+    latency = sub["latency_ms"]
+    print("\n📊 Risultati")
+    print(f"   Pubblicati: {report['publish']['messages']} ({report['publish']['achieved_rate']}/s)")
+    print(f"   Ricevuti: {sub['messages']} | persi {sub['lost']} ({sub['loss_ratio']:.4%}) | riordinati {sub['reordered']}")
+    if latency:
+        print(f"   Latenza MQTT ms: p50 {latency['p50']} | p90 {latency['p90']} | "
+              f"p99 {latency['p99']} | max {latency['max']}")
+    influx = report.get("influxdb")
+    if influx and influx["visible_delay_ms"]:
+        delay = influx["visible_delay_ms"]
+        print(f"   Visibilità InfluxDB ms: p50 {delay['p50']} | p99 {delay['p99']} | "
+              f"max {delay['max']} ({influx['timeouts']} timeout)")
+    elif influx:
+        print(f"   Visibilità InfluxDB: nessun marcatore visibile ({influx['timeouts']} timeout)")
+
+
+def main():
+    print("⏱️ Smart Dive Site Controller - Pipeline Benchmark")
+    print("=" * 60)
+
+    parser = argparse.ArgumentParser(description="Benchmark latenza e throughput della pipeline")
+    parser.add_argument("--host", default="localhost", help="Broker MQTT")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--sites", type=int, default=10, help="Siti sintetici (3 sensori per sito)")
+    parser.add_argument("--rate", type=float, default=100.0, help="Letture/s totali")
+    parser.add_argument("--duration", type=float, default=30.0, help="Secondi di pubblicazione")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Secondi iniziali esclusi dalle latenze")
+    parser.add_argument("--drain", type=float, default=3.0, help="Attesa finale per i messaggi in volo")
+    parser.add_argument("--qos", type=int, default=0, choices=[0, 1, 2])
+    parser.add_argument("--no-influx", action="store_true", help="Salta la misura di visibilità su InfluxDB")
+    parser.add_argument("--probe-every", type=float, default=5.0, help="Secondi tra marcatori InfluxDB")
+    parser.add_argument("--report", default="benchmark_report.json", help="File JSON del report")
+    args = parser.parse_args()
+
+    benchmark = PipelineBenchmark(
+        mqtt_host=args.host,
+        mqtt_port=args.port,
+        sites=args.sites,
+        rate=args.rate,
+        duration=args.duration,
+        warmup=args.warmup,
+        drain=args.drain,
+        qos=args.qos,
+        influx_probe=not args.no_influx,
+        probe_every=args.probe_every
+    )
+
+    try:
+        report = benchmark.run()
+    except KeyboardInterrupt:
+        print("\n🛑 Benchmark interrotto dall'utente")
+        return
+    except Exception as e:
+        print(f"❌ Errore benchmark: {e}")
+        print("💡 Verifica che i servizi siano avviati: docker-compose up -d")
+        return
+
+    print_report(report)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Report salvato in {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Sensor Codec
+Formato binario versionato a layout fisso per il record sensor_data,
+con encoder/decoder e benchmark rispetto al percorso JSON
+"""
+
+from datetime import datetime, timezone
+import json
+import random
+import struct
+import sys
+import time
+
+MAGIC = 0xD5
+VERSION = 1
+
+# v1, network byte order:
+#   magic u8 | version u8 | timestamp_ms u64 | depth u8 | weather u8 |
+#   temperature i16 (c°C) | current_speed u16 (cm/s) | current_direction u16 (°) |
+#   visibility u16 (dm) | luminosity u32 (dlux) | battery_level u16 (d%) |
+#   site_id (u8 len + utf-8) | sensor_id (u8 len + utf-8)
+HEADER = struct.Struct("!BBQBBhHHHIH")
+
+# Batch v1 (recupero dopo una disconnessione, timestamp originali):
+#   magic u8 | version u8 | count u16 | count × (length u16 | record v1)
+BATCH_MAGIC = 0xD6
+BATCH_HEADER = struct.Struct("!BBH")
+RECORD_LENGTH = struct.Struct("!H")
+MAX_BATCH_RECORDS = 65535
+MAX_ID_BYTES = 255          # site_id e sensor_id: lunghezza in un u8
+
+DEPTHS = ["surface", "shallow", "deep"]
+WEATHER = ["calm", "stormy", "changing"]
+UNKNOWN = 255
+
+BINARY_TOPIC = "dive/{site_id}/sensors/bin"
+BATCH_TOPIC = "dive/{site_id}/sensors/batch"
+
+
+class CodecError(ValueError):
+    """Payload binario non valido o versione non supportata"""
+
+
+def _timestamp_ms(timestamp):
+    """ISO (naive = ora locale) o Unix in secondi → ms UTC"""
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp * 1000)
+    if isinstance(timestamp, str):
+        return int(datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp() * 1000)
+    return int(time.time() * 1000)
+
+
+def _enum(values, value):
+    try:
+        return values.index(value)
+    except ValueError:
+        return UNKNOWN
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, int(round(value))))
+
+
+def encode_sensor_data(data):
+    """Codifica una lettura nel formato binario v1"""
+    site_id = data["site_id"].encode()
+    sensor_id = data["sensor_id"].encode()
+    if len(site_id) > MAX_ID_BYTES or len(sensor_id) > MAX_ID_BYTES:
+        raise CodecError(f"site_id/sensor_id oltre {MAX_ID_BYTES} byte")
+
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        _timestamp_ms(data.get("timestamp")),
+        _enum(DEPTHS, data.get("depth")),
+        _enum(WEATHER, data.get("weather_pattern")),
+        _clamp(data["temperature"] * 100, -32768, 32767),
+        _clamp(data["current_speed"] * 100, 0, 65535),
+        _clamp(data.get("current_direction") or 0, 0, 359),
+        _clamp(data["visibility"] * 10, 0, 65535),
+        _clamp(data["luminosity"] * 10, 0, 0xFFFFFFFF),
+        _clamp(data["battery_level"] * 10, 0, 65535),
+    )
+    return b"".join((header, bytes((len(site_id),)), site_id, bytes((len(sensor_id),)), sensor_id))
+
+
+def _read_string(payload, offset):
+    """Stringa u8 len + utf-8 a `offset`: (stringa, offset successivo), con controllo dei limiti"""
+    if offset >= len(payload):
+        raise CodecError("Payload binario troncato")
+    end = offset + 1 + payload[offset]
+    if end > len(payload):
+        raise CodecError("Payload binario troncato")
+    try:
+        return payload[offset + 1:end].decode(), end
+    except UnicodeDecodeError:
+        raise CodecError("Identificativo non UTF-8") from None
+
+
+def decode_sensor_data(payload):
+    """Decodifica un payload binario nello stesso dict del formato JSON"""
+    if len(payload) < HEADER.size + 2 or payload[0] != MAGIC:
+        raise CodecError("Payload binario non valido")
+    if payload[1] != VERSION:
+        raise CodecError(f"Versione formato non supportata: {payload[1]}")
+
+    (_, _, timestamp_ms, depth, weather, temperature, current_speed, current_direction,
+     visibility, luminosity, battery_level) = HEADER.unpack_from(payload)
+
+    site_id, offset = _read_string(payload, HEADER.size)
+    sensor_id, offset = _read_string(payload, offset)
+    if offset != len(payload):
+        raise CodecError("Lunghezza payload non coerente")
+
+    data = {
+        "timestamp": datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc).isoformat().replace("+00:00", "Z"),
+        "site_id": site_id,
+        "sensor_id": sensor_id,
+        "depth": DEPTHS[depth] if depth < len(DEPTHS) else "unknown",
+        "temperature": temperature / 100,
+        "current_speed": current_speed / 100,
+        "current_direction": current_direction,
+        "visibility": visibility / 10,
+        "luminosity": luminosity / 10,
+        "battery_level": battery_level / 10,
+    }
+    if weather < len(WEATHER):
+        data["weather_pattern"] = WEATHER[weather]
+    return data
+
+
+def encode_batch(records):
+    """Batch di record già codificati in v1 (es. letti dal buffer offline)"""
+    if len(records) > MAX_BATCH_RECORDS:
+        raise CodecError(f"Batch oltre {MAX_BATCH_RECORDS} record")
+    parts = [BATCH_HEADER.pack(BATCH_MAGIC, VERSION, len(records))]
+    for record in records:
+        parts.append(RECORD_LENGTH.pack(len(record)))
+        parts.append(record)
+    return b"".join(parts)
+
+
+def decode_batch(payload):
+    """Lista di dict sensor_data da un batch v1"""
+    if len(payload) < BATCH_HEADER.size or payload[0] != BATCH_MAGIC:
+        raise CodecError("Batch binario non valido")
+    _, version, count = BATCH_HEADER.unpack_from(payload)
+    if version != VERSION:
+        raise CodecError(f"Versione formato non supportata: {version}")
+
+    readings = []
+    offset = BATCH_HEADER.size
+    for _ in range(count):
+        if offset + RECORD_LENGTH.size > len(payload):
+            raise CodecError("Batch troncato")
+        (length,) = RECORD_LENGTH.unpack_from(payload, offset)
+        offset += RECORD_LENGTH.size
+        readings.append(decode_sensor_data(payload[offset:offset + length]))
+        offset += length
+    if offset != len(payload):
+        raise CodecError("Lunghezza batch non coerente")
+    return readings
+
+
+def is_binary_payload(payload):
+    return len(payload) > 0 and payload[0] == MAGIC
+
+
+def is_batch_payload(payload):
+    return len(payload) > 0 and payload[0] == BATCH_MAGIC
+
+
+def decode_payload(payload):
+    """Decodifica JSON, record binario o batch (lista di record) riconoscendo il magic byte"""
+    if is_binary_payload(payload):
+        return decode_sensor_data(payload)
+    if is_batch_payload(payload):
+        return decode_batch(payload)
+    return json.loads(payload)
+
+
+def _sample_readings(count, seed=42):
+    rng = random.Random(seed)
+    readings = []
+    for i in range(count):
+        readings.append({
+            "timestamp": datetime.now().isoformat(),
+            "site_id": rng.choice(["capo_vaticano", "tropea_reef", "stromboli_east"]),
+            "sensor_id": "sensor_01",
+            "depth": rng.choice(DEPTHS),
+            "temperature": round(rng.uniform(10, 25), 2),
+            "current_speed": round(rng.uniform(0, 2), 2),
+            "current_direction": rng.randrange(360),
+            "visibility": round(rng.uniform(1, 30), 1),
+            "luminosity": round(rng.uniform(0, 1200), 1),
+            "battery_level": round(rng.uniform(0, 100), 1),
+            "weather_pattern": rng.choice(WEATHER),
+        })
+    return readings
+
+
+def _fanout_bytes(data):
+    """Byte (topic + payload) delle pubblicazioni per-campo del percorso JSON"""
+    site = data["site_id"]
+    topics = {
+        f"dive/{site}/sensors/temperature": data["temperature"],
+        f"dive/{site}/sensors/current": {"speed": data["current_speed"], "direction": data["current_direction"]},
+        f"dive/{site}/sensors/visibility": data["visibility"],
+        f"dive/{site}/sensors/luminosity": data["luminosity"],
+        f"dive/{site}/status/battery": data["battery_level"],
+    }
+    return sum(len(topic) + len(json.dumps(payload)) for topic, payload in topics.items())
+
+
+def run_benchmark(count=100000):
+    """Confronta byte per lettura e costo encode/decode JSON vs binario"""
+    readings = _sample_readings(count)
+
+    start = time.perf_counter()
+    json_payloads = [json.dumps(data).encode() for data in readings]
+    json_encode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for payload in json_payloads:
+        json.loads(payload)
+    json_decode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    binary_payloads = [encode_sensor_data(data) for data in readings]
+    binary_encode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for payload in binary_payloads:
+        decode_sensor_data(payload)
+    binary_decode = time.perf_counter() - start
+
+    data_topic = sum(len(f"dive/{d['site_id']}/sensors/data") for d in readings) / count
+    bin_topic = sum(len(BINARY_TOPIC.format(site_id=d["site_id"])) for d in readings) / count
+    json_bytes = sum(map(len, json_payloads)) / count
+    binary_bytes = sum(map(len, binary_payloads)) / count
+    fanout_bytes = sum(map(_fanout_bytes, readings)) / count
+
+    results = [
+        ("JSON + fan-out (6 msg)", json_bytes + data_topic + fanout_bytes, json_encode, json_decode),
+        ("JSON aggregato (1 msg)", json_bytes + data_topic, json_encode, json_decode),
+        ("Binario v1 (1 msg)", binary_bytes + bin_topic, binary_encode, binary_decode),
+    ]
+
+    print(f"📏 Benchmark su {count} letture (payload JSON {json_bytes:.0f} B, binario {binary_bytes:.0f} B)")
+    print(f"   {'Formato':<24} {'B/lettura':>10} {'encode µs':>10} {'decode µs':>10}")
+    for name, size, encode, decode in results:
+        print(f"   {name:<24} {size:>10.0f} {encode / count * 1e6:>10.2f} {decode / count * 1e6:>10.2f}")
+    print("   (B/lettura include i byte dei topic; alert esclusi)")
+    return results
+
+
+def main():
+    print("📦 Smart Dive Site Controller - Sensor Codec Benchmark")
+    print("=" * 60)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    run_benchmark(count)
+
+
+if __name__ == "__main__":
+    main()
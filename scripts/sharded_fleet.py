@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Sharded Fleet
+Generatore di carico multi-core: la popolazione di sensori virtuali è divisa in
+shard, uno per processo (codifica JSON e ciclo paho tengono il GIL, un processo
+satura un solo core). Ogni worker ha seed e intervallo di client id propri e
+invia al processo padre, via pipe, contatori e latenze di publish da aggregare
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+
+from arduino_simulator import DISCONNECTS, PAYLOAD_FORMATS, PUBLISH_PROFILES, PUBLISH_SECONDS, parse_deadband
+from fleet_simulator import DEPTHS, FleetSimulator, FleetStats, fleet_site_ids, parse_interval
+from metrics import LATENCY_BUCKETS
+
+SHARD_REPORT = 1.0          # secondi tra due invii di statistiche dal worker
+STOP_POLL = 0.2             # reattività del worker allo stop
+SHUTDOWN_TIMEOUT = 15.0     # attesa dei worker allo stop prima di terminarli
+
+
+def shard_sites(sites, shards):
+    """Divide i siti in `shards` intervalli contigui di dimensione quasi uguale"""
+    size, extra = divmod(len(sites), shards)
+    ranges, start = [], 0
+    for shard in range(shards):
+        end = start + size + (1 if shard < extra else 0)
+        ranges.append(sites[start:end])
+        start = end
+    return ranges
+
+
+def shard_report(shard, fleet, done=False):
+    """Contatori cumulativi del worker: il padre somma e calcola i ritmi dalle differenze"""
+    counts, total, count = PUBLISH_SECONDS.default.snapshot()
+    return {
+        "shard": shard,
+        "pid": os.getpid(),
+        "sensors": len(fleet.sensors),
+        "readings": fleet.stats.readings,
+        "messages": fleet.stats.messages,
+        "elapsed_s": time.monotonic() - fleet.stats.started_at,
+        "connected": sum(connection.connected.is_set() for connection in fleet.pool.connections),
+        "connections": len(fleet.pool.connections),
+        "disconnects": DISCONNECTS.default.value,
+        "latency": {"counts": counts, "sum": total, "count": count},
+        "done": done,
+    }
+
+
+async def drive_shard(shard, fleet, stop, conn, duration):
+    if not fleet.pool.connect():
+        conn.send({"shard": shard, "pid": os.getpid(), "failed": True, "done": True})
+        return
+
+    fleet.stats = FleetStats()
+    scheduler = asyncio.create_task(fleet.scheduler_loop(duration))
+    next_report = time.monotonic() + SHARD_REPORT
+    try:
+        while not scheduler.done() and not stop.is_set():
+            await asyncio.wait([scheduler], timeout=STOP_POLL)
+            if time.monotonic() >= next_report:
+                conn.send(shard_report(shard, fleet))
+                next_report += SHARD_REPORT
+        if scheduler.done():
+            scheduler.result()
+    finally:
+        scheduler.cancel()
+        fleet.pool.close()
+    conn.send(shard_report(shard, fleet, done=True))
+
+
+def run_shard(shard, site_ids, options, duration, stop, conn):
+    """Processo worker: una FleetSimulator sui soli siti dello shard"""
+    # Ctrl+C arriva a tutto il gruppo di processi: lo gestisce solo il padre, tramite `stop`
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        fleet = FleetSimulator(sites=len(site_ids), site_ids=site_ids, shard=shard, verbose=False, **options)
+        asyncio.run(drive_shard(shard, fleet, stop, conn, duration))
+    except Exception as e:
+        conn.send({"shard": shard, "pid": os.getpid(), "failed": True, "error": str(e), "done": True})
+    finally:
+        conn.close()
+
+
+def latency_quantile(counts, q, bounds=LATENCY_BUCKETS):
+    """Limite superiore del bucket che contiene il quantile `q` (None senza campioni)"""
+    total = sum(counts)
+    if not total:
+        return None
+    target, cumulative = q * total, 0
+    for bound, count in zip(bounds + (float("inf"),), counts):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return float("inf")
+
+
+def format_latency(bound):
+    if bound is None:
+        return "-"
+    if bound == float("inf"):
+        return f">{LATENCY_BUCKETS[-1]:g}s"
+    return f"≤{bound * 1000:g}ms"
+
+
+class ShardedFleet:
+    """Processo padre: avvia i worker, raccoglie le statistiche, li ferma in modo ordinato"""
+
+    def __init__(self, workers, sites, duration=0, **options):
+        site_ids = fleet_site_ids(sites)
+        self.workers = max(1, min(workers, len(site_ids)))
+        self.duration = duration
+        self.ranges = shard_sites(site_ids, self.workers)
+        self.options = options
+        self.stop = multiprocessing.Event()
+        self.processes = []
+        self.receivers = {}          # connessione -> shard
+        self.latest = {}             # shard -> ultimo report ricevuto
+        self.failed = set()
+        self._last_report = (time.monotonic(), 0, 0)
+
+    def start(self):
+        # I figli nascono con SIGINT ignorato: nessun KeyboardInterrupt a metà avvio
+        previous = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        try:
+            for shard, site_ids in enumerate(self.ranges):
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=run_shard, name=f"fleet_shard_{shard:02d}",
+                                                  args=(shard, site_ids, self.options, self.duration,
+                                                        self.stop, sender))
+                process.start()
+                sender.close()
+                self.processes.append(process)
+                self.receivers[receiver] = shard
+        finally:
+            signal.signal(signal.SIGINT, previous)
+
+        connections = self.options.get("connections", 4)
+        sizes = sorted({len(site_ids) for site_ids in self.ranges})
+        print(f"🚀 {self.workers} worker, {'-'.join(map(str, sizes))} siti ciascuno, "
+              f"client id {self.options.get('client_prefix', 'dive_fleet')}_00.."
+              f"{self.workers * connections - 1:02d}")
+
+    @property
+    def running(self):
+        return bool(self.receivers)
+
+    def collect(self, timeout):
+        """Riceve i report disponibili entro `timeout`; una pipe chiusa è un worker terminato"""
+        for receiver in multiprocessing.connection.wait(list(self.receivers), timeout):
+            try:
+                report = receiver.recv()
+            except EOFError:
+                shard = self.receivers.pop(receiver)
+                if not self.latest.get(shard, {}).get("done"):
+                    self.failed.add(shard)
+                continue
+            self.latest[report["shard"]] = report
+            if report.get("failed"):
+                self.failed.add(report["shard"])
+                print(f"❌ Shard {report['shard']} (pid {report['pid']}) fallito: {report.get('error', 'connessione')}")
+
+    def totals(self):
+        reports = [report for report in self.latest.values() if not report.get("failed")]
+        counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        for report in reports:
+            counts = [a + b for a, b in zip(counts, report["latency"]["counts"])]
+        return {
+            "workers": len(reports),
+            "sensors": sum(report["sensors"] for report in reports),
+            "readings": sum(report["readings"] for report in reports),
+            "messages": sum(report["messages"] for report in reports),
+            "connected": sum(report["connected"] for report in reports),
+            "connections": sum(report["connections"] for report in reports),
+            "disconnects": sum(report["disconnects"] for report in reports),
+            # Ogni worker ha il proprio orologio: il ritmo totale è la somma dei ritmi
+            "readings_per_s": sum(report["readings"] / max(report["elapsed_s"], 1e-9) for report in reports),
+            "messages_per_s": sum(report["messages"] / max(report["elapsed_s"], 1e-9) for report in reports),
+            "latency_counts": counts,
+        }
+
+    def print_progress(self):
+        totals = self.totals()
+        if not totals["workers"]:
+            print("⏳ In attesa dei primi report dai worker...")
+            return
+        now = time.monotonic()
+        last_time, last_readings, last_messages = self._last_report
+        elapsed = max(now - last_time, 1e-9)
+        self._last_report = (now, totals["readings"], totals["messages"])
+        p50 = latency_quantile(totals["latency_counts"], 0.5)
+        p99 = latency_quantile(totals["latency_counts"], 0.99)
+        print(f"📈 worker {totals['workers']:3d} | conn {totals['connected']}/{totals['connections']} | "
+              f"{(totals['readings'] - last_readings) / elapsed:9.1f} letture/s | "
+              f"{(totals['messages'] - last_messages) / elapsed:10.1f} msg/s | "
+              f"publish p50 {format_latency(p50)} p99 {format_latency(p99)}")
+
+    def shutdown(self):
+        """Stop cooperativo: i worker chiudono il pool e inviano il report finale; i ritardatari vengono terminati"""
+        self.stop.set()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        while self.receivers and time.monotonic() < deadline:
+            self.collect(max(0, deadline - time.monotonic()))
+        for process in self.processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                print(f"⚠️ {process.name} non risponde: terminato")
+                process.terminate()
+                process.join()
+
+    def print_summary(self):
+        totals = self.totals()
+        print("\n📊 Riepilogo flotta multi-processo")
+        print(f"   Worker: {totals['workers']} attivi" + (f", {len(self.failed)} falliti" if self.failed else ""))
+        print(f"   Sensori: {totals['sensors']} su {totals['connections']} connessioni MQTT")
+        print(f"   Letture: {totals['readings']} ({totals['readings_per_s']:.1f}/s)")
+        print(f"   Messaggi MQTT: {totals['messages']} ({totals['messages_per_s']:.1f}/s)")
+        print(f"   Disconnessioni: {totals['disconnects']}")
+        print("   Latenza publish: " + ", ".join(
+            f"p{int(q * 100)} {format_latency(latency_quantile(totals['latency_counts'], q))}"
+            for q in (0.5, 0.9, 0.99)))
+        for shard in sorted(self.latest):
+            report = self.latest[shard]
+            if report.get("failed"):
+                continue
+            print(f"   shard {shard:02d} (pid {report['pid']}): {report['sensors']} sensori, "
+                  f"{report['readings'] / max(report['elapsed_s'], 1e-9):.1f} letture/s, "
+                  f"{report['messages'] / max(report['elapsed_s'], 1e-9):.1f} msg/s")
+
+
+def main():
+    print("🤖 Smart Dive Site Controller - Sharded Fleet")
+    print("=" * 70)
+
+    parser = argparse.ArgumentParser(description="Simulatore di flotta multi-processo (un worker per core)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processi worker (default: core)")
+    parser.add_argument("--host", default="localhost", help="Broker MQTT")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--sites", type=int, default=1000, help="Numero totale di siti virtuali")
+    parser.add_argument("--depths", default=",".join(DEPTHS), help="Profondità per sito (lista separata da virgole)")
+    parser.add_argument("--connections", type=int, default=4, help="Connessioni MQTT per worker")
+    parser.add_argument("--interval", type=parse_interval, default=(30.0, 30.0),
+                        help="Intervallo per sensore in secondi, fisso (10) o range (5-30)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Jitter relativo sull'intervallo (0.1 = ±10%%)")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Secondi su cui distribuire l'avvio dei sensori")
+    parser.add_argument("--duration", type=float, default=0, help="Durata in secondi (0 = fino a Ctrl+C)")
+    parser.add_argument("--report", type=float, default=5.0, help="Intervallo report throughput in secondi")
+    parser.add_argument("--events", type=float, default=0.1, help="Probabilità di evento casuale per lettura")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed: stessi dati dei sensori con qualsiasi numero di worker")
+    parser.add_argument("--format", default="json", choices=PAYLOAD_FORMATS, help="Formato payload letture")
+    parser.add_argument("--profile", default="full", choices=PUBLISH_PROFILES, help="Profilo di pubblicazione")
+    parser.add_argument("--deadband", type=parse_deadband, action="append", default=[],
+                        help="Deadband del profilo delta, es. temperature=0.5 (ripetibile)")
+    parser.add_argument("--client-prefix", default="dive_fleet",
+                        help="Prefisso dei client id; il worker N usa gli indici N*connections...")
+    args = parser.parse_args()
+
+    fleet = ShardedFleet(
+        workers=args.workers,
+        sites=args.sites,
+        duration=args.duration,
+        depths=args.depths.split(","),
+        mqtt_host=args.host,
+        mqtt_port=args.port,
+        connections=args.connections,
+        interval=args.interval,
+        jitter=args.jitter,
+        ramp_up=args.ramp_up,
+        event_probability=args.events,
+        seed=args.seed,
+        payload_format=args.format,
+        publish_profile=args.profile,
+        deadbands=dict(args.deadband),
+        client_prefix=args.client_prefix
+    )
+    fleet.start()
+    print("   Premi Ctrl+C per fermare\n")
+
+    try:
+        next_report = time.monotonic() + args.report
+        while fleet.running:
+            fleet.collect(max(0, next_report - time.monotonic()))
+            if time.monotonic() >= next_report:
+                fleet.print_progress()
+                next_report += args.report
+    except KeyboardInterrupt:
+        print("\n🛑 Interruzione utente: arresto dei worker...")
+    finally:
+        fleet.shutdown()
+
+    fleet.print_summary()
+    print("✅ Simulazione terminata")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Simulation Clock
+Orologi (reale o virtuale) e generatori casuali per sensore,
+per simulazioni riproducibili e più veloci del tempo reale
+"""
+
+from datetime import datetime, timedelta, timezone
+import random
+import time
+
+# Ora solare dei siti (Calabria, UTC+1 senza ora legale): guida i cicli giornalieri del modello.
+# Offset fisso invece di Europe/Rome: nessuna dipendenza da tzdata
+SITE_SOLAR_TZ = timezone(timedelta(hours=1))
+
+
+class WallClock:
+    """Tempo reale: comportamento storico del simulatore
+
+    now() è in UTC per entrambi gli orologi e local_hour() nell'ora solare dei siti: né i
+    timestamp né i cicli giornalieri dipendono dal fuso della macchina che esegue la simulazione.
+    """
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.now(timezone.utc)
+
+    def local_hour(self):
+        return self.now().astimezone(SITE_SOLAR_TZ).hour
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """Tempo simulato: `sleep` avanza l'orologio senza attendere"""
+
+    def __init__(self, start=None):
+        if isinstance(start, datetime):
+            start = start.timestamp()
+        self.current = time.time() if start is None else float(start)
+
+    def time(self):
+        return self.current
+
+    def now(self):
+        return datetime.fromtimestamp(self.current, timezone.utc)
+
+    def local_hour(self):
+        return self.now().astimezone(SITE_SOLAR_TZ).hour
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self.current += seconds
+
+
+def sensor_rng(seed, site_id, sensor_id):
+    """Stream casuale indipendente per sensore (non deterministico se seed è None)"""
+    if seed is None:
+        return random.Random()
+    return random.Random(f"{seed}:{site_id}:{sensor_id}")
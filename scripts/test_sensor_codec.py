@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Test Sensor Codec
+Round-trip dei formati binari e payload malformati: ogni errore deve essere un CodecError
+(ValueError), l'unica eccezione gestita dai consumer MQTT
+"""
+
+import unittest
+
+from sensor_codec import (CodecError, HEADER, decode_batch, decode_payload, decode_sensor_data,
+                          encode_batch, encode_sensor_data)
+
+READING = {
+    "timestamp": "2026-03-01T10:15:30Z",
+    "site_id": "capo_vaticano",
+    "sensor_id": "sensor_01",
+    "depth": "shallow",
+    "temperature": 17.42,
+    "current_speed": 0.35,
+    "current_direction": 274,
+    "visibility": 18.5,
+    "luminosity": 640.3,
+    "battery_level": 87.6,
+    "weather_pattern": "calm",
+}
+
+
+class SensorCodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertEqual(decode_sensor_data(encode_sensor_data(READING)), READING)
+
+    def test_batch_round_trip(self):
+        other = dict(READING, site_id="tropea_reef", temperature=-1.5, timestamp="2026-03-01T10:16:00Z")
+        payload = encode_batch([encode_sensor_data(READING), encode_sensor_data(other)])
+        self.assertEqual(decode_payload(payload), [READING, other])
+
+    def test_truncated_payload(self):
+        payload = encode_sensor_data(READING)
+        for size in range(len(payload)):
+            with self.subTest(size=size), self.assertRaises(CodecError):
+                decode_sensor_data(payload[:size])
+
+    def test_header_with_short_identifiers(self):
+        # Intestazione seguita da 2-3 byte: lunghezze dichiarate oltre la fine del payload
+        header = encode_sensor_data(READING)[:HEADER.size]
+        for tail in (b"\x05\x01", b"\x01a", b"\x01a\x04", b"\x00\x00\x00"):
+            with self.subTest(tail=tail), self.assertRaises(CodecError):
+                decode_sensor_data(header + tail)
+
+    def test_invalid_utf8(self):
+        header = encode_sensor_data(READING)[:HEADER.size]
+        with self.assertRaises(CodecError):
+            decode_sensor_data(header + b"\x01\xff\x01a")
+
+    def test_truncated_record_in_batch(self):
+        payload = encode_batch([encode_sensor_data(READING)])
+        for size in range(len(payload)):
+            with self.subTest(size=size), self.assertRaises(CodecError):
+                decode_batch(payload[:size])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Smart Dive Site Controller - Warp Simulator
+Esegue i modelli di DiveSensorSimulator in tempo virtuale, alla massima velocità
+della CPU, pubblicando su MQTT o scrivendo file line protocol giornalieri
+"""
+
+import argparse
+import math
+import os
+import time
+from datetime import datetime, timedelta
+
+from arduino_simulator import DiveSensorSimulator, PAYLOAD_FORMATS, PUBLISH_PROFILES
+from fleet_simulator import DEPTHS, MQTTConnectionPool, fleet_site_ids
+from dive_schema import DIVE_CONDITIONS
+from sim_clock import VirtualClock
+
+# Letture tra due attese di scrittura su socket in uscita MQTT
+BACKPRESSURE_EVERY = 1000
+
+
+class FileOnlyClient:
+    """Client fittizio per l'uscita su file: le letture non passano da MQTT"""
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        return None
+
+
+class LineProtocolFiles:
+    """Un file .lp per giorno simulato (caricabile con `influx write`)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self.lines = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, day, line):
+        f = self.files.get(day)
+        if f is None:
+            f = self.files[day] = open(os.path.join(self.directory, f"dive_{day}.lp"), "w", buffering=1 << 20)
+        f.write(line)
+        f.write("\n")
+        self.lines += 1
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+class WarpSimulator:
+    def __init__(self, sites=3, depths=None, start=None, step=60.0, seed=42, events_per_hour=0.5,
+                 mqtt_pool=None, payload_format="json", publish_profile="aggregate"):
+        self.depths = depths or DEPTHS
+        self.step = step
+        self.clock = VirtualClock(start)
+        self.pool = mqtt_pool
+        # Probabilità di evento per passo equivalente a un processo di Poisson con tasso orario
+        self.event_probability = 1 - math.exp(-events_per_hour * step / 3600)
+        self.readings = 0
+        self.encoder = DIVE_CONDITIONS.encoder("ns")
+
+        file_client = FileOnlyClient()
+        self.sensors = []
+        for site_id in fleet_site_ids(sites):
+            for n, depth in enumerate(self.depths, start=1):
+                client = mqtt_pool.client_for(len(self.sensors)) if mqtt_pool else file_client
+                self.sensors.append(DiveSensorSimulator(
+                    site_id=site_id,
+                    sensor_id=f"sensor_{n:02d}",
+                    depth=depth,
+                    mqtt_client=client,
+                    verbose=False,
+                    payload_format=payload_format,
+                    publish_profile=publish_profile,
+                    clock=self.clock,
+                    seed=seed
+                ))
+
+    def run(self, duration, output):
+        """Avanza di `duration` secondi virtuali; `output(sensor, data)` riceve ogni lettura"""
+        steps = int(duration / self.step)
+        for _ in range(steps):
+            for sensor in self.sensors:
+                output(sensor, sensor.read_all_sensors())
+                self.readings += 1
+                # Gli eventi usano lo stream del sensore: stessa sequenza a ogni run con lo stesso seed
+                if sensor.rng.random() < self.event_probability:
+                    sensor.simulate_random_event()
+            self.clock.advance(self.step)
+
+    def mqtt_output(self):
+        def output(sensor, data):
+            sensor.publish_data(data)
+            if self.readings % BACKPRESSURE_EVERY == 0 and sensor.last_message is not None:
+                sensor.last_message.wait_for_publish()
+        return output
+
+    def file_output(self, files):
+        def output(sensor, data):
+            # Il timestamp della lettura è l'istante dell'orologio virtuale
+            files.write(data["timestamp"][:10], self.encoder.encode_record(data, self.clock.time()))
+        return output
+
+
+def main():
+    print("⏩ Smart Dive Site Controller - Warp Simulator")
+    print("=" * 60)
+
+    parser = argparse.ArgumentParser(description="Simulazione in tempo virtuale, riproducibile")
+    parser.add_argument("--sites", type=int, default=3)
+    parser.add_argument("--depths", default=",".join(DEPTHS), help="Profondità per sito (lista separata da virgole)")
+    parser.add_argument("--days", type=float, default=30, help="Giorni simulati")
+    parser.add_argument("--start", help="Inizio simulazione ISO (default: ora - giorni)")
+    parser.add_argument("--step", type=float, default=60, help="Secondi virtuali tra letture")
+    parser.add_argument("--seed", default="42", help="Seed degli stream casuali per sensore")
+    parser.add_argument("--events-per-hour", type=float, default=0.5,
+                        help="Eventi casuali (meteo, spostamento, manutenzione) per sensore all'ora")
+    parser.add_argument("--output", default="lp", choices=["lp", "mqtt"],
+                        help="lp: file line protocol giornalieri, mqtt: pubblicazione sul broker")
+    parser.add_argument("--out-dir", default="warp_data", help="Cartella dei file .lp")
+    parser.add_argument("--host", default="localhost", help="Broker MQTT")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--format", default="json", choices=PAYLOAD_FORMATS)
+    parser.add_argument("--profile", default="aggregate", choices=PUBLISH_PROFILES)
+    args = parser.parse_args()
+
+    duration = args.days * 86400
+    start = datetime.fromisoformat(args.start) if args.start else datetime.now() - timedelta(seconds=duration)
+
+    pool = None
+    if args.output == "mqtt":
+        pool = MQTTConnectionPool(args.host, args.port, args.connections, client_prefix="dive_warp")
+        if not pool.connect():
+            return
+
+    warp = WarpSimulator(
+        sites=args.sites,
+        depths=args.depths.split(","),
+        start=start,
+        step=args.step,
+        seed=args.seed,
+        events_per_hour=args.events_per_hour,
+        mqtt_pool=pool,
+        payload_format=args.format,
+        publish_profile=args.profile
+    )
+    print(f"🕒 {len(warp.sensors)} sensori, {args.days:g} giorni da {start:%Y-%m-%d %H:%M}, passo {args.step:g}s")
+
+    files = None
+    if pool:
+        output = warp.mqtt_output()
+    else:
+        files = LineProtocolFiles(args.out_dir)
+        output = warp.file_output(files)
+
+    started = time.monotonic()
+    try:
+        warp.run(duration, output)
+    except KeyboardInterrupt:
+        print("\n🛑 Simulazione interrotta dall'utente")
+    finally:
+        if pool:
+            pool.close()
+        if files:
+            files.close()
+
+    elapsed = max(time.monotonic() - started, 1e-9)
+    simulated = warp.clock.time() - start.timestamp()
+    print(f"\n📊 {warp.readings} letture in {elapsed:.1f}s ({warp.readings / elapsed:.0f}/s)")
+    print(f"   Tempo simulato: {simulated / 86400:.1f} giorni ({simulated / elapsed:.0f}x tempo reale)")
+    if files:
+        print(f"💾 {files.lines} righe in {len(files.files)} file in {args.out_dir}")
+        print(f"💡 Caricamento: influx write --bucket dive_data --file {args.out_dir}/dive_<giorno>.lp")
+
+
+if __name__ == "__main__":
+    main()